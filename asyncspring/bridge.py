@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Bridged users of a relay (Discord, Matrix, IRC, ...) kept on one lobby
+connection.
+
+A relay says everything through a Bridge instead of calling
+bridged_client_from, join_from and say_from for every message:
+
+    bridge = Bridge(client, max_users=5000, ttl=3600)
+    bridge.say("discord", author_id, author_name, "main", text)
+
+The bridge remembers which external users are bridged and which channels
+they are in, and only sends BRIDGECLIENTFROM, JOINFROM and LEAVEFROM when
+that changes. These, UNBRIDGECLIENTFROM and SAYFROM all go through the
+chat lane of the send queue, so they reach the server in the order they
+were made. Users idle for `ttl` seconds, or the least recently active
+ones beyond `max_users`, are unbridged. Once the connection logs in again
+after a reconnection, every bridged user and membership is sent again,
+followed by what was said while the connection was down (the last
+`max_pending` messages).
+"""
+
+import re
+import time
+import asyncio
+import logging
+import collections
+
+from asyncspring.sendqueue import CHAT
+
+log = logging.getLogger(__name__)
+
+_unsafe = re.compile("[^A-Za-z0-9]+")
+
+
+def sanitize(name):
+    """
+    The part of an external username the server accepts.
+    """
+
+    return _unsafe.sub("", str(name))
+
+
+class BridgedUser:
+    __slots__ = ("location", "external_id", "name", "channels", "last_seen")
+
+    def __init__(self, location, external_id, name, last_seen):
+        self.location = location
+        self.external_id = external_id
+        self.name = name
+        self.channels = set()
+        self.last_seen = last_seen
+
+    @property
+    def username(self):
+        """
+        The name the server shows this user under.
+        """
+
+        return "{}@{}".format(self.name, self.location)
+
+    def __repr__(self):
+        return "BridgedUser {} ({})".format(self.username, self.external_id)
+
+
+class Bridge:
+    """
+    Bridged identities and their channel memberships on one connection;
+    see the module documentation.
+    """
+
+    def __init__(self, client, max_users=None, ttl=None, max_pending=1000, clock=time.monotonic):
+        self.client = client
+        self.max_users = max_users
+        self.ttl = ttl
+        self.clock = clock
+
+        # (location, external_id) -> BridgedUser, least recently active first
+        self.users = collections.OrderedDict()
+        # (location, external_id, channel, text) said while offline
+        self.pending = collections.deque(maxlen=max_pending)
+        self.expiry_task = None
+
+        self.bridged = 0
+        self.unbridged = 0
+        self.joins = 0
+        self.leaves = 0
+        self.said = 0
+        self.evicted = 0
+        self.expired = 0
+        self.restores = 0
+
+        client.events.signal("accepted").connect(self._accepted, weak=False)
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, key):
+        return key in self.users
+
+    def _online(self):
+        client = self.client
+        return getattr(client, "work", False) and client.registration_complete
+
+    def _accepted(self, message):
+        # after a reconnection this is a new protocol, on the same event bus
+        self.client = message.client.wrapper or message.client
+        # once the channels the connection itself joins are queued
+        asyncio.get_event_loop().call_soon(self.restore)
+
+    def _bridge(self, user):
+        self.bridged += 1
+        self.client.writeln("BRIDGECLIENTFROM {} {} {}".format(user.location, user.external_id, user.name), CHAT)
+
+    def _join(self, user, channel):
+        self.joins += 1
+        self.client.writeln("JOINFROM {} {} {}".format(channel, user.location, user.external_id), CHAT)
+
+    def user(self, location, external_id, external_username):
+        """
+        Return the BridgedUser for an external user, bridging it first if
+        it is new or was renamed.
+        """
+
+        key = (location, external_id)
+        name = sanitize(external_username)
+        now = self.clock()
+        user = self.users.get(key)
+
+        if user is None:
+            user = self.users[key] = BridgedUser(location, external_id, name, now)
+            if self._online():
+                self._bridge(user)
+            if self.max_users is not None and len(self.users) > self.max_users:
+                self.evicted += 1
+                self.remove(*next(iter(self.users)))
+        else:
+            user.last_seen = now
+            self.users.move_to_end(key)
+            if user.name != name:
+                user.name = name
+                if self._online():
+                    self._bridge(user)
+
+        return user
+
+    def join(self, location, external_id, external_username, channel):
+        user = self.user(location, external_id, external_username)
+        if channel not in user.channels:
+            user.channels.add(channel)
+            if self._online():
+                self._join(user, channel)
+        return user
+
+    def leave(self, location, external_id, channel):
+        user = self.users.get((location, external_id))
+        if user is None or channel not in user.channels:
+            return
+        user.channels.discard(channel)
+        self.leaves += 1
+        if self._online():
+            self.client.writeln("LEAVEFROM {} {} {}".format(channel, location, external_id), CHAT)
+
+    def say(self, location, external_id, external_username, channel, text):
+        """
+        Say text in channel as an external user, bridging it and joining it
+        to channel first when needed.
+        """
+
+        user = self.join(location, external_id, external_username, channel)
+        self.said += 1
+        if self._online():
+            self.client.say_from(external_id, location, channel, text)
+        else:
+            # the server would not know the user yet, see restore()
+            self.pending.append((location, external_id, channel, text))
+        return user
+
+    def remove(self, location, external_id):
+        """
+        Unbridge an external user, which also takes it out of its channels.
+        """
+
+        user = self.users.pop((location, external_id), None)
+        if user is None:
+            return
+        self.unbridged += 1
+        if self._online():
+            self.client.writeln("UNBRIDGECLIENTFROM {} {}".format(location, external_id), CHAT)
+
+    def expire(self):
+        """
+        Unbridge the users idle for longer than ttl. Returns how many.
+        """
+
+        if self.ttl is None:
+            return 0
+
+        deadline = self.clock() - self.ttl
+        expired = []
+        for key, user in self.users.items():
+            if user.last_seen > deadline:
+                break
+            expired.append(key)
+
+        for key in expired:
+            self.remove(*key)
+        self.expired += len(expired)
+        return len(expired)
+
+    def start_expiry(self, interval=60):
+        """
+        Expire idle users every interval seconds.
+        """
+
+        async def run():
+            while True:
+                await asyncio.sleep(interval)
+                count = self.expire()
+                if count:
+                    log.debug("unbridged {} idle user(s)".format(count))
+
+        self.stop_expiry()
+        self.expiry_task = asyncio.ensure_future(run())
+        return self.expiry_task
+
+    def stop_expiry(self):
+        if self.expiry_task is not None:
+            self.expiry_task.cancel()
+            self.expiry_task = None
+
+    def restore(self):
+        """
+        Bridge every user and join every membership again, e.g. on a new
+        connection that knows none of them.
+        """
+
+        self.restores += 1
+        for user in self.users.values():
+            self._bridge(user)
+            for channel in user.channels:
+                self._join(user, channel)
+
+        pending, self.pending = self.pending, collections.deque(maxlen=self.pending.maxlen)
+        for location, external_id, channel, text in pending:
+            user = self.users.get((location, external_id))
+            if user is not None and channel in user.channels:
+                self.client.say_from(external_id, location, channel, text)
+
+    def close(self):
+        """
+        Unbridge everybody and stop following the connection.
+        """
+
+        self.stop_expiry()
+        for key in list(self.users):
+            self.remove(*key)
+        self.client.events.signal("accepted").disconnect(self._accepted)
+
+    def stats(self):
+        return {
+            "users": len(self.users),
+            "memberships": sum(len(user.channels) for user in self.users.values()),
+            "bridged": self.bridged,
+            "unbridged": self.unbridged,
+            "joins": self.joins,
+            "leaves": self.leaves,
+            "said": self.said,
+            "pending": len(self.pending),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "restores": self.restores,
+        }
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Wire traffic capture and replay.
+
+A Recorder set as LobbyProtocol.recorder stores every chunk the protocol
+receives (data_received) and sends (_write, _writelines), timestamped, in
+append-only segment files:
+
+    protocol.recorder = Recorder("captures/")
+
+A segment starts with MAGIC, followed by records of a RECORD header
+(timestamp as a double, direction, payload length) and the raw payload.
+Segments are rotated once they reach `segment_size` bytes, and the oldest
+are deleted beyond `max_segments`.
+
+A Capture reads segments back through mmap, and replay() feeds the
+received traffic of a capture to a LobbyProtocol at the recorded pace, N
+times faster, or as fast as possible:
+
+    await replay(Capture("captures/"), replay_protocol(), speed=10)
+
+or from a shell:
+
+    python -m asyncspring.capture info captures/
+    python -m asyncspring.capture replay captures/ --speed 0
+"""
+
+import os
+import glob
+import mmap
+import time
+import struct
+import asyncio
+import logging
+import argparse
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"ASWIRE1\n"
+RECORD = struct.Struct("<dBI")
+
+INBOUND = 0
+OUTBOUND = 1
+
+
+class Recorder:
+    """
+    Appends timestamped wire chunks to rotating segment files in directory.
+    """
+
+    def __init__(self, directory, prefix="wire", segment_size=64 * 1024 * 1024, max_segments=None,
+                 inbound=True, outbound=True, clock=time.time):
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.directions = {INBOUND: inbound, OUTBOUND: outbound}
+        self.clock = clock
+
+        self.file = None
+        self.size = 0
+        self.records = 0
+        self.bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        existing = segments(directory, prefix)
+        self.sequence = int(existing[-1].rsplit("-", 1)[1].split(".")[0]) if existing else 0
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+
+        self.sequence += 1
+        path = os.path.join(self.directory, "{}-{:06d}.wire".format(self.prefix, self.sequence))
+        self.file = open(path, "ab")
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+
+        if self.max_segments:
+            for old in segments(self.directory, self.prefix)[:-self.max_segments]:
+                os.remove(old)
+
+    def record(self, direction, data):
+        if not self.directions[direction]:
+            return
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+
+        if self.file is None or self.size >= self.segment_size:
+            self._rotate()
+
+        self.file.write(RECORD.pack(self.clock(), direction, len(data)))
+        self.file.write(data)
+        self.size += RECORD.size + len(data)
+        self.records += 1
+        self.bytes += len(data)
+
+    def record_many(self, direction, chunks):
+        """
+        Record chunks written out together as a single record.
+        """
+
+        if not self.directions[direction]:
+            return
+
+        if self.file is None or self.size >= self.segment_size:
+            self._rotate()
+
+        length = sum(len(chunk) for chunk in chunks)
+        self.file.write(RECORD.pack(self.clock(), direction, length))
+        self.file.writelines(chunks)
+        self.size += RECORD.size + length
+        self.records += 1
+        self.bytes += length
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def segments(directory, prefix="wire"):
+    return sorted(glob.glob(os.path.join(directory, "{}-*.wire".format(prefix))))
+
+
+def read_segment(path):
+    """
+    Yield (timestamp, direction, payload) for every record of a segment.
+    A record cut short by a crash ends the segment.
+    """
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[:len(MAGIC)] != MAGIC:
+                raise ValueError("{} is not a wire capture".format(path))
+
+            offset = len(MAGIC)
+            end = len(view)
+            unpack = RECORD.unpack_from
+            while offset + RECORD.size <= end:
+                timestamp, direction, length = unpack(view, offset)
+                offset += RECORD.size
+                if offset + length > end:
+                    log.warning("{}: truncated record at {}".format(path, offset - RECORD.size))
+                    return
+                yield timestamp, direction, view[offset:offset + length]
+                offset += length
+
+
+class Capture:
+    """
+    The records of a capture: a single segment file, or every segment of
+    a directory in order.
+    """
+
+    def __init__(self, path, prefix="wire"):
+        self.paths = [path] if os.path.isfile(path) else segments(path, prefix)
+
+    def __iter__(self):
+        for path in self.paths:
+            yield from read_segment(path)
+
+    def received(self):
+        return ((timestamp, data) for timestamp, direction, data in self if direction == INBOUND)
+
+    def lines(self, direction=INBOUND):
+        """
+        Yield (timestamp, line) for the complete lines sent one way.
+        """
+
+        pending = b""
+        for timestamp, record_direction, data in self:
+            if record_direction != direction:
+                continue
+            *complete, pending = (pending + data).split(b"\n")
+            for line in complete:
+                yield timestamp, line.rstrip(b"\r").decode("utf-8", "replace")
+
+    def info(self):
+        counts = {INBOUND: [0, 0], OUTBOUND: [0, 0]}
+        first = last = None
+        for timestamp, direction, data in self:
+            counts[direction][0] += 1
+            counts[direction][1] += len(data)
+            if first is None:
+                first = timestamp
+            last = timestamp
+        return {
+            "segments": len(self.paths),
+            "records_in": counts[INBOUND][0],
+            "bytes_in": counts[INBOUND][1],
+            "records_out": counts[OUTBOUND][0],
+            "bytes_out": counts[OUTBOUND][1],
+            "duration": last - first if first is not None else 0,
+        }
+
+
+class NullTransport(asyncio.Transport):
+    """
+    Swallows what a replayed protocol sends. While the protocol holds
+    reading (pause_reading), replay() stops feeding it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.written = 0
+        self.closing = False
+        self.reading = True
+        self.resumed = None
+
+    def write(self, data):
+        self.written += len(data)
+
+    def writelines(self, chunks):
+        for data in chunks:
+            self.written += len(data)
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    def abort(self):
+        self.closing = True
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def is_reading(self):
+        return self.reading
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+        if self.resumed is not None and not self.resumed.done():
+            self.resumed.set_result(None)
+        self.resumed = None
+
+    async def wait_reading(self):
+        while not self.reading:
+            if self.resumed is None:
+                self.resumed = asyncio.get_event_loop().create_future()
+            await self.resumed
+
+
+def replay_protocol(**kwargs):
+    """
+    A LobbyProtocol connected to a NullTransport, to replay captures into.
+    """
+
+    from asyncspring.protocol import LobbyProtocol
+
+    protocol = LobbyProtocol(**kwargs)
+    protocol.connection_made(NullTransport())
+    return protocol
+
+
+async def replay(capture, protocol, speed=1.0, batch=256):
+    """
+    Feed the received traffic of capture to protocol.data_received.
+
+    With speed 1 records arrive at the pace they were recorded, with speed
+    N N times faster; with speed 0 (or None) as fast as possible, letting
+    the event loop run every `batch` records. Returns replay statistics,
+    including how late records were delivered.
+    """
+
+    loop = asyncio.get_event_loop()
+    transport = protocol.transport if isinstance(protocol.transport, NullTransport) else None
+    records = received = 0
+    max_late = 0
+    first = None
+    start = loop.time()
+
+    for timestamp, data in capture.received():
+        if speed:
+            if first is None:
+                first = timestamp
+            due = start + (timestamp - first) / speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_late = max(max_late, -delay)
+        elif records % batch == 0:
+            await asyncio.sleep(0)
+
+        if transport is not None and not transport.reading:
+            await transport.wait_reading()
+        protocol.data_received(bytes(data))
+        records += 1
+        received += len(data)
+
+    await asyncio.sleep(0)
+    elapsed = loop.time() - start
+    return {
+        "records": records,
+        "bytes": received,
+        "seconds": elapsed,
+        "bytes_per_sec": received / elapsed if elapsed else 0,
+        "max_late": max_late,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay wire captures.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    info = commands.add_parser("info", help="summarise a capture")
+    info.add_argument("path")
+
+    dump = commands.add_parser("dump", help="print the lines of a capture")
+    dump.add_argument("path")
+    dump.add_argument("--outbound", action="store_true", help="print the sent lines instead")
+
+    play = commands.add_parser("replay", help="replay a capture into a LobbyProtocol")
+    play.add_argument("path")
+    play.add_argument("--speed", type=float, default=1.0, help="speed multiplier, 0 for as fast as possible")
+    play.add_argument("--plugins", default="", help="comma separated plugins to load first")
+
+    args = parser.parse_args()
+    capture = Capture(args.path)
+
+    if args.command == "info":
+        for key, value in capture.info().items():
+            print("{:>12}: {}".format(key, value))
+
+    elif args.command == "dump":
+        for timestamp, line in capture.lines(OUTBOUND if args.outbound else INBOUND):
+            print("{:.3f} {}".format(timestamp, line))
+
+    elif args.command == "replay":
+        import importlib
+        importlib.import_module("asyncspring.lobby")
+        for plugin in filter(None, args.plugins.split(",")):
+            importlib.import_module(plugin)
+
+        loop = asyncio.get_event_loop()
+        stats = loop.run_until_complete(replay(capture, replay_protocol(), args.speed))
+        for key, value in stats.items():
+            print("{:>14}: {}".format(key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Declarative description of the server -> client commands of the SpringRTS
+Lobby protocol, as implemented by uberserver.
+
+Each command is described by a spec string listing its fields in order:
+
+    name            a word, up to the next space
+    name:int        a word converted with int()
+    name:client     a word decoded as a ClientStatus bitfield
+    name:battle     a word decoded as a BattleStatus bitfield
+    {name}          a sentence, up to the next tab
+    {name...}       the rest of the line, spaces and tabs included
+    [...]           the field may be missing and defaults to None
+
+Words always come before sentences, so a line is decoded with at most two
+str.split calls. Decoders are built once, at import, into DECODERS, and
+turn the text after the verb into a namedtuple from RECORDS.
+"""
+
+import collections
+
+from asyncspring.status import ClientStatus, BattleStatus
+
+COMMANDS = {
+    # connection and login
+    "TASSERVER": "protocol_version engine_version udp_port:int server_mode:int",
+    "REGISTRATIONACCEPTED": "",
+    "REGISTRATIONDENIED": "[{reason...}]",
+    "ACCEPTED": "user_name",
+    "DENIED": "[{reason...}]",
+    "LOGININFOEND": "",
+    "AGREEMENT": "[{text...}]",
+    "AGREEMENTEND": "",
+    "MOTD": "[{message...}]",
+    "PONG": "",
+    "REDIRECT": "ip port:int",
+    "COMPFLAGS": "[{flags...}]",
+    "OK": "[{text...}]",
+    "FAILED": "[{text...}]",
+    "SERVERMSG": "[{message...}]",
+    "SERVERMSGBOX": "{message} [{url}]",
+
+    # users
+    "ADDUSER": "user_name country user_id:int [{lobby_id}]",
+    "REMOVEUSER": "user_name",
+    "CLIENTSTATUS": "user_name status:client",
+    "RING": "user_name",
+
+    # battles
+    "BATTLEOPENED": "battle_id:int type:int nat_type:int founder ip port:int max_players:int passworded:int "
+                    "rank:int map_hash:int {engine_name} {engine_version} {map_name} {title} {game_name} [{channel}]",
+    "BATTLECLOSED": "battle_id:int",
+    "UPDATEBATTLEINFO": "battle_id:int spectator_count:int locked:int map_hash:int {map_name}",
+    "JOINEDBATTLE": "battle_id:int user_name [script_password]",
+    "LEFTBATTLE": "battle_id:int user_name",
+    "JOINBATTLE": "battle_id:int hash_code:int [channel]",
+    "JOINBATTLEFAILED": "[{reason...}]",
+    "JOINBATTLEREQUEST": "user_name [ip]",
+    "OPENBATTLE": "battle_id:int",
+    "OPENBATTLEFAILED": "[{reason...}]",
+    "CLIENTBATTLESTATUS": "user_name status:battle team_color:int",
+    "REQUESTBATTLESTATUS": "",
+    "ADDBOT": "battle_id:int name owner status:battle team_color:int {ai_dll...}",
+    "REMOVEBOT": "battle_id:int name",
+    "UPDATEBOT": "battle_id:int name status:battle team_color:int",
+    "ADDSTARTRECT": "ally:int left:int top:int right:int bottom:int",
+    "REMOVESTARTRECT": "ally:int",
+    "SETSCRIPTTAGS": "[{tags...}]",
+    "REMOVESCRIPTTAGS": "[{keys...}]",
+    "ENABLEALLUNITS": "",
+    "HOSTPORT": "port:int",
+    "KICKFROMBATTLE": "battle_id:int user_name",
+    "FORCEQUITBATTLE": "",
+    "SAIDBATTLE": "user_name [{message...}]",
+    "SAIDBATTLEEX": "user_name [{message...}]",
+
+    # channels
+    "JOIN": "channel",
+    "JOINFAILED": "channel [{reason...}]",
+    "CHANNEL": "channel user_count:int [{topic...}]",
+    "ENDOFCHANNELS": "",
+    "CHANNELTOPIC": "channel author [{topic...}]",
+    "NOCHANNELTOPIC": "channel",
+    "CHANNELMESSAGE": "channel [{message...}]",
+    "CLIENTS": "channel [{clients...}]",
+    "JOINED": "channel user_name",
+    "LEFT": "channel user_name [{reason...}]",
+    "FORCELEAVECHANNEL": "channel user_name [{reason...}]",
+    "SAID": "channel user_name [{message...}]",
+    "SAIDEX": "channel user_name [{message...}]",
+    "MUTELISTBEGIN": "channel",
+    "MUTELIST": "[{entry...}]",
+    "MUTELISTEND": "",
+
+    # private messages
+    "SAIDPRIVATE": "user_name [{message...}]",
+    "SAIDPRIVATEEX": "user_name [{message...}]",
+    "SAYPRIVATE": "user_name [{message...}]",
+    "SAYPRIVATEEX": "user_name [{message...}]",
+
+    # friends and ignores
+    "FRIEND": "user_name",
+    "UNFRIEND": "user_name",
+    "FRIENDLISTBEGIN": "",
+    "FRIENDLIST": "user_name",
+    "FRIENDLISTEND": "",
+    "FRIENDREQUEST": "user_name",
+    "FRIENDREQUESTLISTBEGIN": "",
+    "FRIENDREQUESTLIST": "user_name",
+    "FRIENDREQUESTLISTEND": "",
+    "IGNORE": "user_name [{reason...}]",
+    "UNIGNORE": "user_name",
+    "IGNORELISTBEGIN": "",
+    "IGNORELIST": "user_name [{reason...}]",
+    "IGNORELISTEND": "",
+
+    # bridged clients
+    "BRIDGEDCLIENTFROM": "location external_id external_user_name",
+    "UNBRIDGEDCLIENTFROM": "location external_id external_user_name",
+    "JOINEDFROM": "channel bridge user_name",
+    "LEFTFROM": "channel user_name",
+    "SAIDFROM": "channel user_name [{message...}]",
+    "CLIENTSFROM": "channel bridge [{clients...}]",
+}
+
+WORD = "word"
+SENTENCE = "sentence"
+REST = "rest"
+
+CONVERTERS = {
+    "int": int,
+    "client": ClientStatus,
+    "battle": BattleStatus,
+}
+
+Field = collections.namedtuple("Field", "name kind convert optional")
+
+
+def parse_spec(spec):
+    """
+    Turn a spec string into a list of Fields.
+    """
+
+    fields = []
+    for token in spec.split():
+        optional = token.startswith("[")
+        token = token.strip("[]")
+
+        if token.startswith("{"):
+            name = token.strip("{}")
+            kind = SENTENCE
+            if name.endswith("..."):
+                name, kind = name[:-3], REST
+            fields.append(Field(name, kind, None, optional))
+        else:
+            name, _, conversion = token.partition(":")
+            fields.append(Field(name, WORD, CONVERTERS[conversion] if conversion else None, optional))
+
+    kinds = [field.kind for field in fields]
+    words = kinds.count(WORD)
+    if WORD in kinds[words:]:
+        raise ValueError("words must come before sentences: {}".format(spec))
+    if REST in kinds[:-1]:
+        raise ValueError("rest of line must be the last field: {}".format(spec))
+
+    return fields
+
+
+def record_name(verb):
+    return verb.capitalize()
+
+
+def compile_decoder(verb, spec):
+    """
+    Build the function decoding the text after verb into its record.
+    """
+
+    fields = parse_spec(spec)
+    record = collections.namedtuple(record_name(verb), [field.name for field in fields])
+    record.__qualname__ = record.__name__
+    record.verb = verb
+    record.fields = tuple(fields)
+
+    words = sum(1 for field in fields if field.kind == WORD)
+    sentences = len(fields) - words
+    required = sum(1 for field in fields if not field.optional)
+    conversions = tuple((i, field.convert) for i, field in enumerate(fields) if field.convert)
+    count = len(fields)
+    padding = (None,) * count
+    make = record._make
+
+    if not fields:
+        empty = record()
+
+        def decode(rest):
+            return empty
+
+    elif not sentences:
+        def decode(rest):
+            parts = rest.split(" ", words - 1) if rest else []
+            if len(parts) < count:
+                if len(parts) < required:
+                    raise ValueError("{}: expected {} fields, got {!r}".format(verb, required, rest))
+                parts += padding[len(parts):]
+            for i, convert in conversions:
+                if parts[i] is not None:
+                    parts[i] = convert(parts[i])
+            return make(parts)
+
+    else:
+        def decode(rest):
+            if not rest:
+                parts = []
+            elif words:
+                parts = rest.split(" ", words)
+                if len(parts) > words:
+                    parts[words:] = parts[words].split("\t", sentences - 1)
+            else:
+                parts = rest.split("\t", sentences - 1)
+            if len(parts) < count:
+                if len(parts) < required:
+                    raise ValueError("{}: expected {} fields, got {!r}".format(verb, required, rest))
+                parts += padding[len(parts):]
+            for i, convert in conversions:
+                if parts[i] is not None:
+                    parts[i] = convert(parts[i])
+            return make(parts)
+
+    decode.record = record
+    return decode
+
+
+DECODERS = {verb: compile_decoder(verb, spec) for verb, spec in COMMANDS.items()}
+RECORDS = {verb: decoder.record for verb, decoder in DECODERS.items()}
+
+
+def decode(verb, rest):
+    """
+    Decode the text after verb, or return None for commands not in COMMANDS.
+    """
+
+    decoder = DECODERS.get(verb)
+    if decoder is None:
+        return None
+    return decoder(rest)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import logging
+
+from asyncblink import signal
+
+log = logging.getLogger(__name__)
+
+# the signals created with asyncblink.signal, to look one up without
+# creating it
+signals = signal.__self__
+
+
+class Route:
+    """
+    Everything that has to run for one command verb, resolved when handlers
+    are registered rather than when a message arrives.
+    """
+
+    __slots__ = ("verb", "handlers", "signal")
+
+    def __init__(self, verb):
+        self.verb = verb
+        self.handlers = []
+        # kept for code connecting to "spring-<verb>" signals directly
+        self.signal = signal("spring-{}".format(verb.lower()))
+
+
+class Dispatcher:
+    """
+    Maps SpringRTS Lobby command verbs to their handlers.
+
+    Dispatching a message is a single dictionary lookup followed by calls to
+    the registered handlers. Verbs nobody registered for go to the fallback
+    handlers instead; either way, receivers connected to the matching
+    "spring-<verb>" signal are still notified.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.fallback = []
+
+    def route(self, verb):
+        verb = verb.upper()
+        try:
+            return self.routes[verb]
+        except KeyError:
+            return self.routes.setdefault(verb, Route(verb))
+
+    def register(self, verb, handler):
+        self.route(verb).handlers.append(handler)
+        return handler
+
+    def unregister(self, verb, handler):
+        self.route(verb).handlers.remove(handler)
+
+    def on(self, verb):
+        """
+        Decorator registering a handler for verb.
+        """
+
+        def process(f):
+            return self.register(verb, f)
+
+        return process
+
+    def dispatch(self, message):
+        route = self.routes.get(message.verb)
+        if route is None:
+            # no route for every verb the server makes up
+            for handler in self.fallback:
+                handler(message)
+            named = signals.get("spring-{}".format(message.verb.lower()))
+            if named is not None and named.receivers:
+                named.send(message)
+            return
+
+        handlers = route.handlers or self.fallback
+        for handler in handlers:
+            handler(message)
+
+        if route.signal.receivers:
+            route.signal.send(message)
+
+
+dispatcher = Dispatcher()
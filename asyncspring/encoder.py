@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Outgoing lines as bytes.
+
+Queued lines are kept encoded, terminator included, so a flush hands them
+to transport.writelines as they are. Command verbs are encoded once and
+cached, and fan_out() encodes a message body once for any number of
+targets.
+
+Messages longer than the server accepts are cut by split(), which works
+on the encoded text: chunks end at a space when there is one within the
+byte budget, and never inside a multibyte character.
+"""
+
+CRLF = b"\r\n"
+
+# bytes of message text in one line, and in the whole line with its command
+MAX_MESSAGE = 400
+MAX_LINE = 1024
+
+_verbs = {}
+
+
+def verb(name):
+    """
+    The encoded "VERB " prefix of a command.
+    """
+
+    prefix = _verbs.get(name)
+    if prefix is None:
+        prefix = _verbs[name] = name.encode("ascii") + b" "
+    return prefix
+
+
+def encode(line):
+    """
+    Encode a line (str, or bytes without terminator) for the wire.
+    """
+
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+    return line + CRLF
+
+
+def command(name, *params):
+    """
+    Encode a command from its verb and parameters.
+    """
+
+    if not params:
+        return name.encode("ascii") + CRLF
+    return verb(name) + " ".join(params).encode("utf-8") + CRLF
+
+
+def fan_out(name, targets, body):
+    """
+    Encode the same body sent by command name to every target, e.g.
+    fan_out("SAY", channels, message).
+    """
+
+    prefix = verb(name)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    tail = b" " + body + CRLF
+    return [prefix + target.encode("utf-8") + tail for target in targets]
+
+
+def _boundary(data, end):
+    """
+    Move end back to the start of the UTF-8 character it falls in.
+    """
+
+    while end > 0 and data[end] & 0xC0 == 0x80:
+        end -= 1
+    return end
+
+
+def split(body, budget=MAX_MESSAGE):
+    """
+    Yield the encoded chunks of body, each at most budget bytes, cut at the
+    last space that fits or else between two characters. The spaces chunks
+    are cut at are dropped.
+    """
+
+    data = body.encode("utf-8") if isinstance(body, str) else body
+    if budget < 4:
+        raise ValueError("budget of {} bytes cannot hold a character".format(budget))
+
+    start = 0
+    size = len(data)
+    while size - start > budget:
+        end = start + budget
+        cut = data.rfind(b" ", start + 1, end + 1)
+        if cut != -1:
+            yield data[start:cut]
+            start = cut + 1
+        else:
+            end = _boundary(data, end)
+            yield data[start:end]
+            start = end
+    if start < size:
+        yield data[start:]
+
+
+def budget(prefix_length):
+    """
+    How many bytes of message fit in a line after a prefix that long.
+    """
+
+    return min(MAX_MESSAGE, MAX_LINE - prefix_length - len(CRLF))
+
+
+def chunks(prefix, body):
+    """
+    Encode body as lines starting with the encoded prefix, e.g.
+    chunks(b"SAY main ", message).
+    """
+
+    for chunk in split(body, budget(len(prefix))):
+        yield prefix + chunk + CRLF
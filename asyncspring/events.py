@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+from asyncblink import Namespace
+
+
+class EventBus(Namespace):
+    """
+    Signals scoped to a single connection.
+
+    Every LobbyProtocol owns one, so handlers registered through
+    LobbyProtocol.on only run for that connection's traffic. Emitting an
+    event nobody on this connection subscribed to costs one dict lookup.
+    """
+
+    def emit(self, name, *args, **kwargs):
+        scoped = self.get(name)
+        if scoped is not None and scoped.receivers:
+            scoped.send(*args, **kwargs)
+
+
+def emit(bus, event, *args, **kwargs):
+    """
+    Send event, a process-wide signal, to the subscribers on bus and then to
+    the global subscribers, if there are any.
+    """
+
+    bus.emit(event.name, *args, **kwargs)
+    if event.receivers:
+        event.send(*args, **kwargs)
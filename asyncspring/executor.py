@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Running event handlers with bounded concurrency.
+
+asyncblink runs every coroutine handler as a new task for every event, so
+a burst of 5000 lines makes 5000 tasks running in no particular order. A
+HandlerExecutor instead queues handler calls and runs them on at most
+`concurrency` worker tasks. Calls that share a key (the same user, channel
+or battle, see by_user, by_channel and by_battle) run one at a time in the
+order their events arrived. Plain functions can be sent to a thread or
+process pool instead of running on the event loop.
+
+    executor = HandlerExecutor(concurrency=16)
+
+    @client.on("said", executor=executor, key=by_channel)
+    async def said(message, user, target, text):
+        ...
+"""
+
+import time
+import asyncio
+import logging
+import functools
+import collections
+import concurrent.futures
+
+from asyncspring.parser import LobbyMessage
+
+log = logging.getLogger(__name__)
+
+
+def by_user(message=None, **kwargs):
+    args = getattr(message, "args", None)
+    name = getattr(args, "user_name", None)
+    if name is None and message is not None:
+        name = message.source
+    return name
+
+
+def by_channel(message=None, **kwargs):
+    channel = kwargs.get("channel") or getattr(getattr(message, "args", None), "channel", None)
+    return channel or kwargs.get("target")
+
+
+def by_battle(message=None, **kwargs):
+    battle_id = getattr(getattr(message, "args", None), "battle_id", None)
+    if battle_id is None and message is not None:
+        battle_id = getattr(message.client, "battle_id", None)
+    return battle_id
+
+
+def _detach(value):
+    """
+    A copy of a handler argument that can be sent to another process.
+    """
+
+    if isinstance(value, LobbyMessage) and value.line is not None:
+        return LobbyMessage.from_message(value.line)
+    return value
+
+
+class Job:
+    __slots__ = ("handler", "args", "kwargs", "key", "queued")
+
+    def __init__(self, handler, args, kwargs, key, queued):
+        self.handler = handler
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.queued = queued
+
+
+class HandlerExecutor:
+    """
+    Queues handler calls and runs at most `concurrency` at a time, keeping
+    calls with the same key in order. With `pool` (a concurrent.futures
+    executor), plain function handlers run there. With `max_queue`, calls
+    beyond that many waiting are dropped.
+    """
+
+    def __init__(self, concurrency=64, pool=None, max_queue=None, history=1000):
+        self.concurrency = concurrency
+        self.pool = pool
+        self.max_queue = max_queue
+
+        self.ready = collections.deque()
+        self.waiting = {}
+        self.depth = 0
+        self.workers = 0
+        self.running = 0
+        self.idle = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.waits = collections.deque(maxlen=history)
+        self.runs = collections.deque(maxlen=history)
+
+    def __len__(self):
+        """
+        Handler calls queued and not started yet.
+        """
+
+        return self.depth
+
+    def wrap(self, handler, key=None):
+        """
+        Return a signal receiver that submits handler calls to this
+        executor; key, called with the same arguments as the handler, picks
+        the ordering key.
+        """
+
+        def receiver(*args, **kwargs):
+            self.submit(handler, args, kwargs, key(*args, **kwargs) if key is not None else None)
+
+        receiver.__name__ = getattr(handler, "__name__", "receiver")
+        return receiver
+
+    def submit(self, handler, args=(), kwargs=None, key=None):
+        if self.max_queue is not None and self.depth >= self.max_queue:
+            self.dropped += 1
+            return False
+
+        job = Job(handler, args, kwargs or {}, key, time.monotonic())
+        self.submitted += 1
+        self.depth += 1
+
+        if key is None:
+            self.ready.append(job)
+        elif key in self.waiting:
+            # a call with this key is queued or running
+            self.waiting[key].append(job)
+        else:
+            self.waiting[key] = collections.deque()
+            self.ready.append(job)
+
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+
+        self._spawn()
+        return True
+
+    def _spawn(self):
+        while self.workers < self.concurrency and self.workers < len(self.ready):
+            self.workers += 1
+            asyncio.ensure_future(self._work())
+
+    async def _work(self):
+        ran = 0
+        try:
+            while self.ready:
+                job = self.ready.popleft()
+                self.depth -= 1
+                try:
+                    await self._run(job)
+                finally:
+                    # even if cancelled, or the key's next job never runs
+                    self._done(job)
+                ran += 1
+                if not ran % 64:
+                    # plain handlers never yield to the loop by themselves
+                    await asyncio.sleep(0)
+        finally:
+            self.workers -= 1
+            # a cancelled worker leaves its jobs to a new one
+            self._spawn()
+            if not self.workers and self.idle is not None and not self.idle.done():
+                self.idle.set_result(None)
+
+    async def _run(self, job):
+        started = time.monotonic()
+        self.waits.append(started - job.queued)
+        self.running += 1
+        try:
+            if asyncio.iscoroutinefunction(job.handler):
+                await job.handler(*job.args, **job.kwargs)
+            elif self.pool is not None:
+                args, kwargs = job.args, job.kwargs
+                if isinstance(self.pool, concurrent.futures.ProcessPoolExecutor):
+                    args = [_detach(arg) for arg in args]
+                    kwargs = {key: _detach(value) for key, value in kwargs.items()}
+                call = functools.partial(job.handler, *args, **kwargs)
+                await asyncio.get_event_loop().run_in_executor(self.pool, call)
+            else:
+                job.handler(*job.args, **job.kwargs)
+            self.completed += 1
+        except asyncio.CancelledError:
+            self.failed += 1
+            log.warning("handler {} was cancelled".format(getattr(job.handler, "__name__", job.handler)))
+            raise
+        except Exception:
+            self.failed += 1
+            log.exception("handler {} failed".format(getattr(job.handler, "__name__", job.handler)))
+        finally:
+            self.running -= 1
+            self.runs.append(time.monotonic() - started)
+
+    def _done(self, job):
+        if job.key is None:
+            return
+        jobs = self.waiting[job.key]
+        if jobs:
+            self.ready.append(jobs.popleft())
+            self._spawn()
+        else:
+            del self.waiting[job.key]
+
+    async def join(self):
+        """
+        Wait until every queued handler call has run.
+        """
+
+        while self.workers:
+            self.idle = asyncio.get_event_loop().create_future()
+            await self.idle
+
+    @staticmethod
+    def _percentile(values, fraction):
+        if not values:
+            return 0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def stats(self):
+        return {
+            "queued": len(self),
+            "running": self.running,
+            "workers": self.workers,
+            "keys": len(self.waiting),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "max_depth": self.max_depth,
+            "wait_p50": self._percentile(self.waits, 0.5),
+            "wait_p99": self._percentile(self.waits, 0.99),
+            "run_p50": self._percentile(self.runs, 0.5),
+            "run_p99": self._percentile(self.runs, 0.99),
+        }
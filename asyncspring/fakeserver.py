@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+A stand-in SpringRTS lobby server, for load testing and benchmarking
+asyncspring offline.
+
+It speaks the part of the uberserver protocol a bot needs: TASSERVER,
+LOGIN/ACCEPTED/DENIED, PING/PONG, JOIN/LEAVE, SAY/SAYEX/SAYPRIVATE,
+JOINBATTLE/LEAVEBATTLE, MYSTATUS, the bridge commands (BRIDGECLIENTFROM,
+JOINFROM, LEAVEFROM, SAYFROM) and EXIT, and tags the direct replies to
+a command sent with a "#<id>" message ID. Every login gets the burst of a
+simulated lobby of `users` users and `battles` battles, chat storms can be
+run at a given rate, the server can read slowly to put backpressure on the
+clients, and connections can be dropped without warning.
+
+    server = FakeServer(users=5000, battles=200)
+    host, port = await server.start()
+    client = await lobby.connect(host, port)
+
+or from a shell:
+
+    python -m asyncspring.fakeserver --users 5000 --battles 200 --chat-rate 100
+"""
+
+import random
+import asyncio
+import logging
+import argparse
+import collections
+
+from asyncspring.framer import LineFramer
+
+log = logging.getLogger(__name__)
+
+COUNTRIES = ["US", "DE", "FR", "RU", "BR", "PL", "SE", "FI", "ES", "CN", "??"]
+LOBBIES = ["SpringLobby 0.270 (win x32)", "Chobby", "skylobby 0.9.1", "weblobby 2.1"]
+TITLES = ["1v1 no noobs", "team game", "winter FFA", "quick game", "spectators welcome"]
+MAPS = ["DeltaSiegeDry", "Comet Catcher Redux", "Tabula-v4", "Throne Acidic"]
+WORDS = ["gg", "hi", "anyone", "up", "for", "a", "game", "?", "lol", "nice", "map", "rehost", "ready"]
+
+
+class World:
+    """
+    The simulated lobby every login is shown: users, battles, statuses.
+    """
+
+    def __init__(self, users=0, battles=0, seed=1):
+        rnd = random.Random(seed)
+        self.rnd = rnd
+        self.users = ["user{}".format(i) for i in range(users)]
+        self.lines = []
+
+        for i, name in enumerate(self.users):
+            self.lines.append("ADDUSER {} {} {} {}".format(name, rnd.choice(COUNTRIES), i + 1, rnd.choice(LOBBIES)))
+
+        self.battles = min(battles, users)
+        for battle_id in range(1, self.battles + 1):
+            founder = self.users[battle_id - 1]
+            self.lines.append("BATTLEOPENED {} 0 0 {} 127.0.0.1 8452 16 0 0 {} Spring\t104.0\t{}\t{}\t"
+                              "Balanced Annihilation\t__battle__{}".format(
+                                  battle_id, founder, rnd.getrandbits(31), rnd.choice(MAPS),
+                                  rnd.choice(TITLES), battle_id))
+            self.lines.append("UPDATEBATTLEINFO {} 0 0 {} {}".format(battle_id, rnd.getrandbits(31), rnd.choice(MAPS)))
+
+        if self.battles:
+            for name in self.users[self.battles:]:
+                if rnd.random() < 0.3:
+                    self.lines.append("JOINEDBATTLE {} {}".format(rnd.randrange(1, self.battles + 1), name))
+
+        for name in self.users:
+            self.lines.append("CLIENTSTATUS {} {}".format(name, rnd.getrandbits(7)))
+
+        self.burst = "".join(line + "\n" for line in self.lines).encode("utf-8")
+
+    def chatter(self):
+        """
+        A random user and a line of chat.
+        """
+
+        rnd = self.rnd
+        name = rnd.choice(self.users) if self.users else "ChanServ"
+        return name, " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(1, 12)))
+
+
+class FakeSession(asyncio.Protocol):
+    """
+    One client connection to the FakeServer.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.framer = LineFramer()
+        self.username = None
+        self.channels = set()
+        self.battle_id = None
+        self.status = 0
+        self.reply_prefix = ""
+        # (location, external id) -> [bridged username, channels]
+        self.bridged = {}
+
+        self.lines_in = 0
+        self.paused = False
+
+    @property
+    def logged_in(self):
+        return self.username is not None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.sessions.add(self)
+        self.server.connections += 1
+        self.send("TASSERVER 0.38-33-ga5f3b28 * 8201 0")
+
+        if self.server.drop_after is not None:
+            self.server.loop.call_later(self.server.drop_after, self.drop)
+
+    def connection_lost(self, exc):
+        server = self.server
+        server.sessions.discard(self)
+        if self.logged_in:
+            server.logged_in.pop(self.username, None)
+            for channel in self.channels:
+                members = server.channels.get(channel)
+                if members is not None:
+                    members.discard(self)
+            server.broadcast("REMOVEUSER {}".format(self.username), server.logged_in.values())
+
+    def data_received(self, data):
+        server = self.server
+        if server.read_rate:
+            # read no faster than read_rate bytes per second
+            self.transport.pause_reading()
+            self.paused = True
+            server.loop.call_later(len(data) / server.read_rate, self.resume)
+
+        for line in self.framer.feed(data):
+            self.lines_in += 1
+            server.lines_in += 1
+            self.handle(line)
+
+    def resume(self):
+        if self.paused and not self.transport.is_closing():
+            self.paused = False
+            self.transport.resume_reading()
+
+    def send(self, line):
+        self.send_bytes((self.reply_prefix + line + "\n").encode("utf-8"))
+
+    def send_bytes(self, data):
+        if self.transport.is_closing():
+            return
+        self.server.lines_out += data.count(b"\n")
+        self.server.bytes_out += len(data)
+        self.transport.write(data)
+
+    def drop(self):
+        """
+        Close the connection abruptly, without EXIT.
+        """
+
+        if not self.transport.is_closing():
+            self.server.drops += 1
+            self.transport.abort()
+
+    def handle(self, line):
+        # replies to a command with a message ID carry the same ID
+        self.reply_prefix = ""
+        if line.startswith("#"):
+            msg_id, _, line = line.partition(" ")
+            self.reply_prefix = msg_id + " "
+
+        verb, _, rest = line.partition(" ")
+        handler = getattr(self, "on_" + verb.lower(), None)
+        if handler is None or (not self.logged_in and verb not in ("LOGIN", "PING", "EXIT")):
+            self.server.unknown += 1
+            if verb:
+                self.send("FAILED Unknown command {}".format(verb))
+        else:
+            handler(rest)
+        self.reply_prefix = ""
+
+    # commands
+
+    def on_ping(self, rest):
+        self.send("PONG")
+
+    def on_exit(self, rest):
+        self.transport.close()
+
+    def on_login(self, rest):
+        server = self.server
+        words = rest.split(" ", 2)
+        if len(words) < 2:
+            self.send("DENIED Bad command arguments")
+            return
+
+        username, password = words[0], words[1]
+        expected = server.passwords.get(username) if server.passwords is not None else password
+        if self.logged_in:
+            self.send("DENIED Already logged in")
+            return
+        if expected != password:
+            self.send("DENIED Invalid password")
+            return
+        if username in server.logged_in:
+            server.logged_in[username].drop()
+
+        self.username = username
+        server.logins += 1
+        server.logged_in[username] = self
+
+        self.send("ACCEPTED {}".format(username))
+        self.send("MOTD Welcome to the fake lobby")
+        adduser = "ADDUSER {} ?? {} asyncspring".format(username, len(server.world.users) + server.logins)
+        server.broadcast(adduser, server.logged_in.values(), exclude=self)
+        self.send_bytes(server.world.burst)
+        self.send_bytes(server.own_lines(exclude=self))
+        self.send(adduser)
+        self.send("LOGININFOEND")
+
+    def on_join(self, rest):
+        channel = rest.split(" ", 1)[0]
+        if not channel or channel.startswith("#"):
+            self.send("JOINFAILED {} Invalid channel name".format(channel))
+            return
+        if channel in self.channels:
+            return
+        members = self.server.channels[channel]
+        self.channels.add(channel)
+        self.server.broadcast("JOINED {} {}".format(channel, self.username), members)
+        members.add(self)
+
+        self.send("JOIN {}".format(channel))
+        self.send("CLIENTS {} {}".format(channel, " ".join(session.username for session in members)))
+
+    def on_leave(self, rest):
+        channel = rest.split(" ", 1)[0]
+        if channel not in self.channels:
+            return
+        self.channels.discard(channel)
+        members = self.server.channels[channel]
+        members.discard(self)
+        self.server.broadcast("LEFT {} {}".format(channel, self.username), members)
+
+    def _say(self, rest, verb):
+        channel, _, message = rest.partition(" ")
+        if channel in self.channels and message:
+            self.server.broadcast("{} {} {} {}".format(verb, channel, self.username, message),
+                                  self.server.channels[channel])
+
+    def on_say(self, rest):
+        self._say(rest, "SAID")
+
+    def on_sayex(self, rest):
+        self._say(rest, "SAIDEX")
+
+    def on_sayprivate(self, rest):
+        target, _, message = rest.partition(" ")
+        if not message:
+            return
+        session = self.server.logged_in.get(target)
+        if session is not None:
+            session.send("SAIDPRIVATE {} {}".format(self.username, message))
+        self.send("SAYPRIVATE {} {}".format(target, message))
+
+    def on_bridgeclientfrom(self, rest):
+        words = rest.split(" ")
+        if len(words) != 3 or not words[2]:
+            self.send("FAILED Bad command arguments")
+            return
+        location, external_id, name = words
+        bridged = self.bridged.setdefault((location, external_id), ["", set()])
+        bridged[0] = "{}@{}".format(name, location)
+        self.send("BRIDGEDCLIENTFROM {} {} {}".format(location, external_id, bridged[0]))
+
+    def on_unbridgeclientfrom(self, rest):
+        location, _, external_id = rest.partition(" ")
+        bridged = self.bridged.pop((location, external_id), None)
+        if bridged is None:
+            return
+        name, channels = bridged
+        for channel in channels:
+            self.server.broadcast("LEFTFROM {} {}".format(channel, name), self.server.channels[channel])
+        self.send("UNBRIDGEDCLIENTFROM {} {} {}".format(location, external_id, name))
+
+    def _bridged_member(self, channel, location, external_id):
+        bridged = self.bridged.get((location, external_id))
+        if bridged is None:
+            self.send("FAILED {} {} is not bridged".format(location, external_id))
+        elif channel not in self.channels:
+            self.send("FAILED Not in channel {}".format(channel))
+        else:
+            return bridged
+
+    def on_joinfrom(self, rest):
+        channel, location, external_id = (rest.split(" ") + ["", ""])[:3]
+        bridged = self._bridged_member(channel, location, external_id)
+        if bridged is not None and channel not in bridged[1]:
+            bridged[1].add(channel)
+            self.server.broadcast("JOINEDFROM {} {} {}".format(channel, location, bridged[0]),
+                                  self.server.channels[channel])
+
+    def on_leavefrom(self, rest):
+        channel, location, external_id = (rest.split(" ") + ["", ""])[:3]
+        bridged = self.bridged.get((location, external_id))
+        if bridged is not None and channel in bridged[1]:
+            bridged[1].discard(channel)
+            self.server.broadcast("LEFTFROM {} {}".format(channel, bridged[0]), self.server.channels[channel])
+
+    def on_sayfrom(self, rest):
+        channel, location, external_id, message = (rest.split(" ", 3) + ["", "", ""])[:4]
+        bridged = self._bridged_member(channel, location, external_id)
+        if bridged is None or not message:
+            return
+        if channel not in bridged[1]:
+            self.send("FAILED {} is not in {}".format(bridged[0], channel))
+            return
+        self.server.broadcast("SAIDFROM {} {} {}".format(channel, bridged[0], message),
+                              self.server.channels[channel])
+
+    def on_joinbattle(self, rest):
+        battle_id = rest.split(" ", 1)[0]
+        if not battle_id.isdigit() or not 0 < int(battle_id) <= self.server.world.battles:
+            self.send("JOINBATTLEFAILED No such battle")
+            return
+        self.battle_id = int(battle_id)
+        self.send("JOINBATTLE {} 0".format(battle_id))
+        self.server.broadcast("JOINEDBATTLE {} {}".format(battle_id, self.username), self.server.logged_in.values())
+
+    def on_leavebattle(self, rest):
+        if self.battle_id is None:
+            return
+        line = "LEFTBATTLE {} {}".format(self.battle_id, self.username)
+        self.battle_id = None
+        self.server.broadcast(line, self.server.logged_in.values())
+
+    def on_mystatus(self, rest):
+        if rest.isdigit():
+            self.status = int(rest)
+            self.server.broadcast("CLIENTSTATUS {} {}".format(self.username, self.status),
+                                  self.server.logged_in.values())
+
+
+class FakeServer:
+    """
+    Stand-in lobby server; see the module documentation.
+
+    `passwords` maps usernames to the password (as sent on the wire) they
+    must log in with; by default every login is accepted. With `read_rate`
+    set, every connection is read at no more than that many bytes per
+    second. With `drop_after` set, every connection is aborted that many
+    seconds after it is made.
+    """
+
+    def __init__(self, users=0, battles=0, seed=1, passwords=None, read_rate=None, drop_after=None):
+        self.world = World(users, battles, seed)
+        self.passwords = passwords
+        self.read_rate = read_rate
+        self.drop_after = drop_after
+
+        self.loop = None
+        self.server = None
+        self.sessions = set()
+        self.logged_in = {}
+        self.channels = collections.defaultdict(set)
+        self.storms = []
+
+        self.connections = 0
+        self.logins = 0
+        self.drops = 0
+        self.unknown = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.bytes_out = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Start listening. Returns the (host, port) actually bound.
+        """
+
+        self.loop = asyncio.get_event_loop()
+        self.server = await self.loop.create_server(lambda: FakeSession(self), host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        for storm in self.storms:
+            storm.cancel()
+        self.storms = []
+        for session in list(self.sessions):
+            session.transport.abort()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def broadcast(self, line, sessions, exclude=None):
+        data = (line + "\n").encode("utf-8")
+        for session in sessions:
+            if session is not exclude:
+                session.send_bytes(data)
+
+    def own_lines(self, exclude=None):
+        """
+        ADDUSER lines for the real clients logged in, as part of a burst.
+        """
+
+        lines = ["ADDUSER {} ?? 0 asyncspring\n".format(session.username)
+                 for session in self.logged_in.values() if session is not exclude]
+        return "".join(lines).encode("utf-8")
+
+    # load
+
+    def chat_storm(self, rate, channel=None, duration=None, tick=0.01):
+        """
+        Send rate SAID lines per second from simulated users to channel (or
+        SAIDPRIVATE lines to every client when channel is None), for
+        duration seconds or until close(). Returns the task.
+        """
+
+        async def run():
+            start = self.loop.time()
+            sent = 0
+            while duration is None or self.loop.time() - start < duration:
+                await asyncio.sleep(tick)
+                due = int((self.loop.time() - start) * rate) - sent
+                for _ in range(due):
+                    user, message = self.world.chatter()
+                    if channel is None:
+                        for session in list(self.logged_in.values()):
+                            session.send("SAIDPRIVATE {} {}".format(user, message))
+                    else:
+                        self.broadcast("SAID {} {} {}".format(channel, user, message), self.channels[channel])
+                sent += due
+
+        task = asyncio.ensure_future(run())
+        self.storms.append(task)
+        return task
+
+    def drop(self, fraction=1.0, rnd=random.random):
+        """
+        Abort a random fraction of the connections. Returns how many.
+        """
+
+        dropped = [session for session in list(self.sessions) if rnd() < fraction]
+        for session in dropped:
+            session.drop()
+        return len(dropped)
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "logged_in": len(self.logged_in),
+            "connections": self.connections,
+            "logins": self.logins,
+            "drops": self.drops,
+            "unknown": self.unknown,
+            "lines_in": self.lines_in,
+            "lines_out": self.lines_out,
+            "bytes_out": self.bytes_out,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in SpringRTS lobby server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--battles", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--chat-rate", type=float, default=0, help="SAID lines per second")
+    parser.add_argument("--chat-channel", default="main")
+    parser.add_argument("--read-rate", type=float, default=None, help="bytes per second read from each client")
+    parser.add_argument("--drop-after", type=float, default=None, help="abort connections after this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    server = FakeServer(args.users, args.battles, args.seed, read_rate=args.read_rate, drop_after=args.drop_after)
+    host, port = loop.run_until_complete(server.start(args.host, args.port))
+    log.info("listening on {}:{}".format(host, port))
+    if args.chat_rate:
+        server.chat_storm(args.chat_rate, args.chat_channel)
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info(server.stats())
+        loop.run_until_complete(server.close())
+
+
+if __name__ == "__main__":
+    main()
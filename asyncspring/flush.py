@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class FlushScheduler:
+    """
+    Decides when the pending messages queue (a SendQueue) of a LobbyProtocol
+    is written to the transport.
+
+    A message queued on an idle link is sent on the next loop iteration, so
+    everything written in the same callback still goes out in one write.
+    Under load, flushes are spaced at least `window` seconds apart and each
+    one sends everything queued since the previous flush.
+
+    While the transport is paused (its buffer went over `high_water`) nothing
+    is flushed; the queue is picked up again once it drains below `low_water`.
+    When the queue's send budget runs out, the next flush waits until there
+    are enough tokens for another line.
+    """
+
+    def __init__(self, protocol, window=0.05, high_water=64 * 1024, low_water=16 * 1024):
+        self.protocol = protocol
+        self.window = window
+        self.high_water = high_water
+        self.low_water = low_water
+
+        self.loop = None
+        self.handle = None
+        self.paused = False
+        self.last_flush = float('-inf')
+        self.pending_since = None
+
+        self.flushes = 0
+        self.messages_sent = 0
+        self.pauses = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self.total_latency = 0
+
+    def attach(self, loop, transport):
+        """
+        Start scheduling flushes for a freshly made connection.
+        """
+
+        self.close()
+        self.loop = loop
+        self.paused = False
+        self.last_flush = float('-inf')
+
+        if hasattr(transport, "set_write_buffer_limits"):
+            transport.set_write_buffer_limits(high=self.high_water, low=self.low_water)
+
+        if self.protocol.queue:
+            self.notify()
+
+    def close(self):
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+
+    @property
+    def depth(self):
+        return len(self.protocol.queue)
+
+    def notify(self):
+        """
+        Called whenever a message is queued.
+        """
+
+        if self.loop is None:
+            # not attached to a connection yet, attach() picks the queue up
+            return
+
+        if self.pending_since is None:
+            self.pending_since = self.loop.time()
+
+        if self.handle or self.paused or not self.protocol.work:
+            return
+
+        delay = self.last_flush + self.window - self.loop.time()
+        if delay > 0:
+            self.handle = self.loop.call_later(delay, self.flush)
+        else:
+            self.handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """
+        Write out everything queued so far.
+        """
+
+        self.handle = None
+
+        if self.paused or not self.protocol.work:
+            return
+
+        queue = self.protocol.queue
+        if not queue:
+            return
+
+        now = self.loop.time()
+        batch = queue.pop_batch()
+        if not batch:
+            # out of send budget, come back when there is enough for one line
+            self.handle = self.loop.call_later(max(queue.delay(), self.window), self.flush)
+            return
+
+        count = len(batch)
+        self.protocol._writelines(batch)
+
+        latency = now - self.pending_since if self.pending_since is not None else 0
+        self.pending_since = now if queue else None
+        self.last_flush = now
+
+        if queue:
+            self.handle = self.loop.call_later(max(queue.delay(), self.window), self.flush)
+
+        self.flushes += 1
+        self.messages_sent += count
+        self.last_latency = latency
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def pause(self):
+        log.debug("Transport paused with {} queued messages".format(self.depth))
+        self.paused = True
+        self.pauses += 1
+        self.close()
+
+    def resume(self):
+        log.debug("Transport resumed with {} queued messages".format(self.depth))
+        self.paused = False
+        if self.protocol.queue:
+            self.notify()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "lanes": self.protocol.queue.stats(),
+            "paused": self.paused,
+            "flushes": self.flushes,
+            "messages_sent": self.messages_sent,
+            "pauses": self.pauses,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+            "avg_latency": self.total_latency / self.flushes if self.flushes else 0,
+        }
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_LINE_LENGTH = 64 * 1024
+
+
+class LineFramer:
+    """
+    Splits the byte stream coming from SpringRTS Lobby into text lines.
+
+    Incoming bytes are appended to a bytearray and only the newly received
+    bytes are scanned for a line terminator. Every complete line is decoded
+    exactly once, so a multibyte UTF-8 character split across two reads is
+    decoded correctly once the rest of it arrives.
+
+    Lines are stripped of surrounding whitespace (CR included) and empty
+    ones skipped. Lines longer than max_line_length bytes are dropped and
+    counted in `dropped`.
+    """
+
+    def __init__(self, max_line_length=DEFAULT_MAX_LINE_LENGTH, encoding="utf-8"):
+        self.max_line_length = max_line_length
+        self.encoding = encoding
+        self.buf = bytearray()
+        self.discarding = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.buf)
+
+    def reset(self):
+        self.buf.clear()
+        self.discarding = False
+
+    def feed(self, data):
+        """
+        Add a chunk of received bytes and return the list of complete lines.
+        """
+
+        buf = self.buf
+        scanned = len(buf)
+        buf += data
+
+        end = buf.rfind(b"\n", scanned)
+        if end == -1:
+            if self.max_line_length and len(buf) > self.max_line_length:
+                self._overflow()
+            return []
+
+        limit = self.max_line_length
+        with memoryview(buf) as view:
+            lines = str(view[:end], self.encoding, "replace").split("\n")
+            sizes = None
+            # a UTF-8 character is at most 4 bytes, so shorter lines can't be
+            # over the limit in bytes
+            if limit and max(map(len, lines)) > limit // 4:
+                sizes = [len(line) for line in bytes(view[:end]).split(b"\n")]
+        del buf[:end + 1]
+
+        if self.discarding:
+            # tail of a line whose head was already thrown away
+            self.discarding = False
+            self.dropped += 1
+            del lines[0]
+            if sizes is not None:
+                del sizes[0]
+
+        if sizes is not None and max(sizes, default=0) > limit:
+            kept = [line for line, size in zip(lines, sizes) if size <= limit]
+            self.dropped += len(lines) - len(kept)
+            log.warning("Dropped {} line(s) longer than {} bytes".format(len(lines) - len(kept), limit))
+            lines = kept
+
+        lines = [line.strip() for line in lines]
+        if "" in lines:
+            lines = [line for line in lines if line]
+
+        if limit and len(buf) > limit:
+            self._overflow()
+
+        return lines
+
+    def _overflow(self):
+        log.warning("Dropping line longer than {} bytes".format(self.max_line_length))
+        self.buf.clear()
+        self.discarding = True
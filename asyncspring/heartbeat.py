@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import time
+import heapq
+import asyncio
+import logging
+import collections
+
+log = logging.getLogger(__name__)
+
+
+class Beat:
+    """
+    Heartbeat bookkeeping for one connection.
+    """
+
+    __slots__ = ("client", "due", "last_ping", "last_pong", "history")
+
+    def __init__(self, client, now, history):
+        self.client = client
+        self.due = now
+        self.last_ping = None
+        self.last_pong = now
+        self.history = collections.deque(maxlen=history)
+
+    @property
+    def lag(self):
+        return self.history[-1] if self.history else None
+
+
+class Heartbeat:
+    """
+    Pings every registered connection from a single timer.
+
+    Pending pings are kept in a heap ordered by due time, and only the
+    earliest one has a loop timer armed, however many connections there
+    are. A connection that has not answered for `timeout` seconds is
+    aborted, so a dead link is noticed at most timeout + interval seconds
+    after its last PONG.
+    """
+
+    def __init__(self, interval=29, timeout=90, history=20):
+        self.interval = interval
+        self.timeout = timeout
+        self.history = history
+
+        self.loop = None
+        self.handle = None
+        self.handle_due = None
+        self.heap = []
+        self.beats = {}
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.beats)
+
+    def __contains__(self, client):
+        return client in self.beats
+
+    def add(self, client):
+        """
+        Start pinging client; the first PING goes out right away.
+        """
+
+        if not self.beats:
+            # idle until now, possibly on another loop
+            if self.handle:
+                self.handle.cancel()
+                self.handle = self.handle_due = None
+            self.heap.clear()
+            self.loop = asyncio.get_event_loop()
+
+        beat = self.beats[client] = Beat(client, self.loop.time(), self.history)
+        self._push(beat)
+        return beat
+
+    def remove(self, client):
+        """
+        Stop pinging client. Its heap entry is dropped when it comes up.
+        """
+
+        self.beats.pop(client, None)
+        if not self.beats and self.handle:
+            self.handle.cancel()
+            self.handle = self.handle_due = None
+
+    def pong(self, client):
+        """
+        Record a PONG from client and return the measured lag.
+        """
+
+        beat = self.beats.get(client)
+        if beat is None or beat.last_ping is None:
+            return None
+
+        now = self.loop.time()
+        beat.last_pong = now
+        lag = now - beat.last_ping
+        beat.history.append(lag)
+        return lag
+
+    def lag_history(self, client):
+        beat = self.beats.get(client)
+        return list(beat.history) if beat else []
+
+    def _push(self, beat):
+        self.counter += 1
+        heapq.heappush(self.heap, (beat.due, self.counter, beat))
+        self._arm()
+
+    def _arm(self):
+        if not self.heap:
+            return
+
+        due = self.heap[0][0]
+        if self.handle and self.handle_due <= due:
+            return
+
+        if self.handle:
+            self.handle.cancel()
+        self.handle_due = due
+        self.handle = self.loop.call_at(due, self._tick)
+
+    def _tick(self):
+        self.handle = self.handle_due = None
+        now = self.loop.time()
+        heap = self.heap
+
+        while heap and heap[0][0] <= now:
+            due, counter, beat = heapq.heappop(heap)
+            client = beat.client
+            if self.beats.get(client) is not beat:
+                continue
+
+            if not client.work:
+                del self.beats[client]
+                continue
+
+            if now - beat.last_pong > self.timeout:
+                log.warning("No PONG for {:.1f}s, dropping connection".format(now - beat.last_pong))
+                del self.beats[client]
+                self._drop(client)
+                continue
+
+            client.ping()
+            client.last_ping = time.time()
+            beat.last_ping = now
+            beat.due = now + self.interval
+            self.counter += 1
+            heapq.heappush(heap, (beat.due, self.counter, beat))
+
+        self._arm()
+
+    @staticmethod
+    def _drop(client):
+        if client.transport:
+            client.transport.abort()
+        else:
+            client.connection_lost(Exception())
@@ -7,20 +7,25 @@ import logging
 from asyncblink import signal
 
 from asyncspring.protocol import LobbyProtocolWrapper, LobbyProtocol, connections
+from asyncspring.reconnect import ReconnectManager
 
 loop = asyncio.get_event_loop()
 
 log = logging.getLogger(__name__)
 
 
-async def connect(server, port=8200, use_ssl=False):
+async def connect(server, port=8200, use_ssl=False, flood_class=None):
     """
     Connect to an SpringRTS Lobby server. Returns a proxy to an LobbyProtocol object.
+
+    flood_class picks the server flood limits to send at (see
+    sendqueue.FLOOD_LIMITS); by default they follow the account's status.
     """
     protocol = None
     while protocol is None:
         try:
-            transport, protocol = await loop.create_connection(LobbyProtocol, host=server, port=port, ssl=use_ssl)
+            transport, protocol = await asyncio.get_event_loop().create_connection(
+                lambda: LobbyProtocol(flood_class=flood_class), host=server, port=port, ssl=use_ssl)
         except ConnectionRefusedError as conn_error:
             log.info("HOST DOWN! retry in 10 secs {}".format(conn_error))
             await asyncio.sleep(10)
@@ -39,24 +44,17 @@ async def connect(server, port=8200, use_ssl=False):
     return protocol.wrapper
 
 
-async def reconnect(client_wrapper):
-    protocol = None
-    server_info = client_wrapper.server_info
-
-    log.info("reconnecting")
-    while protocol is None:
-        await asyncio.sleep(10)
-        try:
-            transport, protocol = await loop.create_connection(LobbyProtocol, **server_info)
-            client_wrapper.protocol = protocol
+reconnector = ReconnectManager()
 
-            signal("netid-available").send(protocol)
 
-            signal("reconnected").send()
+async def reconnect(client_wrapper):
+    """
+    Reconnect a lost connection with the module's ReconnectManager.
+    """
+    if client_wrapper is None or not client_wrapper.autoreconnect:
+        return
 
-        except ConnectionRefusedError as conn_error:
-            pass
-            log.info("HOST DOWN! retry in 10 secs {}".format(conn_error))
+    await reconnector.reconnect(client_wrapper)
 
 
 signal("connection-lost").connect(reconnect)
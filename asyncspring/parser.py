@@ -22,34 +22,62 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import logging
 
+from asyncspring.commands import DECODERS
+
 log = logging.getLogger(__name__)
 
 
+SOURCE_PARAM = {
+    "SAID": 1,
+    "SAIDEX": 1,
+    "SAIDPRIVATE": 0,
+    "SAIDPRIVATEEX": 0,
+}
+
+
 class LobbyMessage:
     """
     Represents an Lobby message.
+
+    A leading "#<id> " message ID, by which the server tags the replies to
+    a command sent with one, is split off into msg_id. Only the verb is
+    split off when a line is parsed. Parameters, the tab separated
+    sentences and the source are worked out from the raw line the first
+    time they are accessed, so messages no handler looks at cost very
+    little.
     """
 
+    __slots__ = ("line", "verb", "client", "msg_id", "_start", "_params", "_sentences", "_source", "_tags", "_args")
+
+    def __init__(self, line=None, verb=None, start=None, tags=None, msg_id=None):
+        self.line = line
+        self.verb = verb
+        self.client = None
+        self.msg_id = msg_id
+        self._start = start
+        self._params = None
+        self._sentences = None
+        self._source = None
+        self._tags = tags
+        self._args = None
+
     @classmethod
     def from_data(cls, verb, params=None, source=None, tags=None):
         """
         Create a new RFC1459Message from the given verb, parameters, and source
         having the given tags.
         """
-        o = cls()
-        o.verb = verb
-        o.tags = dict()
-        o.source = None
-        o.params = list()
+        o = cls(verb=verb, tags=dict())
+        o._params = list()
 
         if params:
-            o.params = params
+            o._params = params
 
         if source:
-            o.source = source
+            o._source = source
 
         if tags:
-            o.tags.update(**tags)
+            o._tags.update(**tags)
 
         return o
 
@@ -62,37 +90,92 @@ class LobbyMessage:
         if isinstance(message, bytes):
             message = message.decode('UTF-8', 'replace')
 
-        s = message.split(' ')
-
         tags = None
-        if s[0].startswith('@'):
-            tag_str = s[0][1:].split(';')
-            s = s[1:]
-            tags = {}
-
-            for tag in tag_str:
-                k, v = tag.split('=', 1)
-                tags[k] = v
-
-        source = "Lobby"
-        if s[0] == 'SAID' or s[0] == 'SAIDEX':
-            source = s[2]
-        elif s[0] == 'SAIDPRIVATE' or s[0] == 'SAIDPRIVATEEX':
-            source = s[1]
-
-        verb = s[0].upper()
-        params = s[1:]
-
-        # for param in params:
-        #     if param.startswith(':'):
-        #         idx = params.index(param)
-        #         arg = ' '.join(params[idx:])
-        #         arg = arg[1:]
-        #         params = params[:idx]
-        #         params.append(arg)
-        #         break
-
-        return cls.from_data(verb, params, source, tags)
+        if message.startswith('@'):
+            tags, _, message = message[1:].partition(' ')
+
+        msg_id = None
+        if message.startswith('#'):
+            index = message.find(' ')
+            if index > 1 and message[1:index].isdigit():
+                msg_id = int(message[1:index])
+                message = message[index + 1:]
+
+        index = message.find(' ')
+        if index == -1:
+            return cls(message, message.upper(), len(message), tags, msg_id)
+        return cls(message, message[:index].upper(), index + 1, tags, msg_id)
+
+    @property
+    def rest(self):
+        """
+        Everything after the verb, as received.
+        """
+
+        if self.line is None:
+            return " ".join(self._params)
+        return self.line[self._start:]
+
+    @property
+    def params(self):
+        if self._params is None:
+            rest = self.line[self._start:]
+            self._params = rest.split(' ') if rest else []
+        return self._params
+
+    @params.setter
+    def params(self, value):
+        self._params = value
+
+    @property
+    def sentences(self):
+        """
+        The parameters split on tabs rather than spaces.
+        """
+
+        if self._sentences is None:
+            rest = self.rest
+            self._sentences = rest.split('\t') if rest else []
+        return self._sentences
+
+    @property
+    def args(self):
+        """
+        The fields of the command as a typed record (see commands.COMMANDS),
+        or None for commands without a schema.
+        """
+
+        if self._args is None:
+            decoder = DECODERS.get(self.verb)
+            if decoder is None:
+                return None
+            self._args = decoder(self.rest)
+        return self._args
+
+    @property
+    def source(self):
+        if self._source is None:
+            index = SOURCE_PARAM.get(self.verb)
+            self._source = "Lobby" if index is None else self.params[index]
+        return self._source
+
+    @source.setter
+    def source(self, value):
+        self._source = value
+
+    @property
+    def tags(self):
+        if not isinstance(self._tags, dict):
+            tag_str, self._tags = self._tags, {}
+            if tag_str:
+                for tag in tag_str.split(';'):
+                    k, v = tag.split('=', 1)
+                    self._tags[k] = v
+        return self._tags
+
+    @tags.setter
+    def tags(self, value):
+        self._tags = value
 
     def __str__(self):
         return "LobbyMessage: verb={}, params={}, source={}".format(self.verb, self.params, self.source)
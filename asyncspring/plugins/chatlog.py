@@ -0,0 +1,730 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Searchable archive of lobby chat on disk.
+
+Once a store is opened, every SAID, SAIDEX, SAIDPRIVATE, SAIDPRIVATEEX
+and SAIDFROM received by any connection is appended to it:
+
+    from asyncspring.plugins import chatlog
+
+    chatlog.open_store("chatlogs/")
+    chatlog.store.search(user="bob", channel="main", start=time.time() - 7 * 86400)
+    chatlog.store.search(words=["cheater"])
+
+Messages go to append-only segment files: SEGMENT_MAGIC, then records of a
+RECORD header (timestamp, kind, channel, user and text lengths) followed by
+the UTF-8 channel (the receiving account for private messages), user and
+text. While a segment is written its indexes are kept in memory, and when
+it is full they are written next to it as an index file, from an executor
+thread when an event loop is running:
+
+    - a time index: the timestamp and offset of every INDEX_EVERY-th record
+    - an inverted index: for every term ("u:" user, "c:" channel, "w:" word
+      of the text, lower cased) the offsets of the records that have it,
+      with the terms sorted so a lookup is a binary search
+
+Segments and index files are read through mmap, so a search only touches
+the pages of the postings and records it needs. A segment left without an
+index by a crash is indexed again when the store is opened, and written
+on from there.
+
+or from a shell:
+
+    python -m asyncspring.plugins.chatlog info chatlogs/
+    python -m asyncspring.plugins.chatlog search chatlogs/ cheater --user bob --days 7
+"""
+
+import os
+import re
+import mmap
+import glob
+import time
+import array
+import struct
+import asyncio
+import logging
+import argparse
+import collections
+
+from asyncblink import signal
+
+log = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b"ASCHAT1\n"
+INDEX_MAGIC = b"ASCHATX1"
+
+RECORD = struct.Struct("<dBBBH")
+TIME_ENTRY = struct.Struct("<dI")
+INDEX_HEADER = struct.Struct("<8sddIIII")
+OFFSET = struct.Struct("<I")
+
+INDEX_EVERY = 64
+
+_big_endian = struct.pack("=I", 1) != struct.pack("<I", 1)
+
+SAID = 0
+SAIDEX = 1
+PRIVATE = 2
+PRIVATEEX = 3
+
+_words = re.compile(r"\w+")
+
+LogEntry = collections.namedtuple("LogEntry", "stamp kind channel user text")
+
+
+def terms(channel, user, text):
+    """
+    The index terms of a message.
+    """
+
+    found = {"c:" + channel, "u:" + user}
+    for word in _words.findall(text.lower()):
+        if len(word) <= 64:
+            found.add("w:" + word)
+    return found
+
+
+def read_record(view, offset):
+    """
+    Return the entry stored at offset and the offset of the next one.
+    """
+
+    stamp, kind, channel_length, user_length, text_length = RECORD.unpack_from(view, offset)
+    start = offset + RECORD.size
+    user_start = start + channel_length
+    text_start = user_start + user_length
+    end = text_start + text_length
+    entry = LogEntry(stamp, kind, view[start:user_start].decode("utf-8", "replace"),
+                     view[user_start:text_start].decode("utf-8", "replace"),
+                     view[text_start:end].decode("utf-8", "replace"))
+    return entry, end
+
+
+def scan(view, offset=len(SEGMENT_MAGIC)):
+    """
+    Yield (offset, entry, next offset) for the records of a segment from
+    offset on. A record cut short by a crash ends the segment.
+    """
+
+    end = len(view)
+    while offset + RECORD.size <= end:
+        header = RECORD.unpack_from(view, offset)
+        if offset + RECORD.size + header[2] + header[3] + header[4] > end:
+            log.warning("truncated chat log record at {}".format(offset))
+            return
+        entry, next_offset = read_record(view, offset)
+        yield offset, entry, next_offset
+        offset = next_offset
+
+
+class MemoryIndex:
+    """
+    The indexes of the segment being written.
+    """
+
+    def __init__(self):
+        self.times = []
+        self.offsets = array.array("I")
+        self.postings = collections.defaultdict(lambda: array.array("I"))
+        self.first = None
+        self.last = None
+        self.records = 0
+
+    def add(self, offset, entry):
+        if self.records % INDEX_EVERY == 0:
+            self.times.append(entry.stamp)
+            self.offsets.append(offset)
+        if self.first is None:
+            self.first = entry.stamp
+        self.last = entry.stamp
+        self.records += 1
+
+        for term in terms(entry.channel, entry.user, entry.text):
+            self.postings[term].append(offset)
+
+    def lookup(self, term):
+        return self.postings.get(term, ())
+
+    def offset_at(self, stamp):
+        """
+        An offset at or before the first record at stamp.
+        """
+
+        position = _bisect(self.times, stamp)
+        return self.offsets[position - 1] if position else len(SEGMENT_MAGIC)
+
+    def write(self, path):
+        ordered = sorted((term.encode("utf-8"), postings) for term, postings in self.postings.items())
+
+        term_offsets = array.array("I", [0])
+        posting_offsets = array.array("I", [0])
+        for term, postings in ordered:
+            term_offsets.append(term_offsets[-1] + len(term))
+            posting_offsets.append(posting_offsets[-1] + len(postings))
+
+        with open(path + ".tmp", "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.first or 0, self.last or 0, self.records,
+                                      len(self.times), len(ordered), posting_offsets[-1]))
+            for stamp, offset in zip(self.times, self.offsets):
+                f.write(TIME_ENTRY.pack(stamp, offset))
+            f.write(_little_endian(term_offsets))
+            f.write(_little_endian(posting_offsets))
+            for term, postings in ordered:
+                f.write(term)
+            for term, postings in ordered:
+                f.write(_little_endian(postings))
+        os.replace(path + ".tmp", path)
+
+
+class SegmentIndex:
+    """
+    The index file of a full segment, read through mmap.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.first, self.last, self.records, self.time_count, self.term_count, posting_count = \
+            INDEX_HEADER.unpack_from(self.view, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError("{} is not a chat log index".format(path))
+
+        self.times_at = INDEX_HEADER.size
+        self.term_offsets_at = self.times_at + self.time_count * TIME_ENTRY.size
+        self.posting_offsets_at = self.term_offsets_at + (self.term_count + 1) * OFFSET.size
+        self.terms_at = self.posting_offsets_at + (self.term_count + 1) * OFFSET.size
+        self.postings_at = self.terms_at + self._term_offset(self.term_count)
+
+    def _term_offset(self, position):
+        return OFFSET.unpack_from(self.view, self.term_offsets_at + position * OFFSET.size)[0]
+
+    def _posting_offset(self, position):
+        return OFFSET.unpack_from(self.view, self.posting_offsets_at + position * OFFSET.size)[0]
+
+    def _term(self, position):
+        return self.view[self.terms_at + self._term_offset(position):self.terms_at + self._term_offset(position + 1)]
+
+    def lookup(self, term):
+        term = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.term_count or self._term(low) != term:
+            return ()
+
+        start = self.postings_at + self._posting_offset(low) * OFFSET.size
+        return Postings(self.view, start, self._posting_offset(low + 1) - self._posting_offset(low))
+
+    def offset_at(self, stamp):
+        low, high = 0, self.time_count
+        while low < high:
+            middle = (low + high) // 2
+            if TIME_ENTRY.unpack_from(self.view, self.times_at + middle * TIME_ENTRY.size)[0] < stamp:
+                low = middle + 1
+            else:
+                high = middle
+        if not low:
+            return len(SEGMENT_MAGIC)
+        return TIME_ENTRY.unpack_from(self.view, self.times_at + (low - 1) * TIME_ENTRY.size)[1]
+
+    def close(self):
+        self.view.close()
+
+
+def _truncate(value, limit):
+    """
+    value cut to at most limit UTF-8 bytes: (str, bytes), as read back.
+    """
+
+    data = value.encode("utf-8")
+    if len(data) <= limit:
+        return value, data
+    data = data[:limit]
+    return data.decode("utf-8", "replace"), data
+
+
+class Postings:
+    """
+    The sorted offsets of one term in an index file, read from the mmap
+    when accessed rather than copied out.
+    """
+
+    __slots__ = ("view", "start", "count")
+
+    def __init__(self, view, start, count):
+        self.view = view
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        return OFFSET.unpack_from(self.view, self.start + position * OFFSET.size)[0]
+
+    def __iter__(self):
+        for offset, in OFFSET.iter_unpack(self.view[self.start:self.start + self.count * OFFSET.size]):
+            yield offset
+
+
+def _little_endian(values):
+    if _big_endian:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _bisect(values, value):
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _seek(values, value, low):
+    """
+    The position of the first of the sorted values at or after value,
+    searching from low on: galloping, then bisecting.
+    """
+
+    step = 1
+    high = low
+    while high < len(values) and values[high] < value:
+        low = high + 1
+        high += step
+        step *= 2
+    high = min(high, len(values))
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _intersect(postings, first=0):
+    """
+    The offsets from first on present in every sorted postings list, in
+    order. Only the shortest one is read in full; the others are searched
+    in.
+    """
+
+    postings = sorted(postings, key=len)
+    shortest = postings[0]
+    if len(postings) == 1:
+        return (shortest[position] for position in range(_seek(shortest, first, 0), len(shortest)))
+    result = list(shortest)[_seek(shortest, first, 0):]
+    for other in postings[1:]:
+        kept = []
+        position = 0
+        for offset in result:
+            position = _seek(other, offset, position)
+            if position == len(other):
+                break
+            if other[position] == offset:
+                kept.append(offset)
+        result = kept
+        if not result:
+            break
+    return result
+
+
+class Segment:
+    __slots__ = ("path", "index_path", "index", "indexed")
+
+    def __init__(self, path, index=None):
+        self.path = path
+        self.index_path = path[:-len(".log")] + ".idx"
+        self.index = index
+        # where the records in a MemoryIndex built from the file end
+        self.indexed = len(SEGMENT_MAGIC)
+
+    def open_index(self):
+        if self.index is None:
+            self.index = SegmentIndex(self.index_path)
+        return self.index
+
+
+class ChatLogStore:
+    """
+    Append-only chat archive in directory; see the module documentation.
+    A readonly store can be searched while another process writes it.
+    """
+
+    def __init__(self, directory, prefix="chat", segment_size=64 * 1024 * 1024, readonly=False):
+        self.directory = directory
+        self.readonly = readonly
+        self.prefix = prefix
+        self.segment_size = segment_size
+
+        self.segments = []
+        self.file = None
+        self.index = None
+        self.size = 0
+        self.appended = 0
+
+        if segment_size >= 2 ** 32:
+            raise ValueError("segment_size must be under 4 GiB, offsets are 32 bit")
+
+        os.makedirs(directory, exist_ok=True)
+        if readonly:
+            self._refresh()
+            return
+
+        self._glob()
+        for segment in self.segments[:-1]:
+            if not os.path.exists(segment.index_path):
+                # full, but the process ended before its index was written
+                self._index(segment)
+                segment.index.write(segment.index_path)
+                segment.index = None
+
+        if self.segments and not os.path.exists(self.segments[-1].index_path):
+            self._resume(self.segments[-1])
+
+    def _glob(self):
+        known = {segment.path for segment in self.segments}
+        for path in sorted(glob.glob(os.path.join(self.directory, "{}-*.log".format(self.prefix)))):
+            if path not in known:
+                self.segments.append(Segment(path))
+
+    def _index(self, segment):
+        """
+        Index the records of a segment written without an index file, from
+        where its MemoryIndex ends on. Returns the index.
+        """
+
+        if segment.index is None:
+            segment.index = MemoryIndex()
+        if os.path.getsize(segment.path) > segment.indexed:
+            with open(segment.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                for offset, entry, segment.indexed in scan(view, segment.indexed):
+                    segment.index.add(offset, entry)
+        return segment.index
+
+    def _refresh(self):
+        """
+        Catch a readonly store up with what its writer appended since.
+        """
+
+        self._glob()
+        for segment in self.segments:
+            if segment.index is not None and not isinstance(segment.index, MemoryIndex):
+                continue
+            if segment.index is None and os.path.exists(segment.index_path):
+                continue
+            # indexed as far as the writer went before sealing it
+            sealed = os.path.exists(segment.index_path)
+            self._index(segment)
+            if sealed:
+                segment.index = None
+
+    def _resume(self, segment):
+        """
+        Index the last segment again and keep writing it.
+        """
+
+        index = self._index(segment)
+        end = segment.indexed
+        self.file = open(segment.path, "r+b")
+        # drop a record cut short by a crash
+        self.file.truncate(end)
+        self.file.seek(end)
+        self.size = end
+        self.index = index
+        log.info("resumed {} with {} records".format(segment.path, index.records))
+
+    def _rotate(self):
+        self._seal()
+        sequence = int(self.segments[-1].path.rsplit("-", 1)[1].split(".")[0]) + 1 if self.segments else 1
+        path = os.path.join(self.directory, "{}-{:06d}.log".format(self.prefix, sequence))
+        self.file = open(path, "wb")
+        self.file.write(SEGMENT_MAGIC)
+        self.size = len(SEGMENT_MAGIC)
+        self.index = MemoryIndex()
+        self.segments.append(Segment(path, self.index))
+
+    def _seal(self, wait=False):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        segment = self.segments[-1]
+        index, self.index = self.index, None
+
+        loop = asyncio.get_event_loop()
+        if wait or not loop.is_running():
+            index.write(segment.index_path)
+            segment.index = None
+            return
+
+        # searches keep using the memory index until the file is written
+        future = loop.run_in_executor(None, index.write, segment.index_path)
+        future.add_done_callback(lambda future: self._sealed(segment, index, future))
+
+    def _sealed(self, segment, index, future):
+        if future.cancelled() or future.exception() is not None:
+            log.error("could not write {}: {!r}".format(segment.index_path, future.exception()))
+        elif segment.index is index:
+            segment.index = None
+
+    def append(self, kind, channel, user, text, stamp=None):
+        if self.readonly:
+            raise ValueError("chat log store {} is read only".format(self.directory))
+
+        stamp = time.time() if stamp is None else stamp
+        channel, channel_bytes = _truncate(channel, 255)
+        user, user_bytes = _truncate(user, 255)
+        text, text_bytes = _truncate(text, 65535)
+
+        if self.file is None or self.size >= self.segment_size:
+            self._rotate()
+
+        offset = self.size
+        header = RECORD.pack(stamp, kind, len(channel_bytes), len(user_bytes), len(text_bytes))
+        self.file.write(header)
+        self.file.write(channel_bytes)
+        self.file.write(user_bytes)
+        self.file.write(text_bytes)
+        self.size += len(header) + len(channel_bytes) + len(user_bytes) + len(text_bytes)
+        self.appended += 1
+
+        self.index.add(offset, LogEntry(stamp, kind, channel, user, text))
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        """
+        Write the index of the current segment; the next append starts a
+        new one.
+        """
+
+        if not self.readonly:
+            self._seal(wait=True)
+        for segment in self.segments:
+            if isinstance(segment.index, SegmentIndex):
+                segment.index.close()
+                segment.index = None
+
+    def search(self, user=None, channel=None, words=(), start=None, end=None, kinds=None, limit=None):
+        """
+        Return the messages, oldest first, by user, in channel (or private
+        messages received by account channel), containing every word of
+        words, from start up to end (timestamps), of the given kinds.
+        """
+
+        if self.readonly:
+            self._refresh()
+        else:
+            self.flush()
+        wanted = []
+        if user is not None:
+            wanted.append("u:" + user)
+        if channel is not None:
+            wanted.append("c:" + channel)
+        for word in words:
+            wanted.extend("w:" + found for found in _words.findall(word.lower()))
+
+        found = []
+        for segment in self.segments:
+            index = segment.open_index()
+            if index.records == 0:
+                continue
+            if (start is not None and index.last < start) or (end is not None and index.first >= end):
+                continue
+
+            found.extend(self._search_segment(segment, index, wanted, start, end, kinds,
+                                              None if limit is None else limit - len(found)))
+            if limit is not None and len(found) >= limit:
+                break
+        return found
+
+    def _search_segment(self, segment, index, wanted, start, end, kinds, limit):
+        first = index.offset_at(start) if start is not None else len(SEGMENT_MAGIC)
+        found = []
+
+        with open(segment.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if wanted:
+                postings = [index.lookup(term) for term in wanted]
+                if not all(postings):
+                    return found
+                records = (read_record(view, offset)[0] for offset in _intersect(postings, first))
+            else:
+                records = (entry for offset, entry, next_offset in scan(view, first))
+
+            for entry in records:
+                if start is not None and entry.stamp < start:
+                    continue
+                if end is not None and entry.stamp >= end:
+                    break
+                if kinds is not None and entry.kind not in kinds:
+                    continue
+                found.append(entry)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def info(self):
+        if self.readonly:
+            self._refresh()
+        records = 0
+        size = 0
+        for segment in self.segments:
+            index = segment.open_index()
+            records += index.records
+            size += os.path.getsize(segment.path)
+        return {
+            "segments": len(self.segments),
+            "records": records,
+            "bytes": size,
+            "appended": self.appended,
+        }
+
+
+## plugin
+
+store = None
+flush_interval = 1.0
+_flush_handle = None
+
+# a message received by several connections of the process is stored
+# once: message -> (when it was stored, connections that reported it), for
+# the last dedupe_window seconds
+dedupe_window = 2.0
+_recent = collections.OrderedDict()
+
+
+def open_store(directory, **kwargs):
+    """
+    Open the store the chat of every connection is appended to.
+    """
+
+    global store
+    close_store()
+    store = ChatLogStore(directory, **kwargs)
+    return store
+
+
+def close_store():
+    global store, _flush_handle
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    _recent.clear()
+    if store is not None:
+        store.close()
+        store = None
+
+
+def _flush():
+    global _flush_handle
+    _flush_handle = None
+    if store is not None:
+        store.flush()
+
+
+def _record(client, kind, channel, user, text):
+    global _flush_handle
+    if store is None:
+        return
+
+    now = time.time()
+    while _recent and next(iter(_recent.values()))[0] < now - dedupe_window:
+        _recent.popitem(last=False)
+
+    key = (kind, channel, user, text)
+    recent = _recent.get(key)
+    if recent is not None and client not in recent[1]:
+        # the same message, through another connection
+        recent[1].add(client)
+        return
+    _recent.pop(key, None)
+    _recent[key] = (now, {client})
+
+    store.append(kind, channel, user, text, now)
+    if _flush_handle is None:
+        _flush_handle = asyncio.get_event_loop().call_later(flush_interval, _flush)
+
+
+def record_said(message, user, target, text):
+    _record(message.client, SAID, target, user, text)
+
+
+def record_saidex(message, user, target, text):
+    _record(message.client, SAIDEX, target, user, text)
+
+
+def _receiver(client):
+    return getattr(client, "nickname", None) or client.bot_username
+
+
+def record_said_private(message, user, target, text):
+    _record(message.client, PRIVATE, _receiver(message.client), user, text)
+
+
+def record_saidex_private(message, user, target, text):
+    _record(message.client, PRIVATEEX, _receiver(message.client), user, text)
+
+
+signal("said").connect(record_said)
+signal("saidex").connect(record_saidex)
+signal("said-from").connect(record_said)
+signal("said-private").connect(record_said_private)
+signal("saidex-private").connect(record_saidex_private)
+
+signal("plugin-registered").send("asyncspring.plugins.chatlog")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and search chat logs.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    info = commands.add_parser("info", help="summarise a chat log store")
+    info.add_argument("path")
+
+    find = commands.add_parser("search", help="print matching messages")
+    find.add_argument("path")
+    find.add_argument("words", nargs="*")
+    find.add_argument("--user")
+    find.add_argument("--channel")
+    find.add_argument("--days", type=float, help="only the last DAYS days")
+    find.add_argument("--limit", type=int)
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.path):
+        parser.error("no chat log store in {}".format(args.path))
+    chatlogs = ChatLogStore(args.path, readonly=True)
+
+    if args.command == "info":
+        for key, value in chatlogs.info().items():
+            print("{:>10}: {}".format(key, value))
+
+    elif args.command == "search":
+        started = time.perf_counter()
+        start = time.time() - args.days * 86400 if args.days else None
+        entries = chatlogs.search(args.user, args.channel, args.words, start, limit=args.limit)
+        for entry in entries:
+            print("{} {:<16} <{}> {}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.stamp)),
+                                             entry.channel, entry.user, entry.text))
+        print("{} messages in {:.1f} ms".format(len(entries), (time.perf_counter() - started) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,66 +8,99 @@ import logging
 from asyncblink import signal
 from asyncspring.user import get_user
 from asyncspring.parser import LobbyMessage
+from asyncspring.dispatch import dispatcher
+from asyncspring.events import emit
+from asyncspring.heartbeat import Heartbeat
 
 log = logging.getLogger(__name__)
 
-ping_client = None
-ping_timer = None
-
-
-def _redispatch_message_common(message, mtype):
+heartbeat = Heartbeat()
+
+raw = signal("raw")
+spring = signal("spring")
+
+said = signal("said")
+saidex = signal("saidex")
+said_private = signal("said-private")
+saidex_private = signal("saidex-private")
+notice = signal("notice")
+joined = signal("joined")
+left = signal("left")
+quit_ = signal("quit")
+kick = signal("kick")
+nick = signal("nick")
+pong = signal("pong")
+accepted = signal("accepted")
+denied = signal("denied")
+tasserver = signal("tasserver")
+clients = signal("clients")
+adduser = signal("adduser")
+removeuser = signal("removeuser")
+agreement = signal("agreement")
+agreement_end = signal("agreement_end")
+failed = signal("failed")
+join_failed = signal("join-failed")
+joined_from = signal("joined-from")
+left_from = signal("left-from")
+said_from = signal("said-from")
+
+
+def _redispatch_message_common(message, event):
     user = message.source
-    target, text = message.params[0], " ".join(message.params[2:])
-    # log.debug("{} {}".format(mtype, text))
+    args = message.args
+    target = message.params[0]
+    text = " ".join(message.params[2:]) if args is None else args.message or ""
+    # log.debug("{} {}".format(event.name, text))
 
-    signal(mtype).send(message, user=user, target=target, text=text)
+    emit(message.client.events, event, message, user=user, target=target, text=text)
 
 
 def _redispatch_said(message):
-    _redispatch_message_common(message, "said")
+    _redispatch_message_common(message, said)
 
 
 def _redispatch_saidex(message):
-    _redispatch_message_common(message, "saidex")
+    _redispatch_message_common(message, saidex)
 
 
 def _redispatch_saidprivate(message):
-    _redispatch_message_common(message, "said-private")
+    _redispatch_message_common(message, said_private)
 
 
 def _redispatch_saidprivateex(message):
-    _redispatch_message_common(message, "saidex-private")
+    _redispatch_message_common(message, saidex_private)
 
 
 def _redispatch_notice(message):
-    _redispatch_message_common(message, "notice")
+    _redispatch_message_common(message, notice)
 
 
 def _redispatch_joined(message):
-    user = get_user(message.params[1])
-    channel = message.params[0]
-    signal("joined").send(message, user=user, channel=channel)
+    user = get_user(message.args.user_name)
+    channel = message.args.channel
+    emit(message.client.events, joined, message, user=user, channel=channel)
 
 
 def _redispatch_joinfailed(message):
     log.debug("JOINFAILED")
     log.debug(message)
+    emit(message.client.events, join_failed, message, channel=message.args.channel, reason=message.args.reason)
 
 
 def _redispatch_left(message):
-    user = get_user(message.params[1])
-    channel = message.params[0]
-    signal("left").send(message, user=user, channel=channel)
+    user = get_user(message.args.user_name)
+    channel = message.args.channel
+    emit(message.client.events, left, message, user=user, channel=channel)
 
 
 def _redispatch_quit(message):
-    signal("quit").send(message, user=get_user(message.source), reason=message.params[0])
+    emit(message.client.events, quit_, message, user=get_user(message.source), reason=message.params[0])
 
 
 def _redispatch_kick(message):
     kicker = get_user(message.source)
     channel, kickee, reason = message.params[0], get_user(message.params[1]), message.params[2]
-    signal("kick").send(message, kicker=kicker, kickee=kickee, channel=channel, reason=reason)
+    emit(message.client.events, kick, message, kicker=kicker, kickee=kickee, channel=channel, reason=reason)
 
 
 def _redispatch_nick(message):
@@ -75,34 +108,19 @@ def _redispatch_nick(message):
     new_nick = message.params[0]
     if old_user.nick == message.client.nickname:
         message.client.nickname = new_nick
-    signal("nick").send(message, user=old_user, new_nick=new_nick)
-
-
-def _ping_server():
-    global ping_timer
-    if ping_client.last_pong != 0 and time.time() - ping_client.last_pong > 90:
-        ping_client.connection_lost(Exception())
+    emit(message.client.events, nick, message, user=old_user, new_nick=new_nick)
 
-    else:
-        ping_client.writeln("PING")
-        ping_client.last_ping = time.time()
 
-        ping_timer = asyncio.get_event_loop().call_later(29, _ping_server)
-
-
-def _stop_ping(message):
-    if ping_timer:
-        ping_timer.cancel()
+def _stop_ping(client):
+    if client is not None:
+        heartbeat.remove(getattr(client, "protocol", client))
 
 
 def _catch_pong(message):
     message.client.last_pong = time.time()
-    message.client.lag = message.client.last_pong - message.client.last_ping
-    signal("pong").send(message)
-
-
-def _redispatch_spring(message):
-    signal("spring-{}".format(message.verb.lower())).send(message)
+    lag = heartbeat.pong(message.client)
+    message.client.lag = lag if lag is not None else message.client.last_pong - message.client.last_ping
+    emit(message.client.events, pong, message)
 
 
 def _redispatch_raw(client, text):
@@ -110,7 +128,24 @@ def _redispatch_raw(client, text):
     message = LobbyMessage.from_message(text)
     message.client = client
     # log.debug(message)
-    signal("spring").send(message)
+    if spring.receivers:
+        spring.send(message)
+    dispatcher.dispatch(message)
+    if message.msg_id is not None:
+        client.requests.resolve(message)
+
+
+def _redispatch_raw_batch(client, lines):
+    scoped = client.events.get("raw")
+    observed = bool(raw.receivers) or (scoped is not None and bool(scoped.receivers))
+    for text in lines:
+        if observed:
+            emit(client.events, raw, client, text=text)
+        try:
+            _redispatch_raw(client, text)
+        except Exception:
+            # one malformed line must not cost the rest of the batch
+            log.exception("Failed to handle line {!r}".format(text))
 
 
 def _register_client(client):
@@ -123,26 +158,36 @@ def _login_client(client):
 
 
 def _queue_ping(client):
-    global ping_client
-
-    ping_client = client
-    _ping_server()
+    heartbeat.add(client)
 
 
 def _connection_registered(message):
     log.debug("Connection registered!")
-    signal("accepted").send(message)
+    emit(message.client.events, accepted, message)
 
     message.client.registration_complete = True
     _queue_ping(message.client)
     for channel in message.client.channels_to_join:
-        # log.debug(channel)
-        message.client.join(channel)
+        message.client.writeln("JOIN {}".format(channel))
+
+    if message.client.battle_to_join:
+        message.client.join_battle(*message.client.battle_to_join)
+        message.client.battle_to_join = None
+
+    if message.client.queue.held:
+        # behind the joins above, and what "accepted" handlers queue next
+        asyncio.get_event_loop().call_soon(_release_held, message.client)
+
+
+def _release_held(client):
+    # lines held back over a reconnection
+    if client.queue.release():
+        client.flusher.notify()
 
 
 def _connection_denied(message):
     message.client.registration_complete = False
-    signal("denied").send(message)
+    emit(message.client.events, denied, message)
 
 
 def _parse_motd(message):
@@ -150,83 +195,116 @@ def _parse_motd(message):
 
 
 def _redispatch_tasserver(message):
-    signal("tasserver").send(message)
+    emit(message.client.events, tasserver, message)
 
 
 def _redispatch_clients(message):
-    signal("clients").send(message)
+    emit(message.client.events, clients, message)
 
 
 def _redispatch_adduser(message):
-    signal("adduser").send(message)
+    emit(message.client.events, adduser, message)
 
 
 def _redispatch_removeuser(message):
-    signal("removeuser").send(message)
+    emit(message.client.events, removeuser, message)
 
 
 def _redispatch_agreement(message):
-    signal("agreement").send(message)
+    emit(message.client.events, agreement, message)
 
 
 def _redispatch_agreementend(message):
-    signal("agreement_end").send(message)
+    emit(message.client.events, agreement_end, message)
 
 
 def _redispatch_joined_from(message):
-    log.debug("JOINED FROM")
-    log.debug(message)
+    args = message.args
+    emit(message.client.events, joined_from, message, user=args.user_name, channel=args.channel,
+         bridge=args.bridge)
 
 
 def _redispatch_left_from(message):
-    log.debug("LEFT FROM")
-    log.debug(message)
+    args = message.args
+    emit(message.client.events, left_from, message, user=args.user_name, channel=args.channel)
 
 
 def _redispatch_said_from(message):
-    log.debug("SAID FROM")
-    log.debug(message)
+    args = message.args
+    emit(message.client.events, said_from, message, user=args.user_name, target=args.channel,
+         text=args.message or "")
+
+
+def _joined_battle(message):
+    message.client.battle_id = message.args.battle_id
+
+
+def _left_battle(message):
+    if message.args.user_name == message.client.bot_username:
+        message.client.battle_id = None
+
+
+def _quit_battle(message):
+    message.client.battle_id = None
+
+
+def _own_status(message):
+    client = message.client
+    if client.flood_class is not None or message.args.user_name != client.bot_username:
+        return
+
+    status = message.args.status
+    account_class = "mod" if status.access else "bot" if status.bot else "user"
+    if client.queue.account_class != account_class:
+        log.debug("Sending at the {} flood limits".format(account_class))
+        client.queue.set_flood_limit(account_class)
 
 
 def _redispatch_failed(message):
     log.debug(f"FAILED MESSAGE: {message}")
-    signal("failed").send(message)
+    emit(message.client.events, failed, message)
 
 
-signal("raw").connect(_redispatch_raw)
-signal("spring").connect(_redispatch_spring)
+signal("raw-batch").connect(_redispatch_raw_batch)
 
 signal("connected").connect(_login_client)
 signal("connection-lost").connect(_stop_ping)
 
-signal("spring-tasserver").connect(_redispatch_tasserver)
+dispatcher.register("TASSERVER", _redispatch_tasserver)
+
+dispatcher.register("PONG", _catch_pong)
+
+dispatcher.register("SAID", _redispatch_said)
+dispatcher.register("SAIDEX", _redispatch_saidex)
+dispatcher.register("SAIDPRIVATE", _redispatch_saidprivate)
+dispatcher.register("SAIDPRIVATEEX", _redispatch_saidprivateex)
 
-signal("spring-pong").connect(_catch_pong)
+dispatcher.register("NOTICE", _redispatch_notice)
+dispatcher.register("JOINED", _redispatch_joined)
+dispatcher.register("JOINFAILED", _redispatch_joinfailed)
 
-signal("spring-said").connect(_redispatch_said)
-signal("spring-saidex").connect(_redispatch_saidex)
-signal("spring-saidprivate").connect(_redispatch_saidprivate)
-signal("spring-saidprivateex").connect(_redispatch_saidprivateex)
+dispatcher.register("LEFT", _redispatch_left)
+dispatcher.register("ADDUSER", _redispatch_adduser)
+dispatcher.register("REMOVEUSER", _redispatch_removeuser)
+dispatcher.register("QUIT", _redispatch_quit)
+dispatcher.register("KICK", _redispatch_kick)
+dispatcher.register("NICK", _redispatch_nick)
+dispatcher.register("ACCEPTED", _connection_registered)
+dispatcher.register("DENIED", _connection_denied)
+dispatcher.register("AGREEMENT", _redispatch_agreement)
+dispatcher.register("AGREEMENTEND", _redispatch_agreementend)
 
-signal("spring-notice").connect(_redispatch_notice)
-signal("spring-joined").connect(_redispatch_joined)
-signal("spring-joinfailed").connect(_redispatch_joinfailed)
+dispatcher.register("MOTD", _parse_motd)
+dispatcher.register("CLIENTS", _redispatch_clients)
 
-signal("spring-left").connect(_redispatch_left)
-signal("spring-adduser").connect(_redispatch_adduser)
-signal("spring-removeuser").connect(_redispatch_removeuser)
-signal("spring-quit").connect(_redispatch_quit)
-signal("spring-kick").connect(_redispatch_kick)
-signal("spring-nick").connect(_redispatch_nick)
-signal("spring-accepted").connect(_connection_registered)
-signal("spring-denied").connect(_connection_denied)
-signal("spring-agreement").connect(_redispatch_agreement)
-signal("spring-agreementend").connect(_redispatch_agreementend)
+dispatcher.register("JOINEDFROM", _redispatch_joined_from)
+dispatcher.register("LEFTFROM", _redispatch_left_from)
+dispatcher.register("SAIDFROM", _redispatch_said_from)
 
-signal("spring-motd").connect(_parse_motd)
-signal("spring-clients").connect(_redispatch_clients)
+dispatcher.register("JOINBATTLE", _joined_battle)
+dispatcher.register("LEFTBATTLE", _left_battle)
+dispatcher.register("FORCEQUITBATTLE", _quit_battle)
 
-signal("spring-joinedfrom").connect(_redispatch_joined_from)
-signal("spring-leftfrom").connect(_redispatch_left_from)
+dispatcher.register("CLIENTSTATUS", _own_status)
 
-signal("spring-failed").connect(_redispatch_failed)
+dispatcher.register("FAILED", _redispatch_failed)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Recent chat of a connection, kept in fixed size ring buffers: one per
+channel and one per private peer. Importing the plugin turns it on; the
+history of a connection is client.chat_history:
+
+    import asyncspring.plugins.history
+
+    history = client.chat_history
+    history.channel("main").last(20)
+    history.channel("main").between(time.time() - 3600)
+    history.seen("bob")
+
+Every buffer holds at most `channel_size` (or `private_size`) messages,
+stored as parallel columns rather than an object per message, with the
+user names interned. On top of that the messages of all histories of the
+process are kept under `budget.max_bytes`; past it, the oldest messages
+of the buffers written least recently are dropped, whichever connection
+they belong to. A history can have its own `max_bytes` cap as well.
+Queries walk the buffer in place and only build the entries they return.
+
+The sizes apply to histories created after they are set, the budget at
+once:
+
+    asyncspring.plugins.history.settings.update(channel_size=2000)
+    asyncspring.plugins.history.budget.max_bytes = 256 * 1024 * 1024
+
+The history of a connection is dropped when the connection is lost for
+good, and kept for the reconnection otherwise.
+"""
+
+import sys
+import time
+import array
+import logging
+import collections
+
+from asyncblink import signal
+
+log = logging.getLogger(__name__)
+
+histories = {}
+
+# keyword arguments of the ChatHistory of every new connection
+settings = {}
+
+# rough bytes taken by a message besides its text: timestamp, list slots,
+# str header
+ENTRY_OVERHEAD = 96
+
+Entry = collections.namedtuple("Entry", "stamp user text emote")
+
+
+class Ring:
+    """
+    The last `capacity` messages of one channel or peer, oldest first.
+    """
+
+    __slots__ = ("name", "capacity", "start", "count", "stamps", "users", "texts", "emotes", "size")
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.start = 0
+        self.count = 0
+        self.stamps = array.array("d", bytes(8 * capacity))
+        self.users = [None] * capacity
+        self.texts = [None] * capacity
+        self.emotes = bytearray(capacity)
+        self.size = 0
+
+    def __len__(self):
+        return self.count
+
+    def _slot(self, position):
+        """
+        Where the position-th oldest message is stored.
+        """
+
+        return (self.start + position) % self.capacity
+
+    def _entry(self, slot):
+        return Entry(self.stamps[slot], self.users[slot], self.texts[slot], bool(self.emotes[slot]))
+
+    def append(self, stamp, user, text, emote=False):
+        """
+        Add a message, overwriting the oldest one when full. Returns the
+        change in bytes held.
+        """
+
+        freed = 0
+        if self.count == self.capacity:
+            freed = self.pop()
+
+        slot = self._slot(self.count)
+        self.stamps[slot] = stamp
+        self.users[slot] = user
+        self.texts[slot] = text
+        self.emotes[slot] = emote
+        self.count += 1
+
+        added = len(text) + ENTRY_OVERHEAD
+        self.size += added
+        return added - freed
+
+    def pop(self):
+        """
+        Drop the oldest message. Returns the bytes freed.
+        """
+
+        slot = self.start
+        freed = len(self.texts[slot]) + ENTRY_OVERHEAD
+        self.users[slot] = self.texts[slot] = None
+        self.start = (slot + 1) % self.capacity
+        self.count -= 1
+        self.size -= freed
+        return freed
+
+    def _bisect(self, stamp):
+        """
+        The position of the first message at or after stamp.
+        """
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.stamps[self._slot(middle)] < stamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._entry(self._slot(position))
+
+    def __reversed__(self):
+        for position in range(self.count - 1, -1, -1):
+            yield self._entry(self._slot(position))
+
+    def last(self, n=10, user=None):
+        """
+        The n most recent messages, by user if given, oldest first.
+        """
+
+        entries = []
+        for position in range(self.count - 1, -1, -1):
+            if len(entries) >= n:
+                break
+            slot = self._slot(position)
+            if user is None or self.users[slot] == user:
+                entries.append(self._entry(slot))
+        entries.reverse()
+        return entries
+
+    def between(self, start, end=None, user=None):
+        """
+        Yield the messages from start up to end (timestamps), oldest first.
+        """
+
+        for position in range(self._bisect(start), self.count):
+            slot = self._slot(position)
+            if end is not None and self.stamps[slot] >= end:
+                return
+            if user is None or self.users[slot] == user:
+                yield self._entry(slot)
+
+    def clear(self):
+        self.__init__(self.name, self.capacity)
+
+    def __repr__(self):
+        return "Ring {} ({}/{})".format(self.name, self.count, self.capacity)
+
+
+class Budget:
+    """
+    The bytes held by the buffers of every history, kept under max_bytes by
+    dropping the oldest messages of the buffers written least recently.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # ring -> (history, key), written least recently first
+        self.rings = collections.OrderedDict()
+        self.evicted = 0
+
+    def written(self, history, key, ring, change):
+        self.size += change
+        self.rings[ring] = (history, key)
+        self.rings.move_to_end(ring)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        for ring in list(self.rings):
+            history, key = self.rings[ring]
+            while ring.count and self.size > self.max_bytes:
+                history._pop(key, ring)
+                self.evicted += 1
+            if self.size <= self.max_bytes:
+                return
+
+    def stats(self):
+        return {
+            "buffers": len(self.rings),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted,
+        }
+
+
+budget = Budget()
+
+
+class ChatHistory:
+    """
+    The ring buffers of one connection; see the module documentation.
+    """
+
+    def __init__(self, channel_size=500, private_size=100, max_bytes=None, max_seen=10000, clock=time.time,
+                 budget=budget):
+        self.channel_size = channel_size
+        self.private_size = private_size
+        self.max_bytes = max_bytes
+        self.max_seen = max_seen
+        self.clock = clock
+        self.budget = budget
+
+        # written least recently first, for eviction
+        self.buffers = collections.OrderedDict()
+        # user -> (stamp, where, text), seen least recently first
+        self.last_seen = collections.OrderedDict()
+        self.size = 0
+
+        self.messages = 0
+        self.evicted = 0
+
+    def channel(self, name):
+        return self.buffers.get(("#", name))
+
+    def private(self, peer):
+        return self.buffers.get(("@", peer))
+
+    def channels(self):
+        return [key[1] for key in self.buffers if key[0] == "#"]
+
+    def peers(self):
+        return [key[1] for key in self.buffers if key[0] == "@"]
+
+    def add(self, where, user, text, emote=False, private=False, stamp=None):
+        """
+        Record a message said in channel `where`, or in a private
+        conversation with peer `where`.
+        """
+
+        stamp = self.clock() if stamp is None else stamp
+        user = sys.intern(user)
+        key = ("@" if private else "#", sys.intern(where))
+
+        ring = self.buffers.get(key)
+        if ring is None:
+            ring = self.buffers[key] = Ring(key[1], self.private_size if private else self.channel_size)
+        else:
+            self.buffers.move_to_end(key)
+
+        change = ring.append(stamp, user, text, emote)
+        self.size += change
+        self.messages += 1
+
+        self.last_seen[user] = (stamp, None if private else key[1], text)
+        self.last_seen.move_to_end(user)
+        if len(self.last_seen) > self.max_seen:
+            self.last_seen.popitem(last=False)
+
+        if self.budget is not None:
+            self.budget.written(self, key, ring, change)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self._evict()
+
+    def _pop(self, key, ring):
+        """
+        Drop the oldest message of a buffer, and the buffer once empty.
+        """
+
+        freed = ring.pop()
+        self.size -= freed
+        self.evicted += 1
+        if self.budget is not None:
+            self.budget.size -= freed
+        if not ring.count:
+            del self.buffers[key]
+            if self.budget is not None:
+                del self.budget.rings[ring]
+
+    def _evict(self):
+        for key, ring in list(self.buffers.items()):
+            while ring.count and self.size > self.max_bytes:
+                self._pop(key, ring)
+            if self.size <= self.max_bytes:
+                return
+
+    def seen(self, user):
+        """
+        When user last said something: (timestamp, channel, text), with
+        channel None for a private message, or None if not seen.
+        """
+
+        return self.last_seen.get(user)
+
+    def search(self, user=None, start=None, end=None, channels=None):
+        """
+        Yield (channel, entry) for the messages said in channels (all
+        channels by default), by user and between start and end if given.
+        """
+
+        for name in channels if channels is not None else self.channels():
+            ring = self.channel(name)
+            if ring is None:
+                continue
+            for entry in ring.between(start or 0, end, user):
+                yield name, entry
+
+    def clear(self):
+        if self.budget is not None:
+            for ring in self.buffers.values():
+                del self.budget.rings[ring]
+            self.budget.size -= self.size
+        self.buffers.clear()
+        self.last_seen.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "buffers": len(self.buffers),
+            "messages": sum(ring.count for ring in self.buffers.values()),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "seen": len(self.last_seen),
+            "received": self.messages,
+            "evicted": self.evicted,
+        }
+
+
+def get_history(client):
+    history = getattr(client, "chat_history", None)
+    if history is None:
+        # a reconnected client keeps the netid, and its history
+        netid = getattr(client, "netid", None)
+        history = histories.get(netid) if netid else None
+        if history is None:
+            history = ChatHistory(**settings)
+            if netid:
+                histories[netid] = history
+        client.chat_history = history
+    return history
+
+
+def drop_history(client):
+    # a reconnection takes the same netid, and keeps its history
+    if getattr(client, "autoreconnect", False):
+        return
+    history = histories.pop(getattr(client, "netid", None), None)
+    if history is not None:
+        history.clear()
+
+
+## event handlers
+
+def record_said(message, user, target, text):
+    get_history(message.client).add(target, user, text)
+
+
+def record_saidex(message, user, target, text):
+    get_history(message.client).add(target, user, text, emote=True)
+
+
+def record_said_private(message, user, target, text):
+    get_history(message.client).add(user, user, text, private=True)
+
+
+def record_saidex_private(message, user, target, text):
+    get_history(message.client).add(user, user, text, emote=True, private=True)
+
+
+signal("said").connect(record_said)
+signal("saidex").connect(record_saidex)
+signal("said-from").connect(record_said)
+signal("said-private").connect(record_said_private)
+signal("saidex-private").connect(record_saidex_private)
+signal("connection-lost").connect(drop_history)
+
+signal("plugin-registered").send("asyncspring.plugins.history")
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Incremental model of the lobby as seen by one connection: users, battles
+and channels, kept up to date from the server's ADDUSER, CLIENTSTATUS,
+BATTLEOPENED, JOINED, ... commands.
+
+Every command is applied in constant time (or in the number of channels or
+battle members involved), so the login burst of a busy server is absorbed
+as it arrives. The state of a connection is available as
+client.lobby_state. Client and battle statuses are kept in a columnar
+StatusStore (state.statuses) rather than on each LobbyUser.
+"""
+
+import logging
+
+from asyncblink import signal
+
+from asyncspring.dispatch import dispatcher
+from asyncspring.status import StatusStore
+
+log = logging.getLogger(__name__)
+
+states = {}
+
+
+class LobbyUser:
+    __slots__ = ("name", "country", "user_id", "lobby_id", "battle_id", "channels", "store", "slot")
+
+    def __init__(self, name, country=None, user_id=None, lobby_id=None, store=None):
+        self.name = name
+        self.country = country
+        self.user_id = user_id
+        self.lobby_id = lobby_id
+        self.battle_id = None
+        self.channels = set()
+        self.store = store if store is not None else StatusStore()
+        self.slot = self.store.add(name)
+
+    @property
+    def status(self):
+        return self.store.status_at(self.slot)
+
+    @property
+    def battle_status(self):
+        return self.store.battle_status_at(self.slot)
+
+    def __repr__(self):
+        return "LobbyUser {} ({})".format(self.name, self.user_id)
+
+
+class Battle:
+    __slots__ = ("battle_id", "type", "nat_type", "founder", "ip", "port", "max_players", "passworded", "rank",
+                 "map_hash", "engine_name", "engine_version", "map_name", "title", "game_name", "channel",
+                 "spectator_count", "locked", "members")
+
+    def __init__(self, args):
+        for name in args._fields:
+            setattr(self, name, getattr(args, name))
+        self.spectator_count = 0
+        self.locked = 0
+        self.members = {args.founder}
+
+    def __repr__(self):
+        return "Battle {} ({})".format(self.battle_id, self.title)
+
+
+class LobbyChannel:
+    __slots__ = ("name", "topic", "topic_author", "users")
+
+    def __init__(self, name):
+        self.name = name
+        self.topic = None
+        self.topic_author = None
+        self.users = set()
+
+    def __repr__(self):
+        return "LobbyChannel {}".format(self.name)
+
+
+class LobbyState:
+    def __init__(self):
+        self.me = None
+        self.battle_id = None
+        self.users = {}
+        self.users_by_id = {}
+        self.battles = {}
+        self.channels = {}
+        self.statuses = StatusStore()
+        self.login_complete = False
+
+    def clear(self):
+        self.__init__()
+
+    # lookups
+
+    def user(self, name):
+        return self.users.get(name)
+
+    def user_by_id(self, user_id):
+        return self.users_by_id.get(user_id)
+
+    def battle(self, battle_id):
+        return self.battles.get(battle_id)
+
+    def channel(self, name):
+        return self.channels.get(name)
+
+    def battle_members(self, battle_id):
+        battle = self.battles.get(battle_id)
+        return battle.members if battle else set()
+
+    def channel_members(self, name):
+        channel = self.channels.get(name)
+        return channel.users if channel else set()
+
+    # updates
+
+    def _channel(self, name):
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels[name] = LobbyChannel(name)
+        return channel
+
+    def add_user(self, name, country, user_id, lobby_id):
+        user = self.users.get(name)
+        if user is None:
+            user = self.users[name] = LobbyUser(name, country, user_id, lobby_id, self.statuses)
+        else:
+            user.country, user.user_id, user.lobby_id = country, user_id, lobby_id
+        if user_id is not None:
+            self.users_by_id[user_id] = user
+        return user
+
+    def remove_user(self, name):
+        user = self.users.pop(name, None)
+        if user is None:
+            return
+        if user.user_id is not None:
+            self.users_by_id.pop(user.user_id, None)
+        if user.battle_id is not None:
+            self.left_battle(user.battle_id, name)
+        for channel in user.channels:
+            self.channels[channel].users.discard(name)
+        self.statuses.remove(name)
+
+    def client_status(self, name, status):
+        if name in self.users:
+            self.statuses.set_status(name, status)
+
+    def battle_status(self, name, status, team_color):
+        if name in self.users:
+            self.statuses.set_battle_status(name, status, team_color)
+
+    def battle_opened(self, args):
+        battle = self.battles[args.battle_id] = Battle(args)
+        founder = self.users.get(args.founder)
+        if founder is not None:
+            founder.battle_id = args.battle_id
+        return battle
+
+    def battle_closed(self, battle_id):
+        battle = self.battles.pop(battle_id, None)
+        if battle is None:
+            return
+        for name in battle.members:
+            user = self.users.get(name)
+            if user is not None and user.battle_id == battle_id:
+                user.battle_id = None
+        if self.battle_id == battle_id:
+            self.battle_id = None
+            self.statuses.clear_battle_statuses()
+
+    def update_battle_info(self, args):
+        battle = self.battles.get(args.battle_id)
+        if battle is not None:
+            battle.spectator_count = args.spectator_count
+            battle.locked = args.locked
+            battle.map_hash = args.map_hash
+            battle.map_name = args.map_name
+
+    def joined_battle(self, battle_id, name):
+        battle = self.battles.get(battle_id)
+        if battle is not None:
+            battle.members.add(name)
+        user = self.users.get(name)
+        if user is not None:
+            user.battle_id = battle_id
+
+    def left_battle(self, battle_id, name):
+        battle = self.battles.get(battle_id)
+        if battle is not None:
+            battle.members.discard(name)
+        user = self.users.get(name)
+        if user is not None and user.battle_id == battle_id:
+            user.battle_id = None
+        if self.battle_id == battle_id:
+            if name == self.me:
+                self.battle_id = None
+                self.statuses.clear_battle_statuses()
+            else:
+                self.statuses.clear_battle_status(name)
+
+    def joined(self, channel, name):
+        self._channel(channel).users.add(name)
+        user = self.users.get(name)
+        if user is not None:
+            user.channels.add(channel)
+
+    def left(self, channel, name):
+        if name == self.me:
+            self.part(channel)
+            return
+        self._channel(channel).users.discard(name)
+        user = self.users.get(name)
+        if user is not None:
+            user.channels.discard(channel)
+
+    def part(self, channel):
+        """
+        Forget a channel we are no longer in.
+        """
+
+        removed = self.channels.pop(channel, None)
+        if removed is None:
+            return
+        for name in removed.users:
+            user = self.users.get(name)
+            if user is not None:
+                user.channels.discard(channel)
+
+
+def get_state(client):
+    state = getattr(client, "lobby_state", None)
+    if state is None:
+        state = client.lobby_state = LobbyState()
+        if getattr(client, "netid", None):
+            states[client.netid] = state
+    return state
+
+
+def create_state(client):
+    states[client.netid] = client.lobby_state = LobbyState()
+
+
+def drop_state(client):
+    # a reconnection brings a new state with netid-available
+    netid = getattr(client, "netid", None)
+    if netid is not None and states.get(netid) is getattr(client, "lobby_state", None):
+        del states[netid]
+
+
+signal("netid-available").connect(create_state)
+signal("connection-lost").connect(drop_state)
+
+
+## event handlers
+
+def handle_tasserver(message):
+    get_state(message.client).clear()
+
+
+def handle_accepted(message):
+    get_state(message.client).me = message.args.user_name
+
+
+def handle_logininfoend(message):
+    get_state(message.client).login_complete = True
+
+
+def handle_adduser(message):
+    args = message.args
+    get_state(message.client).add_user(args.user_name, args.country, args.user_id, args.lobby_id)
+
+
+def handle_removeuser(message):
+    get_state(message.client).remove_user(message.args.user_name)
+
+
+def handle_clientstatus(message):
+    args = message.args
+    get_state(message.client).client_status(args.user_name, args.status)
+
+
+def handle_clientbattlestatus(message):
+    args = message.args
+    get_state(message.client).battle_status(args.user_name, args.status, args.team_color)
+
+
+def handle_battleopened(message):
+    get_state(message.client).battle_opened(message.args)
+
+
+def handle_battleclosed(message):
+    get_state(message.client).battle_closed(message.args.battle_id)
+
+
+def handle_updatebattleinfo(message):
+    get_state(message.client).update_battle_info(message.args)
+
+
+def handle_joinedbattle(message):
+    args = message.args
+    get_state(message.client).joined_battle(args.battle_id, args.user_name)
+
+
+def handle_leftbattle(message):
+    args = message.args
+    get_state(message.client).left_battle(args.battle_id, args.user_name)
+
+
+def handle_joinbattle(message):
+    state = get_state(message.client)
+    state.battle_id = message.args.battle_id
+    if state.me:
+        state.joined_battle(state.battle_id, state.me)
+
+
+def handle_forcequitbattle(message):
+    state = get_state(message.client)
+    if state.battle_id is not None and state.me:
+        state.left_battle(state.battle_id, state.me)
+    state.battle_id = None
+    state.statuses.clear_battle_statuses()
+
+
+def handle_join(message):
+    state = get_state(message.client)
+    state._channel(message.args.channel)
+    if state.me:
+        state.joined(message.args.channel, state.me)
+
+
+def handle_clients(message):
+    args = message.args
+    state = get_state(message.client)
+    for name in (args.clients or "").split():
+        state.joined(args.channel, name)
+
+
+def handle_joined(message):
+    args = message.args
+    get_state(message.client).joined(args.channel, args.user_name)
+
+
+def handle_left(message):
+    args = message.args
+    get_state(message.client).left(args.channel, args.user_name)
+
+
+def handle_forceleavechannel(message):
+    get_state(message.client).part(message.args.channel)
+
+
+def handle_channeltopic(message):
+    args = message.args
+    channel = get_state(message.client)._channel(args.channel)
+    channel.topic, channel.topic_author = args.topic, args.author
+
+
+dispatcher.register("TASSERVER", handle_tasserver)
+dispatcher.register("ACCEPTED", handle_accepted)
+dispatcher.register("LOGININFOEND", handle_logininfoend)
+
+dispatcher.register("ADDUSER", handle_adduser)
+dispatcher.register("REMOVEUSER", handle_removeuser)
+dispatcher.register("CLIENTSTATUS", handle_clientstatus)
+dispatcher.register("CLIENTBATTLESTATUS", handle_clientbattlestatus)
+
+dispatcher.register("BATTLEOPENED", handle_battleopened)
+dispatcher.register("BATTLECLOSED", handle_battleclosed)
+dispatcher.register("UPDATEBATTLEINFO", handle_updatebattleinfo)
+dispatcher.register("JOINEDBATTLE", handle_joinedbattle)
+dispatcher.register("LEFTBATTLE", handle_leftbattle)
+dispatcher.register("JOINBATTLE", handle_joinbattle)
+dispatcher.register("FORCEQUITBATTLE", handle_forcequitbattle)
+
+dispatcher.register("JOIN", handle_join)
+dispatcher.register("CLIENTS", handle_clients)
+dispatcher.register("JOINED", handle_joined)
+dispatcher.register("LEFT", handle_left)
+dispatcher.register("FORCELEAVECHANNEL", handle_forceleavechannel)
+dispatcher.register("CHANNELTOPIC", handle_channeltopic)
+
+signal("plugin-registered").send("asyncspring.plugins.state")
@@ -5,11 +5,58 @@ from collections import defaultdict
 
 class Registry:
     def __init__(self):
-        self.mappings = set()
-        # mappings contains two-tuples (user, channel)
+        # nick -> set of channels and channel -> set of nicks, always updated together
+        self.user_channels = {}
+        self.channel_users = {}
         self.users = {}
         self.channels = {}
 
+    @property
+    def mappings(self):
+        """
+        All (user, channel) pairs. Builds a new set, prefer the indexes.
+        """
+        return {(nick, channel) for nick, channels in self.user_channels.items() for channel in channels}
+
+    def add(self, nick, channel):
+        self.user_channels.setdefault(nick, set()).add(channel)
+        self.channel_users.setdefault(channel, set()).add(nick)
+
+    def discard(self, nick, channel):
+        channels = self.user_channels.get(nick)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.user_channels[nick]
+
+        nicks = self.channel_users.get(channel)
+        if nicks is not None:
+            nicks.discard(nick)
+            if not nicks:
+                del self.channel_users[channel]
+
+    def remove_user(self, nick):
+        """
+        Drop nick from every channel it is in, returning those channels.
+        """
+        channels = self.user_channels.pop(nick, set())
+        for channel in channels:
+            nicks = self.channel_users[channel]
+            nicks.discard(nick)
+            if not nicks:
+                del self.channel_users[channel]
+        return channels
+
+    def rename(self, old_nick, new_nick):
+        channels = self.user_channels.pop(old_nick, None)
+        if channels is None:
+            return
+        self.user_channels.setdefault(new_nick, set()).update(channels)
+        for channel in channels:
+            nicks = self.channel_users[channel]
+            nicks.discard(old_nick)
+            nicks.add(new_nick)
+
 
 registries = {}
 
@@ -35,7 +82,7 @@ class User:
         return "{}!{}@{}".format(self.nick, self.user, self.host)
 
     def _get_channels(self):
-        return list(map(lambda x: x[1], filter(lambda x: x[0] == self.nick, registries[self.netid].mappings)))
+        return list(registries[self.netid].user_channels.get(self.nick, ()))
 
     def __repr__(self):
         return "User {}!{}@{}".format(self.nick, self.user, self.host)
@@ -54,7 +101,7 @@ class Channel:
         self.flags = defaultdict(set)
 
     def _get_users(self):
-        return list(map(lambda x: x[0], filter(lambda x: x[1] == self.channel, registries[self.netid].mappings)))
+        return list(registries[self.netid].channel_users.get(self.channel, ()))
 
     def __repr__(self):
         return "Channel {}".format(self.channel)
@@ -237,7 +284,7 @@ def handle_join(message, user, channel, real=True):
     if user.nick == message.client.nickname and real:
         sync_channel(message.client, channel)
         get_channel(message, channel).available = True
-    message.client.tracking_registry.mappings.add((user.nick, channel))
+    message.client.tracking_registry.add(user.nick, channel)
 
 
 @extjoin.connect
@@ -259,20 +306,19 @@ def handle_part(message, user, channel, reason):
     user = get_user(message, user.nick)
     if user == message.client.nickname:
         get_channel(message, channel).available = False
-    message.client.tracking_registry.mappings.discard((user.nick, channel))
+    message.client.tracking_registry.discard(user.nick, channel)
 
 
 @quit_.connect
 def handle_quit(message, user, reason):
     user = get_user(message, user.nick)
     del message.client.tracking_registry.users[user.nick]
-    for channel in set(user.channels):
-        message.client.tracking_registry.mappings.remove((user.nick, channel))
+    message.client.tracking_registry.remove_user(user.nick)
 
 
 @kick.connect
 def handle_kick(message, kicker, kickee, channel, reason):
-    message.client.tracking_registry.mappings.discard((kickee, channel))
+    message.client.tracking_registry.discard(getattr(kickee, "nick", kickee), channel)
 
 
 @nick.connect
@@ -283,13 +329,7 @@ def handle_nick(message, user, new_nick):
     user.nick = new_nick
     del message.client.tracking_registry.users[old_nick]
     message.client.tracking_registry.users[new_nick] = user
-
-    mappings = set(message.client.tracking_registry.mappings)
-    original_mappings = message.client.tracking_registry.mappings
-    for i in mappings:
-        if i[0] == old_nick:
-            original_mappings.discard(i)
-            original_mappings.add((new_nick, i[1]))
+    message.client.tracking_registry.rename(old_nick, new_nick)
 
 
 @mode_set.connect
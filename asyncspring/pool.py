@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import asyncio
+import logging
+import collections
+
+from asyncspring import lobby, encoder
+from asyncspring.protocol import connections
+from asyncspring.sendqueue import lane_for
+from asyncspring.plugins.core import heartbeat
+
+log = logging.getLogger(__name__)
+
+IDLE = "idle"
+CONNECTING = "connecting"
+ONLINE = "online"
+DENIED = "denied"
+FAILED = "failed"
+STOPPED = "stopped"
+
+
+class Session:
+    """
+    One account of a ConnectionPool and the connection logged in with it.
+    """
+
+    def __init__(self, username, password, channels=(), flags=None):
+        self.username = username
+        self.password = password
+        self.channels = list(channels)
+        self.flags = flags
+
+        self.client = None
+        self.state = IDLE
+        self.error = None
+        self.login_latency = None
+        self.restarts = 0
+
+    @property
+    def online(self):
+        client = self.client
+        return (self.state == ONLINE and client is not None and client.work
+                and client.registration_complete)
+
+    @property
+    def load(self):
+        """
+        Lines waiting in the send queue of this account.
+        """
+
+        return len(self.client.queue) if self.client is not None else 0
+
+    @property
+    def lag(self):
+        if self.client is None:
+            return None
+        history = heartbeat.lag_history(self.client.protocol)
+        return history[-1] if history else None
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "online": self.online,
+            "load": self.load,
+            "lag": self.lag,
+            "login_latency": self.login_latency,
+            "restarts": self.restarts,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return "Session {} ({})".format(self.username, self.state)
+
+
+class ConnectionPool:
+    """
+    Many accounts logged in to the same server from one event loop.
+
+    start() connects every account, spacing the logins `stagger` seconds
+    apart and keeping at most `max_pending` of them in flight so the server
+    login throttle is not hit. Commands go to a named account or to the
+    online one with the shortest send queue; broadcast() queues a line on
+    every online account. check() reports unhealthy sessions and restarts
+    those that are gone for good.
+    """
+
+    def __init__(self, server, port=8200, use_ssl=False, stagger=0.5, max_pending=10,
+                 connect_timeout=10, login_timeout=30):
+        self.server = server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.stagger = stagger
+        self.max_pending = max_pending
+        self.connect_timeout = connect_timeout
+        self.login_timeout = login_timeout
+
+        self.sessions = collections.OrderedDict()
+        self.health_task = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(self.sessions.values())
+
+    def __getitem__(self, username):
+        return self.sessions[username].client
+
+    def add(self, username, password, channels=(), flags=None):
+        """
+        Add an account to the pool. It is connected by the next start().
+        """
+
+        if username in self.sessions:
+            raise ValueError("account {} is already in the pool".format(username))
+
+        session = self.sessions[username] = Session(username, password, channels, flags)
+        return session
+
+    async def start(self):
+        """
+        Connect and log in every account that is not online yet. Returns
+        the sessions that made it online.
+        """
+
+        pending = asyncio.Semaphore(self.max_pending)
+        sessions = [session for session in self.sessions.values() if session.state in (IDLE, FAILED, STOPPED)]
+
+        async def start_one(index, session):
+            await asyncio.sleep(index * self.stagger)
+            async with pending:
+                await self._start(session)
+
+        await asyncio.gather(*(start_one(index, session) for index, session in enumerate(sessions)))
+        return [session for session in sessions if session.online]
+
+    async def _start(self, session):
+        loop = asyncio.get_event_loop()
+        session.state = CONNECTING
+        session.error = None
+        started = loop.time()
+
+        try:
+            client = await asyncio.wait_for(lobby.connect(self.server, self.port, self.use_ssl),
+                                            self.connect_timeout)
+        except asyncio.TimeoutError:
+            session.state = FAILED
+            session.error = "connect timeout"
+            return
+
+        session.client = client
+        client.protocol.channels_to_join = list(session.channels)
+
+        logged_in = loop.create_future()
+
+        def on_accepted(message):
+            if not logged_in.done():
+                logged_in.set_result(True)
+
+        def on_denied(message):
+            if not logged_in.done():
+                logged_in.set_result(False)
+
+        client.events.signal("accepted").connect(on_accepted)
+        client.events.signal("denied").connect(on_denied)
+        try:
+            client.login(session.username, session.password, session.flags)
+            accepted = await asyncio.wait_for(logged_in, self.login_timeout)
+        except asyncio.TimeoutError:
+            session.state = FAILED
+            session.error = "login timeout"
+            self._close(session)
+            return
+        finally:
+            client.events.signal("accepted").disconnect(on_accepted)
+            client.events.signal("denied").disconnect(on_denied)
+
+        if not accepted:
+            session.state = DENIED
+            session.error = "login denied"
+            self._close(session)
+            return
+
+        session.state = ONLINE
+        session.login_latency = loop.time() - started
+
+    def _close(self, session):
+        client = session.client
+        if client is None:
+            return
+
+        client.protocol.autoreconnect = False
+        if client.protocol.transport is not None:
+            client.protocol.transport.close()
+        connections.pop(getattr(client, "netid", None), None)
+
+    async def stop(self):
+        """
+        Log every account out and close its connection.
+        """
+
+        self.stop_health_checks()
+        for session in self.sessions.values():
+            if session.client is not None and session.client.work:
+                session.client.writeln("EXIT")
+                session.client.process_queue()
+            self._close(session)
+            session.state = STOPPED
+
+        # let the transports close
+        await asyncio.sleep(0)
+
+    async def remove(self, username):
+        session = self.sessions.pop(username)
+        self._close(session)
+        session.state = STOPPED
+
+    # health
+
+    def check(self, max_lag=None):
+        """
+        Return the sessions that are not healthy: not online, or with a
+        ping lag above max_lag. Sessions whose connection is gone and is not
+        coming back are marked failed, to be restarted by the next start().
+        """
+
+        unhealthy = []
+        for session in self.sessions.values():
+            if session.state == ONLINE and not session.online:
+                if session.client.work or session.client in lobby.reconnector.reconnecting:
+                    # reconnecting, or logging in again
+                    unhealthy.append(session)
+                    continue
+                session.state = FAILED
+                session.error = "connection lost"
+
+            if session.state != ONLINE:
+                if session.state != STOPPED:
+                    unhealthy.append(session)
+                continue
+
+            lag = session.lag
+            if max_lag is not None and lag is not None and lag > max_lag:
+                unhealthy.append(session)
+
+        return unhealthy
+
+    def start_health_checks(self, interval=30, max_lag=None):
+        """
+        Check the pool every interval seconds, restarting failed sessions.
+        """
+
+        async def run():
+            while True:
+                await asyncio.sleep(interval)
+                failed = [session for session in self.check(max_lag) if session.state == FAILED]
+                if failed:
+                    log.warning("restarting {} failed session(s)".format(len(failed)))
+                    for session in failed:
+                        session.restarts += 1
+                    await self.start()
+
+        self.stop_health_checks()
+        self.health_task = asyncio.ensure_future(run())
+        return self.health_task
+
+    def stop_health_checks(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+
+    # routing
+
+    def online(self):
+        return [session for session in self.sessions.values() if session.online]
+
+    def pick(self, username=None):
+        """
+        Return the client of account username, or of the online account
+        with the fewest lines waiting to be sent.
+        """
+
+        if username is not None:
+            session = self.sessions[username]
+            if not session.online:
+                raise LookupError("account {} is not online".format(username))
+            return session.client
+
+        online = self.online()
+        if not online:
+            raise LookupError("no account is online")
+        return min(online, key=lambda session: session.load).client
+
+    def send(self, line, username=None, lane=None):
+        """
+        Queue a raw line on one account, see pick().
+        """
+
+        return self.pick(username).writeln(line, lane)
+
+    def say(self, channel, message, username=None):
+        self.pick(username).say(channel, message)
+
+    def say_private(self, user, message, username=None):
+        self.pick(username).say_private(user, message)
+
+    def broadcast(self, line, lane=None):
+        """
+        Queue a raw line on every online account. Returns how many got it.
+        """
+
+        data = encoder.encode(line)
+        lane = lane or lane_for(data)
+        clients = [session.client.protocol for session in self.sessions.values() if session.online]
+        for client in clients:
+            client.queue.append_encoded(data, lane)
+        for client in clients:
+            client.flusher.notify()
+        return len(clients)
+
+    def stats(self):
+        states = collections.Counter(session.state for session in self.sessions.values())
+        latencies = [session.login_latency for session in self.sessions.values() if session.login_latency is not None]
+        return {
+            "sessions": len(self.sessions),
+            "online": len(self.online()),
+            "states": dict(states),
+            "load": sum(session.load for session in self.sessions.values()),
+            "avg_login_latency": sum(latencies) / len(latencies) if latencies else 0,
+            "max_login_latency": max(latencies, default=0),
+        }
@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 # coding=utf-8
 
-import re
 import asyncio
 import importlib
 import collections
 import logging
-from copy import copy
 
 from hashlib import md5
 from base64 import b64encode
 
 from asyncblink import signal, ANY
 
+from asyncspring import encoder
+from asyncspring.bridge import sanitize
+from asyncspring.capture import INBOUND, OUTBOUND
+from asyncspring.events import EventBus, emit
+from asyncspring.flush import FlushScheduler
+from asyncspring.framer import LineFramer, DEFAULT_MAX_LINE_LENGTH
+from asyncspring.request import Requests
+from asyncspring.sendqueue import SendQueue, lane_for
+from asyncspring.stream import EventStream, DROP_OLDEST
+
 connections = {}
 
 plugins = []
@@ -61,11 +69,14 @@ class LobbyProtocol(asyncio.Protocol):
     Represents a connection to SpringRTS Lobby.
     """
 
-    def __init__(self, bot_username, bot_password, client_name, client_flags):
+    def __init__(self, bot_username=None, bot_password=None, client_name="asyncspring", client_flags="",
+                 flood_class=None):
         self.bot_username = bot_username
-        self.bot_password = encode_password(bot_password)
+        self.bot_password = encode_password(bot_password) if bot_password else None
         self.client_name = client_name
         self.client_flags = client_flags
+        # the FLOOD_LIMITS class to send at; None follows the account's status
+        self.flood_class = flood_class
 
         self.loop = None
         self.work = False
@@ -75,16 +86,26 @@ class LobbyProtocol(asyncio.Protocol):
         self.last_ping = float('inf')
         self.last_pong = 0
         self.lag = 0
-        self.buf = ""
+        self.max_line_length = DEFAULT_MAX_LINE_LENGTH
+        self.framer = LineFramer(self.max_line_length)
         self.old_nickname = None
         self.server_supports = collections.defaultdict(lambda *_: None)
-        self.queue = list()
-        self.queue_timer = 0.25  # seconds
+        self.queue = SendQueue()
+        if flood_class is not None:
+            self.queue.set_flood_limit(flood_class)
+        self.flusher = FlushScheduler(self)
         self.caps = set()
         self.registration_complete = False
         self.channels_to_join = list()
+        self.battle_id = None
+        self.battle_password = None
+        self.battle_to_join = None
         self.autoreconnect = True
         self.signals = None
+        self.events = EventBus()
+        self.recorder = None
+        self.requests = Requests()
+        self.read_holds = set()
 
     def connection_made(self, transport):
         self.loop = asyncio.get_event_loop()
@@ -94,11 +115,9 @@ class LobbyProtocol(asyncio.Protocol):
         self.last_ping = float('inf')
         self.last_pong = 0
         self.lag = 0
-        self.buf = ""
+        self.framer = LineFramer(self.max_line_length)
         self.old_nickname = None
         self.server_supports = collections.defaultdict(lambda *_: None)
-        self.queue = []
-        self.queue_timer = 1.0  # seconds
         self.caps = set()
         self.registration_complete = False
 
@@ -106,59 +125,73 @@ class LobbyProtocol(asyncio.Protocol):
 
         self.signals["connected"] = signal("connected")
         self.signals["raw"] = signal("raw")
+        self.signals["raw-batch"] = signal("raw-batch")
         self.signals["connection-lost"] = signal("connection-lost")
         self.signals["lobby-send"] = signal("lobby-send")
         self.signals["registration-complete"] = signal("registration-complete")
         self.signals["login-complete"] = signal("login-complete")
 
-        self.signals["connected"].send(self)
+        # before "connected", whose handlers may already queue lines
+        self.flusher.attach(self.loop, transport)
 
-        self.logger.debug("Connection success.")
+        emit(self.events, self.signals["connected"], self)
 
-        self.process_queue()
+        self.logger.debug("Connection success.")
 
     def data_received(self, data):
         if not self.work:
             return
 
-        data = data.decode()
+        if self.recorder is not None:
+            self.recorder.record(INBOUND, data)
+
+        lines = self.framer.feed(data)
+        if not lines:
+            return
 
-        self.buf += data
-        while "\n" in self.buf:
-            index = self.buf.index("\n")
-            line_received = self.buf[:index].strip()
-            self.buf = self.buf[index + 1:]
-            self.logger.debug("RECEIVED: {}".format(line_received))
-            self.signals["raw"].send(self, text=line_received)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for line_received in lines:
+                self.logger.debug("RECEIVED: {}".format(line_received))
+
+        self.signals["raw-batch"].send(self, lines=lines)
 
     def connection_lost(self, exc):
         if not self.work:
             return
 
         self.logger.critical("Connection lost.")
-        self.signals["connection-lost"].send(self.wrapper)
+        self.work = False
+        # joins made from now on wait in channels_to_join for the next login
+        self.registration_complete = False
+        self.flusher.close()
+        self.requests.fail_all(ConnectionError("connection lost"))
+        emit(self.events, self.signals["connection-lost"], self.wrapper)
 
     # Core helper functions
 
+    def pause_writing(self):
+        self.flusher.pause()
+
+    def resume_writing(self):
+        self.flusher.resume()
+
     def process_queue(self):
         """
-        Pull data from the pending messages queue and send it. Schedule ourself
-        to be executed again later.
+        Send everything in the pending messages queue right away, without
+        waiting for the flush scheduler.
         """
 
-        if not self.work:
-            return
+        self.flusher.close()
+        self.flusher.flush()
 
-        if len(self.queue) > 0:
-            self.logger.debug(f"handle {len(self.queue)} messages")
-            # self._writeln(self.queue.pop(0))
-            messages = copy("\r\n".join(self.queue))
-            self._write(f"{messages}\r\n")
-            self.queue.clear()
-
-        self.loop.call_later(self.queue_timer, self.process_queue)
+    def on(self, event, global_bus=False, executor=None, key=None):
+        """
+        Register a handler for event on this connection only, or for every
+        connection in the process when global_bus is set.
 
-    def on(self, event):
+        With an executor (see asyncspring.executor), calls go through it
+        rather than straight from the signal, ordered by key if given.
+        """
 
         def process(f):
             """
@@ -166,12 +199,41 @@ class LobbyProtocol(asyncio.Protocol):
             """
             self.logger.info("Registering function {} for event {}".format(f.__name__, event))
 
-            signal(event).connect(f, sender=ANY, weak=False)
+            receiver = f if executor is None else executor.wrap(f, key)
+            if global_bus:
+                signal(event).connect(receiver, sender=ANY, weak=False)
+            else:
+                self.events.signal(event).connect(receiver, weak=False)
 
             return f
 
         return process
 
+    def stream(self, event, maxsize=1000, policy=DROP_OLDEST, key=None, **filters):
+        """
+        Subscribe to event on this connection as an async iterator with a
+        bounded buffer (see asyncspring.stream), e.g.
+
+            async for event in client.stream("said", channel="main"):
+                ...
+        """
+
+        return EventStream(self.wrapper or self, event, maxsize, policy, key, **filters)
+
+    def hold_reading(self, holder):
+        """
+        Stop reading from the server until every holder has released it.
+        """
+
+        if not self.read_holds and self.transport is not None:
+            self.transport.pause_reading()
+        self.read_holds.add(holder)
+
+    def release_reading(self, holder):
+        self.read_holds.discard(holder)
+        if not self.read_holds and self.transport is not None and not self.transport.is_closing():
+            self.transport.resume_reading()
+
     def _write(self, line):
         """
         Send a raw message to SpringRTS Lobby immediately.
@@ -180,9 +242,28 @@ class LobbyProtocol(asyncio.Protocol):
         if not isinstance(line, bytes):
             line = line.encode("utf-8")
 
-        self.logger.debug(f"SENT: {line}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"SENT: {line}")
+        if self.recorder is not None:
+            self.recorder.record(OUTBOUND, line)
         self.transport.write(line)
-        self.signals["lobby-send"].send(line)
+        if self.signals["lobby-send"].receivers:
+            self.signals["lobby-send"].send(line)
+
+    def _writelines(self, chunks):
+        """
+        Send encoded lines to SpringRTS Lobby immediately, without joining
+        them first.
+        """
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for chunk in chunks:
+                self.logger.debug(f"SENT: {chunk}")
+        if self.recorder is not None:
+            self.recorder.record_many(OUTBOUND, chunks)
+        self.transport.writelines(chunks)
+        if self.signals["lobby-send"].receivers:
+            self.signals["lobby-send"].send(b"".join(chunks))
 
     def _writeln(self, line):
         """
@@ -197,14 +278,80 @@ class LobbyProtocol(asyncio.Protocol):
         self.transport.write(line)
         self.signals["lobby-send"].send(line)
 
-    def writeln(self, line):
+    def writeln(self, line, lane=None):
         """
         Queue a message for sending to the currently connected SpringRTS Lobby server.
+        The priority lane is picked from the command unless given.
+        """
+
+        self.queue.append(line, lane)
+        self.flusher.notify()
+        return self
+
+    def write_encoded(self, data, lane=None):
+        """
+        Queue a line already encoded by asyncspring.encoder, CRLF included.
         """
 
-        self.queue.append(line)
+        self.queue.append_encoded(data, lane)
+        self.flusher.notify()
         return self
 
+    def _say(self, verb, target, message, strip):
+        """
+        Queue message to target with command verb, in as many lines as the
+        server's length limit needs. Line breaks are replaced by strip.
+        """
+
+        message = message.replace("\n", strip).replace("\r", strip)
+        prefix = encoder.verb(verb) + target.encode("utf-8") + b" "
+        lane = lane_for(prefix)
+        append = self.queue.append_encoded
+        for data in encoder.chunks(prefix, message):
+            append(data, lane)
+        self.flusher.notify()
+
+    def _fan_out(self, verb, targets, message, strip):
+        message = message.replace("\n", strip).replace("\r", strip)
+        longest = max((len(target.encode("utf-8")) for target in targets), default=0)
+        budget = encoder.budget(len(encoder.verb(verb)) + longest + 1)
+        lane = lane_for(encoder.verb(verb))
+        append = self.queue.append_encoded
+        for chunk in encoder.split(message, budget):
+            for data in encoder.fan_out(verb, targets, chunk):
+                append(data, lane)
+        self.flusher.notify()
+
+    def say_many(self, channels, message):
+        """
+        Say the same message in several channels, encoding it once.
+        """
+
+        self._fan_out("SAY", channels, message, " ")
+
+    def say_private_many(self, usernames, message):
+        """
+        Send the same private message to several users, encoding it once.
+        """
+
+        self._fan_out("SAYPRIVATE", usernames, message, "")
+
+    async def request(self, line, timeout=10, success=None, failure=None, lane=None):
+        """
+        Send a command tagged with a message ID and wait for the server's
+        reply to it, which is returned as a LobbyMessage. Raises
+        RequestFailed if the reply is a failure (JOINFAILED, DENIED, ...),
+        asyncio.TimeoutError after timeout seconds and ConnectionError if
+        the connection is lost meanwhile.
+
+        The verbs of a successful reply and of a failure are looked up in
+        request.REPLIES unless given; without them, any reply will do.
+        """
+
+        request = self.requests.add(line, success, failure)
+        self.writeln("#{} {}".format(request.msg_id, line), lane)
+        return await self.requests.wait(request, timeout)
+
     def register(self, username, password, email=None):
         """
         Queue registration with the server. This includes sending nickname,
@@ -221,7 +368,7 @@ class LobbyProtocol(asyncio.Protocol):
             self.writeln("REGISTER {} {}".format(self.bot_username, self.bot_password))
 
         self.logger.info("Sent registration information")
-        self.signals["registration-complete"].send(self)
+        emit(self.events, self.signals["registration-complete"], self)
         self.nickname = self.bot_username
 
     def accept(self):
@@ -236,10 +383,12 @@ class LobbyProtocol(asyncio.Protocol):
         """
         self.bot_username = username
         self.bot_password = encode_password(password)
+        self.nickname = username
 
         if flags:
-            self.flags = flags
+            self.client_flags = flags
 
+        self._login()
         return self
 
     def _login(self):
@@ -250,17 +399,15 @@ class LobbyProtocol(asyncio.Protocol):
                                                                self.bot_password,
                                                                self.client_name,
                                                                self.client_flags))
-        self.signals["login-complete"].send(self)
+        emit(self.events, self.signals["login-complete"], self)
         self.logger.debug("Login Complete")
 
     def bridged_client_from(self, location, external_id, external_username):
         """
-        Initialized the bridge
+        Initialized the bridge. Bridge keeps track of bridged users and only
+        sends this when needed.
         """
-        
-        name = re.sub('[^A-Za-z0-9]+', '', str(external_username))
-
-        self.writeln("BRIDGECLIENTFROM {} {} {}".format(location, external_id, name))
+        self.writeln("BRIDGECLIENTFROM {} {} {}".format(location, external_id, sanitize(external_username)))
 
     def un_bridged_client_from(self, location, external_id):
         """
@@ -284,17 +431,18 @@ class LobbyProtocol(asyncio.Protocol):
         """
         Say from remote server.
         """
-        message = body.replace("\n", " ").replace("\r", " ")
-
-        while message:
-            self.writeln("SAYFROM {} {} {} {}".format(channel, domain, user, message[:200]))
-            message = message[400:]
+        self._say("SAYFROM", "{} {} {}".format(channel, domain, user), body, " ")
 
     def join(self, channel):
         """
-        Join a channel.
+        Join a channel. Before login it is joined once ACCEPTED arrives, and
+        it is joined again after a reconnection.
         """
-        self.writeln("JOIN {}".format(channel))
+        if channel not in self.channels_to_join:
+            self.channels_to_join.append(channel)
+
+        if self.registration_complete:
+            self.writeln("JOIN {}".format(channel))
 
         return self
 
@@ -302,20 +450,42 @@ class LobbyProtocol(asyncio.Protocol):
         """
         Leave a channel.
         """
+        if channel in self.channels_to_join:
+            self.channels_to_join.remove(channel)
 
         self.writeln("LEAVE {}".format(channel))
 
+    def join_battle(self, battle_id, password=None):
+        """
+        Join a battle. Before login it is joined once ACCEPTED arrives, and
+        it is joined again after a reconnection.
+        """
+        self.battle_password = password
+
+        if not self.registration_complete:
+            self.battle_to_join = (battle_id, password)
+        elif password:
+            self.writeln("JOINBATTLE {} {}".format(battle_id, password))
+        else:
+            self.writeln("JOINBATTLE {}".format(battle_id))
+
+        return self
+
+    def leave_battle(self):
+        """
+        Leave the current battle.
+        """
+        self.battle_id = None
+        self.battle_password = None
+        self.writeln("LEAVEBATTLE")
+
     def say(self, channel, message):
         """
         Send a MSG to SpringRTS Lobby room.
         Carriage returns and line feeds are stripped to prevent bugs.
         """
 
-        message = message.replace("\n", " ").replace("\r", " ")
-
-        while message:
-            self.writeln("SAY {} {}".format(channel, message[:400]))
-            message = message[400:]
+        self._say("SAY", channel, message, " ")
 
     def say_ex(self, channel, message):
         """
@@ -323,11 +493,7 @@ class LobbyProtocol(asyncio.Protocol):
         Carriage returns and line feeds are stripped to prevent bugs.
         """
 
-        message = message.replace("\n", "").replace("\r", "")
-
-        while message:
-            self.writeln("SAYEX {} {}".format(channel, message[:400]))
-            message = message[400:]
+        self._say("SAYEX", channel, message, "")
 
     def say_private(self, username, message):
         """
@@ -335,11 +501,7 @@ class LobbyProtocol(asyncio.Protocol):
         Carriage returns and line feeds are stripped to prevent bugs.
         """
 
-        message = message.replace("\n", "").replace("\r", "")
-
-        while message:
-            self.writeln("SAYPRIVATE {} :{}".format(username, message[:400]))
-            message = message[400:]
+        self._say("SAYPRIVATE", username, message, "")
 
     def say_private_ex(self, username, message):
         """
@@ -347,11 +509,7 @@ class LobbyProtocol(asyncio.Protocol):
         Carriage returns and line feeds are stripped to prevent bugs.
         """
 
-        message = message.replace("\n", "").replace("\r", "")
-
-        while message:
-            self.writeln("SAYPRIVATEEX {} :{}".format(username, message[:400]))
-            message = message[400:]
+        self._say("SAYPRIVATEEX", username, message, "")
 
     def ping(self):
         self.writeln("PING")
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import random
+import asyncio
+import logging
+import collections
+
+from asyncblink import signal
+
+from asyncspring.events import emit
+from asyncspring.protocol import LobbyProtocol
+from asyncspring.sendqueue import KEEPALIVE
+
+log = logging.getLogger(__name__)
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter: the delay before attempt n is drawn
+    between (1 - jitter) and 1 times min(cap, base * factor ** n), so bots
+    that lost the same server don't all come back at the same instant.
+    """
+
+    def __init__(self, base=1.0, factor=2.0, cap=120.0, jitter=0.5, rnd=random.random):
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+        self.rnd = rnd
+
+    def delay(self, attempt):
+        ceiling = min(self.cap, self.base * self.factor ** attempt)
+        return ceiling * (1 - self.jitter * self.rnd())
+
+
+def _current(lane, data):
+    """
+    Whether a line queued for a lost connection still means something on
+    the next one: pings and logins are for the dead link only.
+    """
+
+    if lane == KEEPALIVE:
+        return False
+    if data.startswith(b"#"):
+        data = data[data.find(b" ") + 1:]
+    return data.split(b" ", 1)[0].rstrip(b"\r\n") not in (b"LOGIN", b"PING")
+
+
+def successor(old):
+    """
+    Build the protocol replacing old after a reconnection, carrying over
+    everything a session needs to be restored: credentials, event
+    handlers, channels, battle, and the chat still waiting to be sent.
+    """
+
+    protocol = LobbyProtocol(client_name=old.client_name, client_flags=old.client_flags,
+                             flood_class=old.flood_class)
+    protocol.bot_username = old.bot_username
+    protocol.bot_password = old.bot_password
+    protocol.nickname = getattr(old, "nickname", old.bot_username)
+    protocol.events = old.events
+    protocol.recorder = old.recorder
+    protocol.autoreconnect = old.autoreconnect
+    protocol.channels_to_join = list(old.channels_to_join)
+    protocol.max_line_length = old.max_line_length
+
+    if old.battle_id is not None:
+        protocol.battle_to_join = (old.battle_id, old.battle_password)
+    else:
+        protocol.battle_to_join = old.battle_to_join
+
+    # the rest waits for the new login and rejoin, see _release_held in
+    # plugins/core.py
+    old.queue.hold(_current)
+    protocol.queue = old.queue
+
+    protocol.flusher.window = old.flusher.window
+    protocol.flusher.high_water = old.flusher.high_water
+    protocol.flusher.low_water = old.flusher.low_water
+
+    for attr in ("netid", "server_info"):
+        if hasattr(old, attr):
+            setattr(protocol, attr, getattr(old, attr))
+
+    return protocol
+
+
+class ReconnectManager:
+    """
+    Brings lost connections back.
+
+    Attempts go through `servers` in turn (by default only the server the
+    connection was made to), each bounded by `connect_timeout`, with
+    `backoff` between them. Once connected, the new protocol replaces the
+    old one behind the wrapper, logs in again and, when ACCEPTED, rejoins
+    its channels and battle, then sends what was still queued.
+
+    Latency from losing the connection to being connected again, and to
+    being logged in again, is kept in `history`.
+    """
+
+    def __init__(self, servers=None, backoff=None, connect_timeout=10, login_timeout=30, history=100):
+        self.servers = servers
+        self.backoff = backoff or Backoff()
+        self.connect_timeout = connect_timeout
+        self.login_timeout = login_timeout
+
+        self.reconnecting = set()
+        self.reconnects = 0
+        self.failures = 0
+        self.history = collections.deque(maxlen=history)
+
+    def _servers(self, client_wrapper):
+        current = client_wrapper.server_info
+        servers = list(self.servers or [])
+        if current in servers:
+            servers.remove(current)
+        return [current] + servers
+
+    async def reconnect(self, client_wrapper):
+        if client_wrapper in self.reconnecting:
+            return
+        self.reconnecting.add(client_wrapper)
+
+        try:
+            await self._reconnect(client_wrapper)
+        finally:
+            self.reconnecting.discard(client_wrapper)
+
+    async def _reconnect(self, client_wrapper):
+        loop = asyncio.get_event_loop()
+        old = client_wrapper.protocol
+        servers = self._servers(client_wrapper)
+        started = loop.time()
+        attempt = 0
+
+        log.info("reconnecting")
+        while True:
+            delay = self.backoff.delay(attempt)
+            await asyncio.sleep(delay)
+
+            server_info = servers[attempt % len(servers)]
+            attempt += 1
+            try:
+                transport, protocol = await asyncio.wait_for(
+                    loop.create_connection(lambda: successor(old), **server_info), self.connect_timeout)
+                break
+            except (OSError, asyncio.TimeoutError) as conn_error:
+                self.failures += 1
+                log.info("reconnect attempt {} to {} failed: {!r}".format(attempt, server_info["host"], conn_error))
+
+        connect_latency = loop.time() - started
+
+        protocol.server_info = server_info
+        protocol.wrapper = client_wrapper
+        client_wrapper.protocol = protocol
+        self.reconnects += 1
+
+        signal("netid-available").send(protocol)
+
+        accepted = None
+        if protocol.bot_username and protocol.bot_password:
+            accepted = loop.create_future()
+
+            def on_accepted(message):
+                if not accepted.done():
+                    accepted.set_result(loop.time())
+
+            protocol.events.signal("accepted").connect(on_accepted)
+            protocol._login()
+
+        emit(protocol.events, signal("reconnected"), client_wrapper)
+
+        login_latency = None
+        if accepted is not None:
+            try:
+                login_latency = await asyncio.wait_for(accepted, self.login_timeout) - started
+            except asyncio.TimeoutError:
+                log.warning("no ACCEPTED {}s after reconnecting".format(self.login_timeout))
+            finally:
+                protocol.events.signal("accepted").disconnect(on_accepted)
+
+        self.history.append({
+            "netid": getattr(protocol, "netid", None),
+            "server": server_info["host"],
+            "attempts": attempt,
+            "connect_latency": connect_latency,
+            "login_latency": login_latency,
+        })
+        log.info("reconnected after {} attempt(s) in {:.2f}s".format(attempt, connect_latency))
+
+    def stats(self):
+        latencies = [entry["connect_latency"] for entry in self.history]
+        logins = [entry["login_latency"] for entry in self.history if entry["login_latency"] is not None]
+        return {
+            "reconnecting": len(self.reconnecting),
+            "reconnects": self.reconnects,
+            "failed_attempts": self.failures,
+            "avg_connect_latency": sum(latencies) / len(latencies) if latencies else 0,
+            "max_connect_latency": max(latencies, default=0),
+            "avg_login_latency": sum(logins) / len(logins) if logins else 0,
+            "max_login_latency": max(logins, default=0),
+        }
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Awaitable commands.
+
+A command sent as "#<id> COMMAND ..." has every reply the server sends
+for it tagged with the same "#<id> " prefix. Requests uses that to hand
+each reply to the request that caused it, so a bot can await the outcome
+of a command instead of watching for unrelated signals:
+
+    await client.request("JOIN main")
+    try:
+        await client.request("JOINBATTLE 12", timeout=5)
+    except RequestFailed as e:
+        log.info("could not join: {}".format(e.message.rest))
+
+Any number of requests can be in flight at once.
+"""
+
+import asyncio
+import itertools
+
+# command verb -> (verbs that complete it, verbs that fail it)
+REPLIES = {
+    "LOGIN": ({"ACCEPTED"}, {"DENIED", "AGREEMENT"}),
+    "REGISTER": ({"REGISTRATIONACCEPTED"}, {"REGISTRATIONDENIED"}),
+    "PING": ({"PONG"}, set()),
+    "JOIN": ({"JOIN"}, {"JOINFAILED"}),
+    "JOINBATTLE": ({"JOINBATTLE"}, {"JOINBATTLEFAILED"}),
+    "OPENBATTLE": ({"OPENBATTLE"}, {"OPENBATTLEFAILED"}),
+    "SAYPRIVATE": ({"SAYPRIVATE"}, set()),
+    "SAYPRIVATEEX": ({"SAYPRIVATEEX"}, set()),
+    "CHANNELS": ({"ENDOFCHANNELS"}, set()),
+    "FRIENDLIST": ({"FRIENDLISTEND"}, set()),
+}
+
+# fail any request
+FAILURES = {"FAILED"}
+
+
+class RequestFailed(Exception):
+    """
+    The server answered a request with a failure; message is the reply.
+    """
+
+    def __init__(self, message):
+        super().__init__("{} {}".format(message.verb, message.rest))
+        self.message = message
+
+
+class Request:
+    __slots__ = ("msg_id", "line", "future", "success", "failure", "replies")
+
+    def __init__(self, msg_id, line, future, success, failure):
+        self.msg_id = msg_id
+        self.line = line
+        self.future = future
+        self.success = success
+        self.failure = failure
+        self.replies = []
+
+
+class Requests:
+    """
+    The requests a connection is waiting on, by message ID.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.ids = itertools.count(1)
+
+        self.sent = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, line, success=None, failure=None):
+        """
+        Register a request for line and return it; its tagged line is
+        "#<msg_id> <line>".
+        """
+
+        verb = line.split(" ", 1)[0].upper()
+        expected_success, expected_failure = REPLIES.get(verb, (None, set()))
+        if success is None:
+            success = expected_success
+        if failure is None:
+            failure = expected_failure
+
+        msg_id = next(self.ids)
+        future = asyncio.get_event_loop().create_future()
+        request = self.pending[msg_id] = Request(msg_id, line, future, success, failure | FAILURES)
+        self.sent += 1
+        return request
+
+    def resolve(self, message):
+        """
+        Hand a reply tagged with a message ID to its request. Without an
+        expected success verb, the first reply completes the request.
+        """
+
+        request = self.pending.get(message.msg_id)
+        if request is None:
+            return
+
+        request.replies.append(message)
+        if message.verb in request.failure:
+            del self.pending[message.msg_id]
+            self.failed += 1
+            if not request.future.done():
+                request.future.set_exception(RequestFailed(message))
+        elif request.success is None or message.verb in request.success:
+            del self.pending[message.msg_id]
+            self.completed += 1
+            if not request.future.done():
+                request.future.set_result(message)
+
+    def discard(self, request):
+        self.pending.pop(request.msg_id, None)
+
+    def fail_all(self, exc):
+        """
+        Fail every pending request, e.g. when the connection is lost.
+        """
+
+        pending, self.pending = self.pending, {}
+        for request in pending.values():
+            if not request.future.done():
+                request.future.set_exception(exc)
+
+    async def wait(self, request, timeout):
+        try:
+            return await asyncio.wait_for(request.future, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        finally:
+            self.discard(request)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "sent": self.sent,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+        }
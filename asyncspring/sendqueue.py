@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import time
+import collections
+
+from asyncspring.encoder import encode
+
+CONTROL = "control"
+KEEPALIVE = "keepalive"
+MODERATION = "moderation"
+CHAT = "chat"
+
+# lane name -> deficit round robin quantum in bytes, in priority order
+LANES = collections.OrderedDict([
+    (KEEPALIVE, 512),
+    (CONTROL, 4096),
+    (MODERATION, 2048),
+    (CHAT, 1024),
+])
+
+VERB_LANES = {
+    "PING": KEEPALIVE,
+
+    "KICK": MODERATION,
+    "KICKUSER": MODERATION,
+    "KICKFROMBATTLE": MODERATION,
+    "MUTE": MODERATION,
+    "UNMUTE": MODERATION,
+    "BAN": MODERATION,
+    "UNBAN": MODERATION,
+    "BANIP": MODERATION,
+    "UNBANIP": MODERATION,
+    "BANSPECIFIC": MODERATION,
+    "FORCELEAVECHANNEL": MODERATION,
+    "FORCETEAMNO": MODERATION,
+    "FORCEALLYNO": MODERATION,
+    "FORCETEAMCOLOR": MODERATION,
+    "FORCESPECTATORMODE": MODERATION,
+    "SETCHANNELKEY": MODERATION,
+
+    "SAY": CHAT,
+    "SAYEX": CHAT,
+    "SAYPRIVATE": CHAT,
+    "SAYPRIVATEEX": CHAT,
+    "SAYBATTLE": CHAT,
+    "SAYBATTLEEX": CHAT,
+    "SAYBATTLEPRIVATE": CHAT,
+    "SAYBATTLEPRIVATEEX": CHAT,
+    "SAYFROM": CHAT,
+}
+
+VERB_LANES_BYTES = {verb.encode("ascii"): lane for verb, lane in VERB_LANES.items()}
+
+# commands about one channel, private conversation or the battle: whichever
+# lane they go to, they leave the queue in the order they were queued
+CHANNEL_VERBS = {b"SAY", b"SAYEX", b"JOIN", b"LEAVE", b"JOINFROM", b"LEAVEFROM", b"SAYFROM", b"MUTE",
+                 b"UNMUTE", b"FORCELEAVECHANNEL", b"SETCHANNELKEY", b"CHANNELTOPIC"}
+PRIVATE_VERBS = {b"SAYPRIVATE", b"SAYPRIVATEEX"}
+BATTLE_VERBS = {b"OPENBATTLE", b"JOINBATTLE", b"LEAVEBATTLE", b"SAYBATTLE", b"SAYBATTLEEX",
+                b"SAYBATTLEPRIVATE", b"SAYBATTLEPRIVATEEX", b"MYBATTLESTATUS", b"UPDATEBATTLEINFO",
+                b"KICKFROMBATTLE", b"FORCETEAMNO", b"FORCEALLYNO", b"FORCETEAMCOLOR", b"FORCESPECTATORMODE"}
+
+# uberserver flood limits per account class: (bytes per second, window in seconds)
+FLOOD_LIMITS = {
+    "fresh": (1024 * 32, 2),
+    "user": (1024, 10),
+    "bot": (10000, 5),
+    "mod": (10000, 10),
+    "admin": (100000, 10),
+}
+
+
+def lane_for(line):
+    """
+    Pick the lane a raw outgoing line (str or encoded) belongs to, from its
+    command verb.
+    """
+
+    if isinstance(line, bytes):
+        lanes, space, hash_ = VERB_LANES_BYTES, b" ", b"#"
+        line = line.rstrip(b"\r\n")
+    else:
+        lanes, space, hash_ = VERB_LANES, " ", "#"
+
+    if line.startswith(hash_):
+        # skip the message ID
+        line = line[line.find(space) + 1:]
+
+    index = line.find(space)
+    verb = line if index == -1 else line[:index]
+    return lanes.get(verb, CONTROL)
+
+
+def target_for(data):
+    """
+    The channel, private peer or battle an encoded line is about, or None.
+    """
+
+    line = data.rstrip(b"\r\n")
+    if line.startswith(b"#"):
+        line = line[line.find(b" ") + 1:]
+
+    verb, _, rest = line.partition(b" ")
+    if verb in BATTLE_VERBS:
+        return b"battle"
+    if verb in CHANNEL_VERBS:
+        return b"#" + rest.partition(b" ")[0]
+    if verb in PRIVATE_VERBS:
+        return b"@" + rest.partition(b" ")[0]
+    return None
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `burst`.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.stamp = clock()
+
+    @classmethod
+    def from_flood_limit(cls, bytes_per_second, seconds, burst_seconds=2):
+        """
+        Build a byte bucket that can never exceed the server's sliding window
+        of bytes_per_second * seconds, even when a full burst is followed by
+        sending at the sustained rate for the whole window.
+        """
+
+        rate = bytes_per_second * seconds / (seconds + burst_seconds)
+        return cls(rate, rate * burst_seconds)
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def consume(self, amount):
+        """
+        Take amount tokens if available. An amount larger than the whole
+        bucket is allowed through once the bucket is full.
+        """
+
+        self._refill()
+        if self.tokens >= amount or self.tokens >= self.burst:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount):
+        """
+        Seconds until amount tokens are available.
+        """
+
+        self._refill()
+        needed = min(amount, self.burst) - self.tokens
+        return max(needed / self.rate, 0)
+
+
+class Lane:
+    def __init__(self, name, quantum):
+        self.name = name
+        self.quantum = quantum
+        self.items = collections.deque()
+        self.deficit = 0
+
+        self.queued = 0
+        self.sent = 0
+        self.bytes_sent = 0
+        self.max_depth = 0
+        self.max_wait = 0
+        self.total_wait = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self):
+        return {
+            "depth": len(self.items),
+            "queued": self.queued,
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "max_depth": self.max_depth,
+            "max_wait": self.max_wait,
+            "avg_wait": self.total_wait / self.sent if self.sent else 0,
+        }
+
+
+class SendQueue:
+    """
+    Outgoing messages split in priority lanes (keepalive, control,
+    moderation, chat) and drained by deficit round robin, so a long chat
+    burst can't starve PING or JOIN, while still getting its share.
+
+    Messages are kept encoded, CRLF included, ready to be written out.
+    Lines about the same channel, private peer or battle keep their order
+    across lanes: one queued behind such a line in another lane waits for
+    it, so "SAY main bye" is still said before "LEAVE main".
+
+    What leaves the queue is limited by a byte token bucket (sized after the
+    uberserver flood limits by default) and, optionally, a line bucket.
+    """
+
+    def __init__(self, byte_bucket=None, line_bucket=None, lanes=LANES, clock=time.monotonic):
+        # the FLOOD_LIMITS class the byte bucket is sized for, if any
+        self.account_class = None
+        if byte_bucket is None:
+            byte_bucket = TokenBucket.from_flood_limit(*FLOOD_LIMITS["user"])
+            self.account_class = "user"
+
+        self.byte_bucket = byte_bucket
+        self.line_bucket = line_bucket
+        self.clock = clock
+        self.lanes = collections.OrderedDict((name, Lane(name, quantum)) for name, quantum in lanes.items())
+        self.length = 0
+        self.sequence = 0
+        # target -> (lane, sequence) of the last line queued about it
+        self.targets = {}
+        # (lane name, line) set aside by hold(), oldest first
+        self.held = []
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __iter__(self):
+        for lane in self.lanes.values():
+            for item in lane.items:
+                yield item[0][:-2].decode("utf-8", "replace")
+
+    def set_flood_limit(self, account_class):
+        """
+        Resize the byte bucket for the flood limits of an account class
+        (see FLOOD_LIMITS).
+        """
+
+        self.byte_bucket = TokenBucket.from_flood_limit(*FLOOD_LIMITS[account_class])
+        self.account_class = account_class
+
+    def append(self, line, lane=None):
+        """
+        Queue a line, str or bytes, without its terminator.
+        """
+
+        self.append_encoded(encode(line), lane)
+
+    def append_encoded(self, data, lane=None):
+        """
+        Queue a line already encoded with encoder.encode/command/fan_out.
+        """
+
+        lane = self.lanes[lane or lane_for(data)]
+        self.sequence += 1
+
+        # wait for the last line about the same target if another lane has it
+        after = None
+        target = target_for(data)
+        if target is not None:
+            last = self.targets.get(target)
+            if last is not None and last[0] is not lane:
+                after = last
+            self.targets[target] = (lane, self.sequence)
+
+        lane.items.append((data, len(data), self.clock(), self.sequence, after))
+        lane.queued += 1
+        if len(lane.items) > lane.max_depth:
+            lane.max_depth = len(lane.items)
+        self.length += 1
+
+    def take(self, lane):
+        """
+        Remove and return the (encoded) lines waiting in one lane.
+        """
+
+        lane = self.lanes[lane]
+        lines = [item[0] for item in lane.items]
+        lane.items.clear()
+        lane.deficit = 0
+        self._removed(len(lines))
+        return lines
+
+    def hold(self, keep=None):
+        """
+        Set every queued line aside until release(), e.g. while a new
+        connection logs in. Lines keep(lane name, data) rejects are dropped.
+        Returns how many were set aside.
+        """
+
+        items = sorted((item[3], lane.name, item[0]) for lane in self.lanes.values() for item in lane.items)
+        for name in self.lanes:
+            self.take(name)
+
+        held = [(name, data) for sequence, name, data in items if keep is None or keep(name, data)]
+        self.held.extend(held)
+        return len(held)
+
+    def release(self):
+        """
+        Queue the held lines again, behind what was queued since, in their
+        original lanes and order. Returns how many.
+        """
+
+        held, self.held = self.held, []
+        for name, data in held:
+            self.append_encoded(data, name)
+        return len(held)
+
+    def clear(self):
+        for lane in self.lanes.values():
+            lane.items.clear()
+            lane.deficit = 0
+        self.length = 0
+        self.targets.clear()
+
+    @staticmethod
+    def _blocked(item):
+        after = item[4]
+        if after is None:
+            return False
+        lane, sequence = after
+        # lanes are sent in order, so it is gone once the head is past it
+        return bool(lane.items) and lane.items[0][3] <= sequence
+
+    def _allowed(self, size):
+        if self.line_bucket and not self.line_bucket.consume(1):
+            return False
+        if not self.byte_bucket.consume(size):
+            if self.line_bucket:
+                self.line_bucket.tokens += 1
+            return False
+        return True
+
+    def pop_batch(self):
+        """
+        Remove and return the encoded lines that fit in the current budget.
+        """
+
+        batch = []
+        now = self.clock()
+        lanes = [lane for lane in self.lanes.values() if lane.items]
+
+        while lanes:
+            blocked = 0
+            for lane in lanes:
+                items = lane.items
+                if self._blocked(items[0]):
+                    blocked += 1
+                    continue
+                lane.deficit += lane.quantum
+                while items and items[0][1] <= lane.deficit and not self._blocked(items[0]):
+                    data, size, stamp = items[0][:3]
+                    if not self._allowed(size):
+                        self._removed(len(batch))
+                        return batch
+                    items.popleft()
+                    lane.deficit -= size
+                    lane.sent += 1
+                    lane.bytes_sent += size
+                    wait = now - stamp
+                    lane.total_wait += wait
+                    if wait > lane.max_wait:
+                        lane.max_wait = wait
+                    batch.append(data)
+                if not items:
+                    lane.deficit = 0
+
+            if blocked == len(lanes):
+                # only a safeguard: the oldest queued line never waits
+                break
+            lanes = [lane for lane in lanes if lane.items]
+
+        self._removed(len(batch))
+        return batch
+
+    def _removed(self, count):
+        self.length -= count
+        if not self.length:
+            self.targets.clear()
+
+    def delay(self):
+        """
+        Seconds until the budget allows sending the next queued line.
+        """
+
+        sizes = [lane.items[0][1] for lane in self.lanes.values() if lane.items]
+        if not sizes:
+            return 0
+
+        wait = self.byte_bucket.wait_time(min(sizes))
+        if self.line_bucket:
+            wait = max(wait, self.line_bucket.wait_time(1))
+        return wait
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self.lanes.items()}
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Lobby connections spread over worker processes.
+
+A Supervisor starts one worker process per core, each running its own event
+loop, and hands every new connection to the least loaded one, so parsing
+and dispatch of many busy connections use all cores. The coordinator talks
+to the workers over pipes: commands go down, and the events the
+coordinator subscribed to come back up, batched once per loop iteration.
+A worker that dies is started again, and its connections are made again,
+logged in and joined to their channels.
+
+    supervisor = Supervisor()
+    supervisor.start()
+    client = await supervisor.connect("lobby.springrts.com")
+
+    @client.on("said")
+    def said(message, user, target, text):
+        ...
+
+    client.login("user", "password")
+"""
+
+import os
+import asyncio
+import logging
+import importlib
+import itertools
+import collections
+import multiprocessing
+
+from asyncspring.events import EventBus
+from asyncspring.parser import LobbyMessage
+from asyncspring.user import User
+
+log = logging.getLogger(__name__)
+
+# stands for the connection itself in forwarded event arguments
+CLIENT = "\0client"
+
+PLAIN_TYPES = (str, int, float, bool, bytes, type(None), User)
+
+# LobbyProtocol methods a RemoteClient forwards to its worker
+REMOTE_METHODS = (
+    "writeln", "accept", "say", "say_ex", "say_from", "say_private", "say_private_ex", "ping", "join_battle",
+    "leave_battle",
+)
+
+Message = collections.namedtuple("Message", "line")
+
+
+def _pack(value):
+    if isinstance(value, PLAIN_TYPES):
+        return value
+    if isinstance(value, LobbyMessage):
+        return Message(value.line)
+    if hasattr(value, "writeln"):
+        return CLIENT
+    return str(value)
+
+
+## worker side
+
+class Worker:
+    """
+    Runs the connections given to one worker process.
+    """
+
+    def __init__(self, index, conn, loop):
+        self.index = index
+        self.conn = conn
+        self.loop = loop
+        self.clients = {}
+        self.connecting = {}
+        self.subscriptions = collections.defaultdict(set)
+        self.outbox = []
+        self.flush_scheduled = False
+        self.stopped = loop.create_future()
+
+    def post(self, *item):
+        self.outbox.append(item)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        batch, self.outbox = self.outbox, []
+        try:
+            self.conn.send(batch)
+        except (OSError, EOFError):
+            self.stop()
+
+    def read(self):
+        try:
+            while self.conn.poll():
+                self.handle(*self.conn.recv())
+        except (OSError, EOFError):
+            # the coordinator is gone
+            self.stop()
+
+    def handle(self, command, account_id=None, *args):
+        if command == "connect":
+            # calls made while connecting are run once connected
+            self.connecting[account_id] = []
+            asyncio.ensure_future(self.connect(account_id, *args))
+        elif command == "call":
+            self.call(account_id, *args)
+        elif command == "subscribe":
+            self.subscribe(account_id, *args)
+        elif command == "close":
+            self.close(account_id)
+        elif command == "stop":
+            self.stop()
+
+    async def connect(self, account_id, server, port, use_ssl):
+        from asyncspring import lobby
+
+        try:
+            client = await lobby.connect(server, port, use_ssl)
+        except Exception as e:
+            self.post("error", account_id, repr(e))
+            return
+        finally:
+            backlog = self.connecting.pop(account_id, ())
+
+        self.clients[account_id] = client
+        for event in self.subscriptions[account_id]:
+            self._forward(account_id, client, event)
+        self.post("connected", account_id, client.netid)
+
+        for call in backlog:
+            self.call(account_id, *call)
+
+    def call(self, account_id, method, args, kwargs):
+        if account_id in self.connecting:
+            self.connecting[account_id].append((method, args, kwargs))
+            return
+
+        client = self.clients.get(account_id)
+        if client is None:
+            self.post("error", account_id, "not connected")
+            return
+        try:
+            getattr(client, method)(*args, **kwargs)
+        except Exception as e:
+            log.exception("{} failed".format(method))
+            self.post("error", account_id, repr(e))
+
+    def subscribe(self, account_id, event):
+        if event in self.subscriptions[account_id]:
+            return
+        self.subscriptions[account_id].add(event)
+        client = self.clients.get(account_id)
+        if client is not None:
+            self._forward(account_id, client, event)
+
+    def _forward(self, account_id, client, event):
+        def forward(*args, **kwargs):
+            self.post("event", account_id, event, [_pack(arg) for arg in args],
+                      {key: _pack(value) for key, value in kwargs.items()})
+
+        client.events.signal(event).connect(forward, weak=False)
+
+    def close(self, account_id):
+        from asyncspring.protocol import connections
+
+        client = self.clients.pop(account_id, None)
+        self.subscriptions.pop(account_id, None)
+        if client is not None:
+            client.protocol.autoreconnect = False
+            client.protocol.transport.close()
+            connections.pop(client.netid, None)
+
+    def stop(self):
+        for account_id in list(self.clients):
+            self.close(account_id)
+        if not self.stopped.done():
+            self.stopped.set_result(None)
+
+
+def worker_main(index, conn, plugins):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    importlib.import_module("asyncspring.lobby")
+    for plugin in plugins:
+        importlib.import_module(plugin)
+
+    worker = Worker(index, conn, loop)
+    loop.add_reader(conn.fileno(), worker.read)
+    try:
+        loop.run_until_complete(worker.stopped)
+        # let the transports close
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+
+
+## coordinator side
+
+class RemoteClient:
+    """
+    Coordinator side stand-in for a connection running in a worker process.
+    It offers the sending half of LobbyProtocol; events are delivered on
+    its own bus to the handlers registered with on().
+    """
+
+    def __init__(self, supervisor, account_id, server_info):
+        self.supervisor = supervisor
+        self.account_id = account_id
+        self.server_info = server_info
+        self.shard = None
+        self.netid = None
+        self.work = False
+        self.events = EventBus()
+
+        self.credentials = None
+        self.channels_to_join = []
+
+    def __getattr__(self, attr):
+        if attr in REMOTE_METHODS:
+            return lambda *args, **kwargs: self._call(attr, *args, **kwargs)
+        raise AttributeError(attr)
+
+    def _call(self, method, *args, **kwargs):
+        self.supervisor.send(self.shard, "call", self.account_id, method, args, kwargs)
+        return self
+
+    def on(self, event):
+        def process(f):
+            self.events.signal(event).connect(f, weak=False)
+            self.supervisor.send(self.shard, "subscribe", self.account_id, event)
+            return f
+
+        return process
+
+    def login(self, username, password, flags=None):
+        self.credentials = (username, password, flags)
+        return self._call("login", username, password, flags)
+
+    def join(self, channel):
+        if channel not in self.channels_to_join:
+            self.channels_to_join.append(channel)
+        return self._call("join", channel)
+
+    def leave(self, channel):
+        if channel in self.channels_to_join:
+            self.channels_to_join.remove(channel)
+        return self._call("leave", channel)
+
+    def close(self):
+        self.supervisor.close(self)
+
+    def __repr__(self):
+        return "RemoteClient {} on worker {}".format(self.netid, self.shard.index if self.shard else None)
+
+
+class Shard:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.clients = {}
+        self.backlog = []
+        self.restarts = 0
+        self.events = 0
+        self.commands = 0
+
+    def stats(self):
+        return {
+            "pid": self.process.pid if self.process else None,
+            "alive": bool(self.process and self.process.is_alive()),
+            "clients": len(self.clients),
+            "restarts": self.restarts,
+            "events": self.events,
+            "commands": self.commands,
+        }
+
+
+class Supervisor:
+    """
+    Spreads lobby connections over `workers` processes (one per core by
+    default). `plugins` are imported in every worker, next to
+    asyncspring.lobby. Crashed workers are started again after
+    `restart_delay` seconds.
+    """
+
+    def __init__(self, workers=None, plugins=(), restart_delay=1.0, start_method="spawn"):
+        self.workers = workers or os.cpu_count() or 1
+        self.plugins = tuple(plugins)
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context(start_method)
+
+        self.loop = None
+        self.shards = []
+        self.pending = {}
+        self.account_ids = itertools.count()
+        self.stopping = False
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        self.stopping = False
+        self.shards = [Shard(index) for index in range(self.workers)]
+        for shard in self.shards:
+            self._spawn(shard)
+
+    def _spawn(self, shard):
+        conn, child_conn = self.context.Pipe()
+        shard.process = self.context.Process(target=worker_main, args=(shard.index, child_conn, self.plugins),
+                                             name="asyncspring-worker-{}".format(shard.index), daemon=True)
+        shard.process.start()
+        child_conn.close()
+        shard.conn = conn
+        self.loop.add_reader(conn.fileno(), self._read, shard)
+
+    def send(self, shard, *command):
+        if shard.conn is None:
+            # the worker is being restarted
+            shard.backlog.append(command)
+            return
+
+        shard.commands += 1
+        try:
+            shard.conn.send(command)
+        except (OSError, EOFError):
+            self._crashed(shard)
+
+    def _read(self, shard):
+        try:
+            while shard.conn.poll():
+                for item in shard.conn.recv():
+                    self._handle(shard, *item)
+        except (OSError, EOFError):
+            self._crashed(shard)
+
+    def _handle(self, shard, kind, account_id, *args):
+        client = shard.clients.get(account_id)
+
+        if kind == "event":
+            if client is None:
+                return
+            shard.events += 1
+            event, args, kwargs = args
+            args = [self._unpack(client, arg) for arg in args]
+            kwargs = {key: self._unpack(client, value) for key, value in kwargs.items()}
+            client.events.emit(event, *args, **kwargs)
+
+        elif kind == "connected":
+            if client is not None:
+                client.netid = args[0]
+                client.work = True
+            future = self.pending.pop(account_id, None)
+            if future is not None and not future.done():
+                future.set_result(client)
+
+        elif kind == "error":
+            future = self.pending.pop(account_id, None)
+            if future is not None and not future.done():
+                future.set_exception(ConnectionError(args[0]))
+            else:
+                log.warning("worker {}: {}: {}".format(shard.index, client, args[0]))
+
+    @staticmethod
+    def _unpack(client, value):
+        if value == CLIENT:
+            return client
+        if isinstance(value, Message):
+            message = LobbyMessage.from_message(value.line)
+            message.client = client
+            return message
+        return value
+
+    def _crashed(self, shard):
+        if shard.conn is None:
+            return
+
+        self.loop.remove_reader(shard.conn.fileno())
+        shard.conn.close()
+        shard.conn = None
+        for client in shard.clients.values():
+            client.work = False
+
+        if self.stopping:
+            return
+
+        log.warning("worker {} (pid {}) died, restarting".format(shard.index, shard.process.pid))
+        shard.restarts += 1
+        self.loop.call_later(self.restart_delay, self._restart, shard)
+
+    def _restart(self, shard):
+        if self.stopping:
+            return
+
+        backlog, shard.backlog = shard.backlog, []
+        self._spawn(shard)
+        for client in shard.clients.values():
+            self._replay(shard, client)
+        for command in backlog:
+            self.send(shard, *command)
+
+    def _replay(self, shard, client):
+        server_info = client.server_info
+        self.send(shard, "connect", client.account_id, server_info["host"], server_info["port"], server_info["ssl"])
+        for event in (event for event, signal in client.events.items() if signal.receivers):
+            self.send(shard, "subscribe", client.account_id, event)
+        if client.credentials:
+            self.send(shard, "call", client.account_id, "login", client.credentials, {})
+        for channel in client.channels_to_join:
+            self.send(shard, "call", client.account_id, "join", (channel,), {})
+
+    async def connect(self, server, port=8200, use_ssl=False):
+        """
+        Connect to a SpringRTS Lobby server from the least loaded worker.
+        Returns a RemoteClient.
+        """
+
+        running = [shard for shard in self.shards if shard.conn is not None]
+        if not running:
+            raise ConnectionError("no worker is running")
+        shard = min(running, key=lambda shard: len(shard.clients))
+        account_id = next(self.account_ids)
+        client = RemoteClient(self, account_id, {"host": server, "port": port, "ssl": use_ssl})
+        client.shard = shard
+        shard.clients[account_id] = client
+
+        future = self.pending[account_id] = self.loop.create_future()
+        self.send(shard, "connect", account_id, server, port, use_ssl)
+        try:
+            return await future
+        except ConnectionError:
+            shard.clients.pop(account_id, None)
+            raise
+
+    def close(self, client):
+        shard = client.shard
+        shard.clients.pop(client.account_id, None)
+        client.work = False
+        if shard.conn is not None:
+            self.send(shard, "close", client.account_id)
+
+    async def stop(self, timeout=5):
+        """
+        Close every connection and stop the workers.
+        """
+
+        self.stopping = True
+        for shard in self.shards:
+            if shard.conn is not None:
+                self.send(shard, "stop")
+
+        deadline = self.loop.time() + timeout
+        while any(shard.process.is_alive() for shard in self.shards) and self.loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+        for shard in self.shards:
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.process.join()
+            if shard.conn is not None:
+                self.loop.remove_reader(shard.conn.fileno())
+                shard.conn.close()
+                shard.conn = None
+
+    def stats(self):
+        return [shard.stats() for shard in self.shards]
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Decoding and storage of the CLIENTSTATUS and CLIENTBATTLESTATUS bitfields.
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# field name -> (shift, bit count)
+CLIENT_STATUS_BITS = {
+    "ingame": (0, 1),
+    "away": (1, 1),
+    "rank": (2, 3),
+    "access": (5, 1),
+    "bot": (6, 1),
+}
+
+BATTLE_STATUS_BITS = {
+    "ready": (1, 1),
+    "team": (2, 4),
+    "ally": (6, 4),
+    "player": (10, 1),
+    "handicap": (11, 7),
+    "sync": (22, 2),
+    "side": (24, 4),
+}
+
+
+def _bits(shift, count):
+    mask = (1 << count) - 1
+    if count == 1:
+        return property(lambda self: bool(self >> shift & 1))
+    return property(lambda self: self >> shift & mask)
+
+
+class ClientStatus(int):
+    """
+    The status bitfield sent in CLIENTSTATUS / MYSTATUS.
+    """
+
+    __slots__ = ()
+
+    ingame = _bits(*CLIENT_STATUS_BITS["ingame"])
+    away = _bits(*CLIENT_STATUS_BITS["away"])
+    rank = _bits(*CLIENT_STATUS_BITS["rank"])
+    access = _bits(*CLIENT_STATUS_BITS["access"])
+    bot = _bits(*CLIENT_STATUS_BITS["bot"])
+
+    __str__ = int.__repr__
+
+    def __repr__(self):
+        return "ClientStatus({})".format(", ".join("{}={}".format(name, getattr(self, name)) for name in CLIENT_STATUS_BITS))
+
+
+class BattleStatus(int):
+    """
+    The battle status bitfield sent in CLIENTBATTLESTATUS / MYBATTLESTATUS.
+    """
+
+    __slots__ = ()
+
+    ready = _bits(*BATTLE_STATUS_BITS["ready"])
+    team = _bits(*BATTLE_STATUS_BITS["team"])
+    ally = _bits(*BATTLE_STATUS_BITS["ally"])
+    player = _bits(*BATTLE_STATUS_BITS["player"])
+    handicap = _bits(*BATTLE_STATUS_BITS["handicap"])
+    sync = _bits(*BATTLE_STATUS_BITS["sync"])
+    side = _bits(*BATTLE_STATUS_BITS["side"])
+
+    __str__ = int.__repr__
+
+    @property
+    def spectator(self):
+        return not self.player
+
+    def __repr__(self):
+        return "BattleStatus({})".format(", ".join("{}={}".format(name, getattr(self, name)) for name in BATTLE_STATUS_BITS))
+
+
+def _criteria(bits, criteria):
+    """
+    Turn field=value criteria into a (mask, expected) pair for bitfields.
+    """
+
+    mask = expected = 0
+    for name, value in criteria.items():
+        shift, count = bits[name]
+        field = (1 << count) - 1
+        mask |= field << shift
+        expected |= (int(value) & field) << shift
+    return mask, expected
+
+
+class StatusStore:
+    """
+    Columnar storage for the client and battle status bitfields of every
+    user on the server.
+
+    Each user gets a dense slot index; statuses live in flat int arrays
+    indexed by slot, rather than in attributes of one object per user.
+    ClientStatus / BattleStatus views are only built when asked for, and
+    queries over all users (select, rank_histogram) work directly on the
+    arrays, with NumPy when it is installed.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.names = []
+        self.free = []
+        self.alive = bytearray()
+        self.client = array("q")
+        self.in_battle = bytearray()
+        self.battle = array("q")
+        self.team_color = array("q")
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def add(self, name):
+        slot = self.slots.get(name)
+        if slot is not None:
+            return slot
+
+        if self.free:
+            slot = self.free.pop()
+            self.names[slot] = name
+            self.alive[slot] = 1
+        else:
+            slot = len(self.names)
+            self.names.append(name)
+            self.alive.append(1)
+            self.client.append(0)
+            self.in_battle.append(0)
+            self.battle.append(0)
+            self.team_color.append(0)
+
+        self.slots[name] = slot
+        return slot
+
+    def remove(self, name):
+        slot = self.slots.pop(name, None)
+        if slot is None:
+            return
+        self.names[slot] = None
+        self.alive[slot] = 0
+        self.client[slot] = 0
+        self.in_battle[slot] = 0
+        self.battle[slot] = 0
+        self.team_color[slot] = 0
+        self.free.append(slot)
+
+    def rename(self, old_name, new_name):
+        slot = self.slots.pop(old_name, None)
+        if slot is not None:
+            self.slots[new_name] = slot
+            self.names[slot] = new_name
+
+    # client status
+
+    def set_status(self, name, status):
+        self.client[self.add(name)] = status
+
+    def status(self, name):
+        slot = self.slots.get(name)
+        return None if slot is None else ClientStatus(self.client[slot])
+
+    def status_at(self, slot):
+        return ClientStatus(self.client[slot])
+
+    # battle status
+
+    def set_battle_status(self, name, status, team_color=0):
+        slot = self.add(name)
+        self.battle[slot] = status
+        self.team_color[slot] = team_color
+        self.in_battle[slot] = 1
+
+    def clear_battle_status(self, name):
+        slot = self.slots.get(name)
+        if slot is not None:
+            self.in_battle[slot] = 0
+            self.battle[slot] = 0
+
+    def clear_battle_statuses(self):
+        self.in_battle[:] = bytes(len(self.in_battle))
+
+    def battle_status(self, name):
+        slot = self.slots.get(name)
+        if slot is None or not self.in_battle[slot]:
+            return None
+        return BattleStatus(self.battle[slot])
+
+    def battle_status_at(self, slot):
+        return BattleStatus(self.battle[slot]) if self.in_battle[slot] else None
+
+    # queries
+
+    def _select(self, values, present, bits, criteria):
+        mask, expected = _criteria(bits, criteria)
+        if numpy is not None and values:
+            column = numpy.frombuffer(values, dtype=numpy.int64)
+            live = numpy.frombuffer(present, dtype=numpy.uint8).astype(bool)
+            slots = numpy.flatnonzero(live & ((column & mask) == expected)).tolist()
+        else:
+            slots = [slot for slot, value in enumerate(values) if value & mask == expected and present[slot]]
+        names = self.names
+        return [names[slot] for slot in slots]
+
+    def select(self, **criteria):
+        """
+        Names of users whose client status matches every field=value given,
+        e.g. select(ingame=True, bot=True).
+        """
+
+        return self._select(self.client, self.alive, CLIENT_STATUS_BITS, criteria)
+
+    def select_battle(self, **criteria):
+        """
+        Names of battle members whose battle status matches every field=value
+        given, e.g. select_battle(player=True, ally=1).
+        """
+
+        return self._select(self.battle, self.in_battle, BATTLE_STATUS_BITS, criteria)
+
+    def rank_histogram(self):
+        """
+        Number of users for each of the 8 ranks.
+        """
+
+        shift, count = CLIENT_STATUS_BITS["rank"]
+        field = (1 << count) - 1
+        if numpy is not None and self.client:
+            column = numpy.frombuffer(self.client, dtype=numpy.int64)
+            live = numpy.frombuffer(self.alive, dtype=numpy.uint8).astype(bool)
+            return numpy.bincount((column[live] >> shift) & field, minlength=field + 1).tolist()
+
+        histogram = [0] * (field + 1)
+        alive = self.alive
+        for slot, value in enumerate(self.client):
+            if alive[slot]:
+                histogram[value >> shift & field] += 1
+        return histogram
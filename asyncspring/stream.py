@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Events as async iterators.
+
+    async with client.stream("said", channel="main", maxsize=100) as said:
+        async for event in said:
+            print(event.user, event.text)
+
+A stream receives its event synchronously, without spawning a task per
+message, into a bounded buffer. What happens when the consumer falls
+behind and the buffer is full is up to its policy:
+
+    BLOCK        stop reading from the server until the consumer catches
+                 up (the lines already read are still delivered, so the
+                 buffer can go over maxsize by one read's worth)
+    DROP_OLDEST  discard the oldest buffered event
+    COALESCE     keep only the latest event per key (e.g. per user for
+                 CLIENTSTATUS), dropping the oldest key when full
+"""
+
+import asyncio
+import collections
+
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+COALESCE = "coalesce"
+
+POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+
+
+class Event:
+    """
+    One event delivered by a stream: its name, the message it came from,
+    and the keyword arguments it was sent with, also available as
+    attributes.
+    """
+
+    __slots__ = ("name", "message", "kwargs")
+
+    def __init__(self, name, message, kwargs):
+        self.name = name
+        self.message = message
+        self.kwargs = kwargs
+
+    def __getattr__(self, attr):
+        try:
+            return self.kwargs[attr]
+        except KeyError:
+            raise AttributeError(attr) from None
+
+    def __repr__(self):
+        return "Event {} {}".format(self.name, self.kwargs)
+
+
+def default_key(event):
+    params = event.message.params if event.message is not None and hasattr(event.message, "params") else None
+    return params[0] if params else None
+
+
+class EventStream:
+    """
+    A bounded subscription to one event of a connection; see the module
+    documentation. Keyword filters are matched against the event's
+    keyword arguments, or else the fields of its message's args.
+    """
+
+    def __init__(self, client, event, maxsize=1000, policy=DROP_OLDEST, key=None, **filters):
+        if policy not in POLICIES:
+            raise ValueError("unknown overflow policy {!r}".format(policy))
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.client = client
+        self.event = event
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key or default_key
+        self.filters = filters
+
+        self.items = collections.OrderedDict() if policy == COALESCE else collections.deque()
+        self.waiter = None
+        self.paused = False
+        self.closed = False
+
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.pauses = 0
+        self.max_depth = 0
+
+        self.signal = client.events.signal(event)
+        self.signal.connect(self._receive, weak=False)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _matches(self, message, kwargs):
+        args = None
+        for name, expected in self.filters.items():
+            if name in kwargs:
+                value = kwargs[name]
+            else:
+                if args is None:
+                    args = getattr(message, "args", None)
+                value = getattr(args, name, None)
+            if value != expected:
+                return False
+        return True
+
+    def _receive(self, message=None, **kwargs):
+        if self.closed or (self.filters and not self._matches(message, kwargs)):
+            return
+
+        self.received += 1
+        event = Event(self.event, message, kwargs)
+        items = self.items
+
+        if self.policy == COALESCE:
+            key = self.key(event)
+            if key in items:
+                del items[key]
+                self.coalesced += 1
+            elif len(items) >= self.maxsize:
+                items.popitem(last=False)
+                self.dropped += 1
+            items[key] = event
+        else:
+            if self.policy == DROP_OLDEST and len(items) >= self.maxsize:
+                items.popleft()
+                self.dropped += 1
+            items.append(event)
+            if self.policy == BLOCK and len(items) >= self.maxsize and not self.paused:
+                self.paused = True
+                self.pauses += 1
+                self.client.hold_reading(self)
+
+        if len(items) > self.max_depth:
+            self.max_depth = len(items)
+
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _pop(self):
+        if self.policy == COALESCE:
+            event = self.items.popitem(last=False)[1]
+        else:
+            event = self.items.popleft()
+
+        if self.paused and len(self.items) <= self.maxsize // 2:
+            self.paused = False
+            self.client.release_reading(self)
+
+        self.delivered += 1
+        return event
+
+    def get_nowait(self):
+        """
+        Return the next buffered event, or None.
+        """
+
+        return self._pop() if self.items else None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.items:
+            if self.closed:
+                raise StopAsyncIteration
+            self.waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        return self._pop()
+
+    async def get(self):
+        try:
+            return await self.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def close(self):
+        """
+        Stop receiving. Events already buffered are still delivered.
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        self.signal.disconnect(self._receive)
+        if self.paused:
+            self.paused = False
+            self.client.release_reading(self)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def stats(self):
+        return {
+            "depth": len(self.items),
+            "received": self.received,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "pauses": self.pauses,
+            "max_depth": self.max_depth,
+        }
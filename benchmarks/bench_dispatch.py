@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Messages per second through the old raw -> spring -> spring-<verb> -> event
+signal chain and through the verb dispatch table of the core plugin.
+
+    python benchmarks/bench_dispatch.py [messages]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asyncblink import Namespace, signal  # noqa: E402
+
+from asyncspring.events import EventBus  # noqa: E402
+from asyncspring.parser import LobbyMessage  # noqa: E402
+from asyncspring.plugins import core  # noqa: E402
+from fixtures import login_burst, chat_flood  # noqa: E402
+
+
+class Client:
+    netid = "bench"
+    nickname = "benchbot"
+    bot_username = "benchbot"
+    flood_class = "user"
+    events = EventBus()
+
+
+def legacy_chain():
+    """
+    The signal chain core.py used to build, in its own namespace.
+    """
+
+    ns = Namespace()
+
+    def redispatch_raw(client, text):
+        message = LobbyMessage.from_message(text)
+        message.client = client
+        ns.signal("spring").send(message)
+
+    def redispatch_spring(message):
+        ns.signal("spring-{}".format(message.verb.lower())).send(message)
+
+    def redispatch_said(message):
+        user = message.source
+        target, text = message.params[0], " ".join(message.params[2:])
+        ns.signal("said").send(message, user=user, target=target, text=text)
+
+    def redispatch_adduser(message):
+        ns.signal("adduser").send(message)
+
+    ns.signal("raw").connect(redispatch_raw, weak=False)
+    ns.signal("spring").connect(redispatch_spring, weak=False)
+    ns.signal("spring-said").connect(redispatch_said, weak=False)
+    ns.signal("spring-adduser").connect(redispatch_adduser, weak=False)
+
+    def feed(client, lines):
+        raw = ns.signal("raw")
+        for text in lines:
+            raw.send(client, text=text)
+
+    return feed, ns.signal
+
+
+def run(name, feed, event, lines):
+    counter = [0]
+
+    def on_said(message, user, target, text):
+        counter[0] += 1
+
+    def on_adduser(message):
+        counter[0] += 1
+
+    event("said").connect(on_said)
+    event("adduser").connect(on_adduser)
+
+    client = Client()
+    start = time.perf_counter()
+    feed(client, lines)
+    elapsed = time.perf_counter() - start
+
+    event("said").disconnect(on_said)
+    event("adduser").disconnect(on_adduser)
+
+    print("{:>14}: {:>8} messages, {:>8} handled in {:.3f}s, {:>10.0f} messages/s".format(
+        name, len(lines), counter[0], elapsed, len(lines) / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    lines = [line for line in login_burst(users=count // 2) if line.startswith(("ADDUSER", "CLIENTSTATUS"))]
+    lines += chat_flood(messages=count // 2)
+
+    feed, event = legacy_chain()
+    run("signal chain", feed, event, lines)
+    run("dispatch table", core._redispatch_raw_batch, signal, lines)
+    run("scoped bus", core._redispatch_raw_batch, Client.events.signal, lines)
+
+
+if __name__ == "__main__":
+    main()
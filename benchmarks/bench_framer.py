@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Compare LineFramer against the old string buffer in LobbyProtocol.data_received.
+
+    python benchmarks/bench_framer.py [users] [chunk size]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asyncspring.framer import LineFramer  # noqa: E402
+from fixtures import login_burst, to_wire, chunked  # noqa: E402
+
+
+class StringBuffer:
+    """
+    The framing previously done in LobbyProtocol.data_received.
+    """
+
+    def __init__(self):
+        self.buf = ""
+
+    def feed(self, data):
+        lines = []
+        data = data.decode()
+
+        self.buf += data
+        while "\n" in self.buf:
+            index = self.buf.index("\n")
+            lines.append(self.buf[:index].strip())
+            self.buf = self.buf[index + 1:]
+        return lines
+
+
+def run(framer, chunks):
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        count += len(framer.feed(chunk))
+    return count, time.perf_counter() - start
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 65536
+
+    data = to_wire(login_burst(users=users))
+    chunks = chunked(data, size)
+    print("{} bytes in {} reads of {} bytes".format(len(data), len(chunks), size))
+
+    for name, factory in (("StringBuffer", StringBuffer), ("LineFramer", LineFramer)):
+        try:
+            count, elapsed = run(factory(), chunks)
+        except UnicodeDecodeError as e:
+            print("{:>12}: failed ({})".format(name, e))
+            continue
+        print("{:>12}: {:>8} lines in {:.3f}s, {:>10.0f} lines/s".format(name, count, elapsed, count / elapsed))
+
+
+if __name__ == "__main__":
+    main()
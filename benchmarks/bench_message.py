@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Time, memory and allocations of parsing a login burst into LobbyMessage
+objects, before and after making them lazy and slotted.
+
+    python benchmarks/bench_message.py [users]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asyncspring.parser import LobbyMessage  # noqa: E402
+from fixtures import login_burst  # noqa: E402
+
+
+class EagerLobbyMessage:
+    """
+    LobbyMessage as it was: everything split up front, one __dict__ each.
+    """
+
+    @classmethod
+    def from_data(cls, verb, params=None, source=None, tags=None):
+        o = cls()
+        o.verb = verb
+        o.tags = dict()
+        o.source = None
+        o.params = list()
+
+        if params:
+            o.params = params
+
+        if source:
+            o.source = source
+
+        if tags:
+            o.tags.update(**tags)
+
+        return o
+
+    @classmethod
+    def from_message(cls, message):
+        s = message.split(' ')
+
+        tags = None
+        if s[0].startswith('@'):
+            tag_str = s[0][1:].split(';')
+            s = s[1:]
+            tags = {}
+
+            for tag in tag_str:
+                k, v = tag.split('=', 1)
+                tags[k] = v
+
+        source = "Lobby"
+        if s[0] == 'SAID' or s[0] == 'SAIDEX':
+            source = s[2]
+        elif s[0] == 'SAIDPRIVATE' or s[0] == 'SAIDPRIVATEEX':
+            source = s[1]
+
+        return cls.from_data(s[0].upper(), s[1:], source, tags)
+
+
+def measure(cls, lines):
+    parse = cls.from_message
+
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    kept = [parse(line) for line in lines]
+    blocks = sys.getallocatedblocks() - blocks
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del kept
+    return elapsed, current, peak, blocks
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lines = login_burst(users=users)
+    print("{} lines".format(len(lines)))
+
+    for cls in (EagerLobbyMessage, LobbyMessage):
+        elapsed, current, peak, blocks = measure(cls, lines)
+        print("{:>18}: {:.3f}s ({:>8.0f} lines/s), retained {:>6.1f} MiB, peak {:>6.1f} MiB, {:>5.1f} blocks/message".format(
+            cls.__name__, elapsed, len(lines) / elapsed, current / 2 ** 20, peak / 2 ** 20, blocks / len(lines)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Compare the say* chunking by character count with encoder.chunks on long
+pasted texts.
+
+    python benchmarks/bench_splitter.py [texts] [words per text]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asyncspring import encoder  # noqa: E402
+from fixtures import pastes  # noqa: E402
+
+
+def by_characters(channel, message):
+    """
+    The chunking previously done in LobbyProtocol.say.
+    """
+
+    lines = []
+    message = message.replace("\n", " ").replace("\r", " ")
+    while message:
+        lines.append("SAY {} {}\r\n".format(channel, message[:400]).encode("utf-8"))
+        message = message[400:]
+    return lines
+
+
+def by_bytes(channel, message):
+    message = message.replace("\n", " ").replace("\r", " ")
+    prefix = encoder.verb("SAY") + channel.encode("utf-8") + b" "
+    return list(encoder.chunks(prefix, message))
+
+
+def run(split, texts):
+    lines = over = 0
+    start = time.perf_counter()
+    for text in texts:
+        chunks = split("main", text)
+        lines += len(chunks)
+    elapsed = time.perf_counter() - start
+    for text in texts:
+        over += sum(len(chunk) - len("SAY main \r\n") > encoder.MAX_MESSAGE for chunk in split("main", text))
+    return lines, over, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    words = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    texts = pastes(count, words)
+    size = sum(len(text.encode("utf-8")) for text in texts)
+    print("{} texts, {} bytes".format(len(texts), size))
+
+    for name, split in (("characters", by_characters), ("bytes", by_bytes)):
+        lines, over, elapsed = run(split, texts)
+        print("{:>10}: {:>7} lines in {:.3f}s, {:>8.1f} MB/s, {} lines over {} bytes".format(
+            name, lines, elapsed, size / elapsed / 1e6, over, encoder.MAX_MESSAGE))
+
+
+if __name__ == "__main__":
+    main()
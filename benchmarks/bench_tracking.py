@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Scaling of the tracking plugin's registry: the old flat set of
+(user, channel) pairs against the user/channel indexes.
+
+    python benchmarks/bench_tracking.py [users] [channels] [channels per user]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asyncspring.plugins.tracking import Registry  # noqa: E402
+
+
+class SetRegistry:
+    """
+    The registry operations as they were done on the mappings set.
+    """
+
+    def __init__(self):
+        self.mappings = set()
+
+    def add(self, nick, channel):
+        self.mappings.add((nick, channel))
+
+    def channels_of(self, nick):
+        return list(map(lambda x: x[1], filter(lambda x: x[0] == nick, self.mappings)))
+
+    def users_of(self, channel):
+        return list(map(lambda x: x[0], filter(lambda x: x[1] == channel, self.mappings)))
+
+    def remove_user(self, nick):
+        for channel in set(self.channels_of(nick)):
+            self.mappings.remove((nick, channel))
+
+    def rename(self, old_nick, new_nick):
+        for i in set(self.mappings):
+            if i[0] == old_nick:
+                self.mappings.discard(i)
+                self.mappings.add((new_nick, i[1]))
+
+
+class IndexedRegistry(Registry):
+    def channels_of(self, nick):
+        return list(self.user_channels.get(nick, ()))
+
+    def users_of(self, channel):
+        return list(self.channel_users.get(channel, ()))
+
+
+def timed(label, count, f):
+    start = time.perf_counter()
+    f()
+    elapsed = time.perf_counter() - start
+    print("    {:<20} {:>10.1f} us/op".format(label, elapsed / count * 1e6))
+
+
+def run(registry, pairs, ops):
+    rnd = random.Random(5)
+    for nick, channel in pairs:
+        registry.add(nick, channel)
+
+    nicks = sorted({nick for nick, channel in pairs})
+    channels = sorted({channel for nick, channel in pairs})
+    sample = rnd.sample(nicks, ops)
+
+    timed("user channels", ops, lambda: [registry.channels_of(nick) for nick in sample])
+    timed("channel users", ops, lambda: [registry.users_of(rnd.choice(channels)) for _ in range(ops)])
+    timed("rename", ops, lambda: [registry.rename(nick, nick + "_") for nick in sample])
+    timed("quit", ops, lambda: [registry.remove_user(nick + "_") for nick in sample])
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    per_user = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    rnd = random.Random(4)
+    pairs = [("user{}".format(u), "#ch{}".format(c))
+             for u in range(users) for c in rnd.sample(range(channels), per_user)]
+    print("{} users x {} channels, {} memberships".format(users, channels, len(pairs)))
+
+    for cls, ops in ((SetRegistry, 20), (IndexedRegistry, 2000)):
+        print("  {}:".format(cls.__name__))
+        run(cls(), pairs, ops)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Deterministic SpringRTS Lobby traffic used by the benchmarks.
+"""
+
+import random
+
+COUNTRIES = ["US", "DE", "FR", "RU", "BR", "PL", "SE", "FI", "ES", "CN", "??"]
+LOBBIES = ["SpringLobby 0.270 (win x32)", "Chobby", "skylobby 0.9.1", "weblobby 2.1"]
+TITLES = ["1v1 no noobs", "Ñoño's team game", "☃ winter FFA ☃", "Быстрая игра", "観戦歓迎"]
+MAPS = ["DeltaSiegeDry", "Comet Catcher Redux", "Tabula-v4", "Throne Acidic"]
+
+
+def login_burst(users=20000, battles=500, seed=1):
+    """
+    Return the lines a server sends right after ACCEPTED.
+    """
+
+    rnd = random.Random(seed)
+    lines = ["TASSERVER 0.38-33-ga5f3b28 * 8201 0", "ACCEPTED benchbot", "MOTD Welcome to the bench lobby"]
+
+    names = ["user{}".format(i) for i in range(users)]
+    for i, name in enumerate(names):
+        lines.append("ADDUSER {} {} {} {}".format(name, rnd.choice(COUNTRIES), i, rnd.choice(LOBBIES)))
+
+    for battle_id in range(battles):
+        founder = names[battle_id % users]
+        lines.append("BATTLEOPENED {} 0 0 {} 127.0.0.1 8452 16 0 0 {} Spring\t104.0\t{}\t{}\tBalanced Annihilation\t__battle__{}".format(
+            battle_id, founder, rnd.getrandbits(31), rnd.choice(MAPS), rnd.choice(TITLES), battle_id))
+        lines.append("UPDATEBATTLEINFO {} 0 0 {} {}".format(battle_id, rnd.getrandbits(31), rnd.choice(MAPS)))
+
+    for name in names[battles:]:
+        if rnd.random() < 0.3:
+            lines.append("JOINEDBATTLE {} {}".format(rnd.randrange(battles), name))
+
+    for name in names:
+        lines.append("CLIENTSTATUS {} {}".format(name, rnd.getrandbits(7)))
+
+    lines.append("LOGININFOEND")
+    return lines
+
+
+def chat_flood(messages=50000, channels=20, users=500, seed=2):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(messages):
+        text = " ".join(rnd.choice(TITLES + MAPS) for _ in range(rnd.randrange(1, 12)))
+        lines.append("SAID ch{} user{} {}".format(rnd.randrange(channels), rnd.randrange(users), text))
+    return lines
+
+
+def status_storm(updates=100000, users=20000, seed=3):
+    rnd = random.Random(seed)
+    return ["CLIENTSTATUS user{} {}".format(rnd.randrange(users), rnd.getrandbits(7)) for _ in range(updates)]
+
+
+def pastes(count=200, words=2000, seed=4):
+    """
+    Long relayed texts, mixing ASCII with multibyte words and runs without
+    spaces (URLs, base64).
+    """
+
+    rnd = random.Random(seed)
+    vocabulary = TITLES + MAPS + ["https://springrts.com/wiki/Lobby_Protocol?" + "x" * 300, "=" * 500]
+    return [" ".join(rnd.choice(vocabulary) for _ in range(rnd.randrange(words // 2, words)))
+            for _ in range(count)]
+
+
+def to_wire(lines):
+    return "".join(line + "\n" for line in lines).encode("utf-8")
+
+
+def chunked(data, size=4096):
+    """
+    Split wire data into fixed size reads, like a TCP stream would.
+    """
+
+    return [data[i:i + size] for i in range(0, len(data), size)]
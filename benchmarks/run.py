@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Benchmarks of the parse -> dispatch -> reply hot path over the fixtures:
+login bursts, chat floods, status storms and long pasted texts.
+
+For every case it reports lines per second, p50/p99 latency per line,
+memory allocated per line (traced by tracemalloc), garbage collections and
+the process RSS. Results can be saved as JSON and compared with an earlier
+run, typically of another commit:
+
+    python benchmarks/run.py --save                   # benchmarks/results/<commit>.json
+    python benchmarks/run.py --compare benchmarks/results/abc1234.json
+    python benchmarks/run.py --cases parse,dispatch --scale 0.1
+
+With --compare, the exit status is 1 when a case got slower than the
+threshold allows, so it can gate a deploy.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asyncspring.events import EventBus  # noqa: E402
+from asyncspring.parser import LobbyMessage  # noqa: E402
+from asyncspring.plugins import core  # noqa: E402
+from asyncspring.plugins import state  # noqa: E402
+from asyncspring.protocol import LobbyProtocol  # noqa: E402
+from asyncspring.sendqueue import SendQueue, TokenBucket  # noqa: E402
+from fixtures import login_burst, chat_flood, status_storm, pastes  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(HERE, "results")
+
+# metric -> True when bigger is better
+METRICS = {
+    "lines_per_sec": True,
+    "p50_us": False,
+    "p99_us": False,
+    "alloc_bytes_per_line": False,
+}
+
+
+class Client:
+    """
+    What the core plugin handlers need of a connection.
+    """
+
+    netid = "bench"
+    nickname = "benchbot"
+    bot_username = "benchbot"
+    flood_class = "user"
+
+    def __init__(self):
+        self.events = EventBus()
+        self.lobby_state = state.LobbyState()
+
+
+class Transport:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def writelines(self, chunks):
+        for data in chunks:
+            self.written += len(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def is_closing(self):
+        return False
+
+
+def unlimited_protocol():
+    protocol = LobbyProtocol("benchbot", "benchbot")
+    protocol.queue = SendQueue(byte_bucket=TokenBucket(float("inf"), float("inf")))
+    protocol.connection_made(Transport())
+    return protocol
+
+
+def fixture(name, scale):
+    if name == "burst":
+        return login_burst(users=int(20000 * scale), battles=max(1, int(500 * scale)))
+    if name == "chat":
+        return chat_flood(messages=int(50000 * scale))
+    if name == "status":
+        return status_storm(updates=int(100000 * scale), users=int(20000 * scale))
+    if name == "paste":
+        return pastes(count=max(1, int(200 * scale)))
+    raise KeyError(name)
+
+
+## cases: each returns (lines, step), where step(line) handles one line
+
+def case_parse(scale):
+    lines = fixture("burst", scale) + fixture("chat", scale)
+
+    def step(line):
+        message = LobbyMessage.from_message(line)
+        message.args
+
+    return lines, step
+
+
+def case_dispatch(scale):
+    # ACCEPTED would start logging in and pinging
+    burst = [line for line in fixture("burst", scale) if not line.startswith("ACCEPTED")]
+    lines = burst + fixture("chat", scale) + fixture("status", scale)
+    client = Client()
+    redispatch = core._redispatch_raw
+
+    def on_said(message, user, target, text):
+        pass
+
+    client.events.signal("said").connect(on_said, weak=False)
+
+    def step(line):
+        redispatch(client, line)
+
+    return lines, step
+
+
+def case_reply(scale):
+    lines = fixture("chat", scale)
+    client = Client()
+    protocol = unlimited_protocol()
+    redispatch = core._redispatch_raw
+
+    def on_said(message, user, target, text):
+        protocol.writeln("SAY {} {}: {}".format(target, user, text[:64]))
+        protocol.process_queue()
+
+    client.events.signal("said").connect(on_said, weak=False)
+
+    def step(line):
+        redispatch(client, line)
+
+    return lines, step
+
+
+def case_writeln(scale):
+    lines = ["SAY main {}".format(line) for line in fixture("chat", scale)]
+    protocol = unlimited_protocol()
+
+    def step(line):
+        protocol.writeln(line)
+        if len(protocol.queue) >= 64:
+            protocol.process_queue()
+
+    return lines, step
+
+
+def case_say(scale):
+    lines = [" ".join([line] * 8) for line in fixture("chat", scale * 0.2)]
+    protocol = unlimited_protocol()
+
+    def step(line):
+        protocol.say("main", line)
+        protocol.queue.clear()
+
+    return lines, step
+
+
+def case_paste(scale):
+    lines = fixture("paste", scale)
+    protocol = unlimited_protocol()
+
+    def step(line):
+        protocol.say_from("relayed", "irc", "main", line)
+        protocol.queue.clear()
+
+    return lines, step
+
+
+CASES = {
+    "parse": case_parse,
+    "dispatch": case_dispatch,
+    "reply": case_reply,
+    "writeln": case_writeln,
+    "say": case_say,
+    "paste": case_paste,
+}
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def rss_kib():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+def measure(name, scale, repeat):
+    best = None
+    for _ in range(repeat):
+        lines, step = CASES[name](scale)
+
+        # throughput
+        gc.collect()
+        collections = sum(stat["collections"] for stat in gc.get_stats())
+        start = time.perf_counter()
+        for line in lines:
+            step(line)
+        elapsed = time.perf_counter() - start
+        collections = sum(stat["collections"] for stat in gc.get_stats()) - collections
+
+        if best is None or elapsed < best[0]:
+            best = (elapsed, collections, len(lines))
+
+    elapsed, collections, count = best
+
+    # latency per line, on a fresh run
+    lines, step = CASES[name](scale)
+    clock = time.perf_counter_ns
+    latencies = []
+    for line in lines:
+        start = clock()
+        step(line)
+        latencies.append(clock() - start)
+    latencies.sort()
+
+    # memory, on a fresh run
+    lines, step = CASES[name](scale)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    allocated = 0
+    for line in lines:
+        step(line)
+        current, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+        tracemalloc.reset_peak()
+        before = current
+    tracemalloc.stop()
+
+    return {
+        "lines": count,
+        "seconds": elapsed,
+        "lines_per_sec": count / elapsed,
+        "p50_us": percentile(latencies, 0.5) / 1000,
+        "p99_us": percentile(latencies, 0.99) / 1000,
+        "alloc_bytes_per_line": allocated / len(lines),
+        "gc_collections": collections,
+        "rss_kib": rss_kib(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report(results):
+    print("{:<10} {:>9} {:>12} {:>9} {:>9} {:>12} {:>6} {:>10}".format(
+        "case", "lines", "lines/s", "p50 us", "p99 us", "alloc B/line", "gc", "rss KiB"))
+    for name, result in results.items():
+        print("{:<10} {:>9} {:>12.0f} {:>9.2f} {:>9.2f} {:>12.1f} {:>6} {:>10}".format(
+            name, result["lines"], result["lines_per_sec"], result["p50_us"], result["p99_us"],
+            result["alloc_bytes_per_line"], result["gc_collections"], result["rss_kib"]))
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every metric against baseline and return the
+    regressions beyond threshold (a fraction).
+    """
+
+    regressions = []
+    print()
+    print("against {} ({}):".format(baseline["revision"], baseline["date"]))
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        changes = []
+        for metric, higher_is_better in METRICS.items():
+            if not old[metric]:
+                continue
+            change = result[metric] / old[metric] - 1
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = " !"
+                regressions.append((name, metric, change))
+            changes.append("{} {:+.1%}{}".format(metric, change, flag))
+        print("  {:<10} {}".format(name, ", ".join(changes)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated, from: " + ", ".join(CASES))
+    parser.add_argument("--scale", type=float, default=1.0, help="fixture size multiplier")
+    parser.add_argument("--repeat", type=int, default=3, help="throughput runs, the best is kept")
+    parser.add_argument("--save", nargs="?", const="", default=None, metavar="PATH",
+                        help="save results as JSON (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", metavar="PATH", help="compare with saved results")
+    parser.add_argument("--threshold", type=float, default=0.10, help="regression threshold (default 0.10)")
+    args = parser.parse_args()
+
+    # the protocol needs an event loop to attach its flusher to
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    results = {}
+    for name in args.cases.split(","):
+        results[name] = measure(name, args.scale, args.repeat)
+
+    revision = git_revision()
+    report(results)
+
+    document = {
+        "revision": revision,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "results": results,
+    }
+
+    if args.save is not None:
+        path = args.save or os.path.join(RESULTS, "{}.json".format(revision))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+        print("saved to {}".format(path))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != args.scale:
+            print("warning: baseline was run with --scale {}".format(baseline.get("scale")))
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
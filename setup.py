@@ -18,6 +18,10 @@ setuptools.setup(
         "ruamel.yaml"
     ],
 
+    extras_require={
+        "numpy": ["numpy"],
+    },
+
     classifiers=[
         "Development Status :: 1 - Beta",
         'License :: MIT License (MIT)',